@@ -49,8 +49,8 @@ def get_rules() -> Dict:
 
     :return json_response: dict of rules
     """
-    response = requests.get(
-        "https://api.twitter.com/2/tweets/search/stream/rules", auth=bearer_oauth
+    response = st.client.get(
+        f"{st.API_BASE}/2/tweets/search/stream/rules", auth=bearer_oauth
     )
     if response.status_code != 200:
         raise Exception(
@@ -71,8 +71,8 @@ def delete_all_rules(rules: Dict) -> None:
 
     ids = list(map(lambda rule: rule["id"], rules["data"]))
     payload = {"delete": {"ids": ids}}
-    response = requests.post(
-        "https://api.twitter.com/2/tweets/search/stream/rules",
+    response = st.client.post(
+        f"{st.API_BASE}/2/tweets/search/stream/rules",
         auth=bearer_oauth,
         json=payload
     )
@@ -104,29 +104,10 @@ def set_rules() -> None:
     for rule in my_rules:
         rules.append(
             {"value": rule, "tag": tags[my_rules.index(rule)]})
-    logging.info(("ADDED RULES USED:\n", rules))
+    logging.info(("RULES USED:\n", rules))
 
-    response = requests.get(
-        "https://api.twitter.com/2/tweets/search/stream/rules", auth=bearer_oauth
-    )
-    axel_rules: Dict = get_rules()
-    if response.status_code != 200:
-        delete_all_rules(axel_rules)
-        logging.warning("Reconnecting to the stream...")
-        params.recount += 1
-
-    payload: Dict = {"add": rules}
-    response = requests.post(
-        "https://api.twitter.com/2/tweets/search/stream/rules",
-        auth=bearer_oauth,
-        json=payload,
-    )
-    if response.status_code != 201:
-        raise Exception(
-            "Cannot add rules (HTTP {}): {}".format(
-                response.status_code, response.text)
-        )
-    logging.info(json.dumps(response.json()))
+    # only the rules that changed are added or deleted
+    st.sync_rules()
 
 
 # UPDATE CURRENT STREAM RULES
@@ -137,7 +118,6 @@ def update_rules() -> None:
     config = params.get_config()
 
     if config.update_flag == True:
-        delete_all_rules(get_rules())
         set_rules()
         config.update_flag = False
         logging.info("CONFIG CHECK COMPLETE\n")
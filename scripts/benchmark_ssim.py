@@ -0,0 +1,57 @@
+import argparse
+import time
+
+import numpy as np
+from skimage.metrics import structural_similarity as ssim
+
+from utils import ssim_tools as sst
+
+'''
+Standalone file to check the batched SSIM engine against skimage and measure its speed-up
+Scores one pfp against N references both ways, asserts the similarities agree and prints the timings:
+    python -m scripts.benchmark_ssim
+    python -m scripts.benchmark_ssim --size 128 --counts 1 10 100 1000
+'''
+
+
+def _best_of(repeats: int, fn) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched SSIM against skimage")
+    parser.add_argument("--size", type=int, default=64, help="the side of the compared images")
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 5, 25, 100, 500, 2000],
+                        help="the numbers of references to score the pfp against")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=1e-9)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    pfp = rng.integers(0, 256, (args.size, args.size), dtype=np.uint8)
+    # references ranging from the pfp itself to unrelated noise
+    noise = rng.integers(0, 256, (max(args.counts), args.size, args.size), dtype=np.uint8)
+    mix = np.linspace(0, 1, len(noise))[:, None, None]
+    references = (pfp * (1 - mix) + noise * mix).astype(np.uint8)
+
+    print(f"{'N':>6} {'skimage ms':>11} {'batched ms':>11} {'speed-up':>9} {'max diff':>10}")
+    for count in args.counts:
+        stack = references[:count]
+        expected = np.array([ssim(pfp, reference, data_range=255) for reference in stack])
+        got = sst.structural_similarity(pfp, stack)
+        diff = float(np.abs(got - expected).max())
+        assert diff <= args.tolerance, f"Batched SSIM differs from skimage by {diff} for N={count}"
+
+        skimage_seconds = _best_of(args.repeats, lambda: [ssim(pfp, reference, data_range=255) for reference in stack])
+        batched_seconds = _best_of(args.repeats, lambda: sst.structural_similarity(pfp, stack))
+        print(f"{count:>6} {skimage_seconds * 1000:>11.2f} {batched_seconds * 1000:>11.2f} "
+              f"{skimage_seconds / batched_seconds:>8.1f}x {diff:>10.1e}")
+
+
+main()
@@ -0,0 +1,36 @@
+import argparse
+from utils import hash_tools as hst
+from utils import reference_tools as rft
+from utils.config import Config
+
+'''
+Standalone file to preprocess the collection reference images into the reference and hash indexes
+The stream builds a missing or out of date index on startup - run this first to keep that off the startup path:
+    python -m scripts.build_reference_index
+    python -m scripts.build_reference_index --collection y00ts --force
+'''
+
+
+def main():
+    config = Config()
+    parser = argparse.ArgumentParser(description="Build the pfp matching reference indexes")
+    parser.add_argument("--collection", action="append", default=[],
+                        help="only build this collection (repeatable) - defaults to every reference folder")
+    parser.add_argument("--index-dir", default=config.reference_index_dir)
+    parser.add_argument("--size", type=int, default=config.reference_size)
+    parser.add_argument("--hash", default=config.pfp_hash, choices=sorted(hst.HASHES))
+    parser.add_argument("--force", action="store_true", help="rebuild even if the index is up to date")
+    args = parser.parse_args()
+
+    folders = {collection: folder_path for collection, folder_path in config.reference_folders.items()
+               if not args.collection or collection in args.collection}
+    for collection, folder_path in folders.items():
+        if args.force:
+            index = rft.ReferenceIndex.build(collection, folder_path, args.index_dir, args.size)
+        else:
+            index = rft.ReferenceIndex.open(collection, folder_path, args.index_dir, args.size)
+        hashes = hst.HashIndex.open(index, args.hash)
+        print(f"{collection}: {len(index)} references in {index.path}, {len(hashes)} {args.hash} hashes")
+
+
+main()
@@ -0,0 +1,21 @@
+import argparse
+import stream
+
+'''
+Standalone file to replay a recorded stream through the processing pipeline
+Record a stream first by setting record_path in the config, then run:
+    python -m scripts.replay_stream outputs/stream.jsonl.gz --speed 10
+A speed of 0 replays as fast as possible and reports the tweets/sec throughput
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded twitter stream")
+    parser.add_argument("path", help="gzipped stream recording")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="1 for real time, N for N x real time, 0 for as fast as possible")
+    args = parser.parse_args()
+    stream.replay_stream(args.path, args.speed)
+
+
+main()
@@ -0,0 +1,509 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+logging.basicConfig(level=logging.INFO)
+
+'''
+Standalone stand-in for the Twitter API v2 endpoints this project uses, for offline load testing - serves:
+    - The filtered stream at a configurable tweet emission rate, with keep-alive heartbeats
+    - Stream rules (get, add, delete and dry_run)
+    - Tweet lookup by ID(s), user lookup by IDs/usernames and paginated user timelines
+    - Profile images (with ETag/304) - optionally copies of the collection reference images
+    - Injected latency, 429s with rate limit reset headers, 5xx errors and stream stalls
+
+Run it, then point the pipeline at it through the base url setting:
+    python standalone_utils/fake_twitter_api.py --port 8080 --rate 50 --error-429 0.01
+    TWITTER_API_BASE=http://127.0.0.1:8080 TWITTER_BEARER_TOKEN=fake python stream.py
+'''
+
+RATE_LIMIT_WINDOW = 15 * 60
+WORDS = ("gm", "wagmi", "y00ts", "degods", "floor", "mint", "pfp", "holders", "alpha", "ser", "ngmi", "lfg")
+
+
+def iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def parse_time(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class FakeTwitter:
+    """
+    In-memory state of the fake API: users, their tweets and the stream rules
+
+    :param users: the number of fake users
+    :param base_url: the url the server is reachable at (used in profile image urls)
+    :param pfp_folders: reference image folders whose images are served as pfps of some users
+    :param holder_rate: the fraction of users whose pfp is a reference image
+    :param days: the number of days of timeline generated per user
+    :param seed: random seed for reproducible data
+    """
+
+    def __init__(self, users: int, base_url: str, pfp_folders: List[str], holder_rate: float, days: int, seed: int):
+        self.base_url = base_url
+        self.days = days
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.rules: Dict[str, Dict[str, str]] = {}
+        self.next_rule_id = 1
+        self.tweets: Dict[str, Dict] = {}
+        self.timelines: Dict[str, List[str]] = {}
+        self.sequence = 0
+        references = [os.path.join(folder, f) for folder in pfp_folders
+                      for f in sorted(os.listdir(folder)) if f.endswith((".png", ".jpg"))]
+        self.users: Dict[str, Dict] = {}
+        self.pfp_files: Dict[str, str] = {}
+        for i in range(users):
+            user_id = str(1_000_000 + i)
+            self.users[user_id] = {
+                "id": user_id,
+                "username": f"user{i}",
+                "name": f"User {i}",
+                "profile_image_url": f"{base_url}/profile_images/{user_id}/avatar_normal.png",
+                "description": " ".join(self.random.choices(WORDS, k=6)),
+                "url": f"https://example.com/{i}" if self.random.random() < 0.5 else "",
+                "public_metrics": {"followers_count": int(self.random.paretovariate(1.2) * 50),
+                                   "following_count": self.random.randint(0, 2000),
+                                   "tweet_count": self.random.randint(0, 50000),
+                                   "listed_count": self.random.randint(0, 100)},
+            }
+            if references and self.random.random() < holder_rate:
+                self.pfp_files[user_id] = self.random.choice(references)
+        self.by_username = {user["username"].lower(): user for user in self.users.values()}
+
+    def _tweet_id(self, created_at: float) -> str:
+        # snowflake-like: increases with creation time
+        self.sequence = (self.sequence + 1) % 4096
+        return str((int(created_at * 1000) << 12) | self.sequence)
+
+    def _new_tweet(self, author_id: str, created_at: float) -> Dict:
+        age_hours = max(0.0, (time.time() - created_at) / 3600)
+        likes = int(self.random.expovariate(1 / 5) * (1 + age_hours) ** 0.3)
+        mentioned = self.random.sample(list(self.users), k=min(len(self.users), self.random.randint(0, 2)))
+        tweet = {
+            "id": self._tweet_id(created_at),
+            "author_id": author_id,
+            "created_at": iso(created_at),
+            "text": " ".join(self.random.choices(WORDS, k=8) + [f"@{self.users[m]['username']}" for m in mentioned]),
+            "entities": {"mentions": [{"username": self.users[m]["username"], "id": m} for m in mentioned]},
+            "public_metrics": {"like_count": likes, "retweet_count": likes // 5, "reply_count": likes // 8,
+                               "quote_count": likes // 20, "impression_count": likes * 40 + self.random.randint(0, 100)},
+        }
+        self.tweets[tweet["id"]] = tweet
+        return tweet
+
+    def timeline(self, user_id: str) -> List[str]:
+        """
+        Tweet IDs of a user, newest first - generated over the last days on first use
+        """
+        with self.lock:
+            if user_id not in self.timelines:
+                now = time.time()
+                count = self.random.randint(0, 300)
+                created = sorted(now - self.random.random() * self.days * 86400 for _ in range(count))
+                self.timelines[user_id] = [self._new_tweet(user_id, t)["id"] for t in reversed(created)]
+            return self.timelines[user_id]
+
+    def emit(self) -> Dict:
+        """
+        A new tweet for the stream, in the stream payload shape with its expansions
+        """
+        with self.lock:
+            author_id = self.random.choice(list(self.users))
+            tweet = self._new_tweet(author_id, time.time())
+            if author_id in self.timelines:
+                self.timelines[author_id].insert(0, tweet["id"])
+            rules = list(self.rules.values()) or [{"id": "0", "tag": "untagged"}]
+            payload = self.expand([tweet])
+            payload["data"] = tweet
+            payload["matching_rules"] = [{"id": rule["id"], "tag": rule["tag"]}
+                                         for rule in self.random.sample(rules, k=1)]
+            return payload
+
+    def expand(self, tweets: List[Dict]) -> Dict:
+        """
+        The includes of tweets: their author and mentioned users
+        """
+        users = {}
+        for tweet in tweets:
+            users[tweet["author_id"]] = self.users[tweet["author_id"]]
+            for mention in tweet["entities"]["mentions"]:
+                users[mention["id"]] = self.users[mention["id"]]
+        return {"includes": {"users": list(users.values())}}
+
+    def pfp(self, user_id: str) -> bytes:
+        """
+        The profile image of a user - a reference image copy for holders, generated otherwise
+        """
+        if user_id in self.pfp_files:
+            with open(self.pfp_files[user_id], "rb") as file:
+                return file.read()
+        seed = int(hashlib.sha256(user_id.encode()).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+        img = Image.new("RGB", (48, 48), tuple(rng.randint(0, 255) for _ in range(3)))
+        for _ in range(20):
+            x, y = rng.randint(0, 40), rng.randint(0, 40)
+            img.paste(tuple(rng.randint(0, 255) for _ in range(3)), (x, y, x + 8, y + 8))
+        buffer = BytesIO()
+        img.save(buffer, "PNG")
+        return buffer.getvalue()
+
+
+class Faults:
+    """
+    Injected latency and errors
+
+    :param latency: mean added seconds per response
+    :param jitter: max extra random seconds per response
+    :param error_429: fraction of API calls answered with 429 until the next window
+    :param error_5xx: fraction of API calls answered with a 503
+    :param stall_rate: chance per second of the stream going silent (no data, no heartbeat)
+    :param stall_seconds: how long a stream stall lasts
+    :param rate_limit: calls allowed per endpoint per 15 minute window - reported in the headers and
+        answered with 429 once spent
+    """
+
+    def __init__(self, latency: float, jitter: float, error_429: float, error_5xx: float,
+                 stall_rate: float, stall_seconds: float, rate_limit: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.rate_limit = rate_limit
+        self.lock = threading.Lock()
+        self.windows: Dict[str, Tuple[float, int]] = {}
+
+    def _window(self, endpoint: str) -> Tuple[float, int]:
+        now = time.time()
+        reset_at, used = self.windows.get(endpoint, (now + RATE_LIMIT_WINDOW, 0))
+        if now >= reset_at:
+            reset_at, used = now + RATE_LIMIT_WINDOW, 0
+        return reset_at, used
+
+    def remaining(self, endpoint: str) -> int:
+        """
+        Calls left in the endpoint window, without taking one
+        """
+        with self.lock:
+            return max(0, self.rate_limit - self._window(endpoint)[1])
+
+    def budget(self, endpoint: str, exhaust: bool = False) -> Tuple[int, int, int]:
+        """
+        Take one call from the endpoint window
+
+        return: limit, remaining and reset epoch seconds for the rate limit headers
+        """
+        with self.lock:
+            reset_at, used = self._window(endpoint)
+            used = self.rate_limit if exhaust else used + 1
+            self.windows[endpoint] = (reset_at, used)
+            return self.rate_limit, max(0, self.rate_limit - used), int(reset_at)
+
+    def delay(self) -> None:
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.random() * self.jitter)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    api: FakeTwitter
+    faults: Faults
+    emission_rate: float
+    heartbeat: float
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    # RESPONSES
+    def _send(self, status: int, body: bytes, content_type: str = "application/json",
+              headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status: int, payload: Dict, endpoint: str) -> None:
+        limit, remaining, reset_at = self.faults.budget(endpoint)
+        self._send(status, json.dumps(payload).encode(), headers={
+            "x-rate-limit-limit": str(limit), "x-rate-limit-remaining": str(remaining),
+            "x-rate-limit-reset": str(reset_at)})
+
+    def _injected_error(self, endpoint: str) -> bool:
+        """
+        Answer with a 429 once the endpoint window is spent, or an injected 429 or 5xx, instead of the real response
+        """
+        if self.faults.remaining(endpoint) == 0 or random.random() < self.faults.error_429:
+            limit, _, reset_at = self.faults.budget(endpoint, exhaust=True)
+            self._send(429, json.dumps({"title": "Too Many Requests", "status": 429}).encode(), headers={
+                "x-rate-limit-limit": str(limit), "x-rate-limit-remaining": "0",
+                "x-rate-limit-reset": str(reset_at)})
+            return True
+        if random.random() < self.faults.error_5xx:
+            self._send(503, json.dumps({"title": "Service Unavailable", "status": 503}).encode())
+            return True
+        return False
+
+    def _fields(self, tweet: Dict, query: Dict[str, List[str]]) -> Dict:
+        """
+        Only the tweet fields that were asked for, like the real API - which also returns the
+        fields an expansion is made from (author_id, entities...)
+        """
+        wanted = set(query.get("tweet.fields", [""])[0].split(",")) | {"id", "text"}
+        wanted |= {expansion.split(".")[0] for expansion in query.get("expansions", [""])[0].split(",")}
+        return {key: value for key, value in tweet.items() if key in wanted}
+
+    def _user(self, user: Dict, query: Dict[str, List[str]]) -> Dict:
+        wanted = set(query.get("user.fields", [""])[0].split(",")) | {"id", "username", "name"}
+        return {key: value for key, value in user.items() if key in wanted and value != ""}
+
+    def _tweet_lookup(self, ids: List[str], query: Dict[str, List[str]]) -> Dict:
+        found = [self.api.tweets[tweet_id] for tweet_id in ids if tweet_id in self.api.tweets]
+        payload: Dict = {"data": [self._fields(tweet, query) for tweet in found]}
+        if "expansions" in query:
+            payload["includes"] = {"users": [self._user(user, query)
+                                             for user in self.api.expand(found)["includes"]["users"]]}
+        errors = [{"value": tweet_id, "resource_id": tweet_id, "resource_type": "tweet",
+                   "title": "Not Found Error", "detail": f"Could not find tweet with ids: [{tweet_id}]."}
+                  for tweet_id in ids if tweet_id not in self.api.tweets]
+        if errors:
+            payload["errors"] = errors
+        return payload
+
+    def _user_lookup(self, users: List[Optional[Dict]], keys: List[str], query: Dict[str, List[str]]) -> Dict:
+        payload: Dict = {"data": [self._user(user, query) for user in users if user is not None]}
+        errors = [{"value": key, "resource_id": key, "resource_type": "user", "title": "Not Found Error"}
+                  for key, user in zip(keys, users) if user is None]
+        if errors:
+            payload["errors"] = errors
+        return payload
+
+    def _timeline(self, user_id: str, query: Dict[str, List[str]]) -> Dict:
+        tweet_ids = self.api.timeline(user_id)
+        since_id = query.get("since_id", [None])[0]
+        start_time = query.get("start_time", [None])[0]
+        selected = [self.api.tweets[tweet_id] for tweet_id in tweet_ids
+                    if (since_id is None or int(tweet_id) > int(since_id))
+                    and (start_time is None or parse_time(self.api.tweets[tweet_id]["created_at"]) >= parse_time(start_time))]
+        max_results = int(query.get("max_results", ["10"])[0])
+        offset = int(query.get("pagination_token", ["0"])[0])
+        page = selected[offset:offset + max_results]
+        meta: Dict = {"result_count": len(page)}
+        if page:
+            meta["newest_id"], meta["oldest_id"] = page[0]["id"], page[-1]["id"]
+        if offset + max_results < len(selected):
+            meta["next_token"] = str(offset + max_results)
+        payload: Dict = {"meta": meta}
+        if page:
+            payload["data"] = [self._fields(tweet, query) for tweet in page]
+        return payload
+
+    # ROUTES
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        path, query = parsed.path.rstrip("/"), parse_qs(parsed.query)
+        if path.startswith("/profile_images/"):
+            return self._profile_image(path.split("/")[2])
+        if path == "/2/tweets/search/stream":
+            return self._stream(query)
+        self.faults.delay()
+        if path == "/2/tweets/search/stream/rules":
+            if not self._injected_error("rules"):
+                self._json(200, {"data": list(self.api.rules.values()),
+                                 "meta": {"result_count": len(self.api.rules)}}, "rules")
+        elif path == "/2/tweets":
+            if not self._injected_error("tweet_lookup"):
+                self._json(200, self._tweet_lookup(query.get("ids", [""])[0].split(","), query), "tweet_lookup")
+        elif path.startswith("/2/tweets/"):
+            if not self._injected_error("tweet_lookup"):
+                payload = self._tweet_lookup([path.split("/")[3]], query)
+                if payload["data"]:
+                    payload["data"] = payload["data"][0]
+                    self._json(200, payload, "tweet_lookup")
+                else:
+                    self._json(200, {"errors": payload["errors"]}, "tweet_lookup")
+        elif path == "/1.1/statuses/show.json":
+            if not self._injected_error("tweet_lookup_v1"):
+                tweet = self.api.tweets.get(query.get("id", [""])[0])
+                if tweet is None:
+                    self._json(404, {"errors": [{"code": 144, "message": "No status found with that ID."}]}, "tweet_lookup_v1")
+                else:
+                    metrics = tweet["public_metrics"]
+                    self._json(200, {"id_str": tweet["id"], "favorite_count": metrics["like_count"],
+                                     "retweet_count": metrics["retweet_count"]}, "tweet_lookup_v1")
+        elif path == "/2/users/by":
+            if not self._injected_error("user_lookup"):
+                usernames = query.get("usernames", [""])[0].split(",")
+                users = [self.api.by_username.get(name.lower()) for name in usernames]
+                self._json(200, self._user_lookup(users, usernames, query), "user_lookup")
+        elif path.startswith("/2/users/by/username/"):
+            if not self._injected_error("user_lookup"):
+                username = path.split("/")[-1]
+                user = self.api.by_username.get(username.lower())
+                payload = self._user_lookup([user], [username], query)
+                self._json(200, {"data": payload["data"][0]} if user else payload, "user_lookup")
+        elif path == "/2/users":
+            if not self._injected_error("user_lookup"):
+                ids = query.get("ids", [""])[0].split(",")
+                self._json(200, self._user_lookup([self.api.users.get(i) for i in ids], ids, query), "user_lookup")
+        elif path.startswith("/2/users/") and path.endswith("/tweets"):
+            if not self._injected_error("user_timeline"):
+                user_id = path.split("/")[3]
+                if user_id in self.api.users:
+                    self._json(200, self._timeline(user_id, query), "user_timeline")
+                else:
+                    self._json(404, {"title": "Not Found Error"}, "user_timeline")
+        elif path.startswith("/2/users/"):
+            if not self._injected_error("user_lookup"):
+                user = self.api.users.get(path.split("/")[3])
+                payload = self._user_lookup([user], [path.split("/")[3]], query)
+                self._json(200, {"data": payload["data"][0]} if user else payload, "user_lookup")
+        else:
+            self._json(404, {"title": "Not Found"}, "other")
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.faults.delay()
+        if parsed.path.rstrip("/") != "/2/tweets/search/stream/rules":
+            return self._json(404, {"title": "Not Found"}, "other")
+        if self._injected_error("rules"):
+            return
+        dry_run = query.get("dry_run", ["false"])[0] == "true"
+        with self.api.lock:
+            if "add" in body:
+                # like the real API: a value that is already a rule (or repeated in the payload) is not created
+                values = {rule["value"]: rule["id"] for rule in self.api.rules.values()}
+                created, errors = [], []
+                for rule in body["add"]:
+                    if rule["value"] in values:
+                        errors.append({"value": rule["value"], "id": values[rule["value"]], "title": "DuplicateRule",
+                                       "type": "https://api.twitter.com/2/problems/duplicate-rules"})
+                        continue
+                    created.append({"id": str(self.api.next_rule_id), "value": rule["value"], "tag": rule.get("tag", "")})
+                    values[rule["value"]] = created[-1]["id"]
+                    self.api.next_rule_id += 1
+                if not dry_run:
+                    self.api.rules.update({rule["id"]: rule for rule in created})
+                response = {"data": created,
+                            "meta": {"summary": {"created": len(created), "not_created": len(errors)}}}
+                if errors:
+                    response["errors"] = errors
+                return self._json(201 if created else 200, response, "rules")
+            ids = [str(rule_id) for rule_id in body.get("delete", {}).get("ids", [])]
+            deleted = [rule_id for rule_id in ids if rule_id in self.api.rules]
+            if not dry_run:
+                for rule_id in deleted:
+                    del self.api.rules[rule_id]
+            self._json(200, {"meta": {"summary": {"deleted": len(deleted), "not_deleted": len(ids) - len(deleted)}}}, "rules")
+
+    def _profile_image(self, user_id: str) -> None:
+        if user_id not in self.api.users:
+            return self._send(404, b"", "text/plain")
+        self.faults.delay()
+        content = self.api.pfp(user_id)
+        etag = '"' + hashlib.sha256(content).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._send(200, content, "image/png", {"ETag": etag, "Last-Modified": "Mon, 01 May 2023 00:00:00 GMT"})
+
+    def _stream(self, query: Dict[str, List[str]]) -> None:
+        if self._injected_error("stream"):
+            return
+        limit, remaining, reset_at = self.faults.budget("stream")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("x-rate-limit-limit", str(limit))
+        self.send_header("x-rate-limit-remaining", str(remaining))
+        self.send_header("x-rate-limit-reset", str(reset_at))
+        self.end_headers()
+        expanded = "expansions" in query
+        interval = 1 / self.emission_rate if self.emission_rate > 0 else self.heartbeat
+        last_sent = time.monotonic()
+        logging.info(f"Stream connected - emitting {self.emission_rate} tweets/sec")
+        try:
+            while True:
+                if random.random() < self.faults.stall_rate * interval:
+                    logging.info(f"Injecting a {self.faults.stall_seconds}s stream stall")
+                    time.sleep(self.faults.stall_seconds)
+                time.sleep(interval)
+                if self.emission_rate > 0:
+                    payload = self.api.emit()
+                    if expanded:
+                        payload["data"] = self._fields(payload["data"], query)
+                        payload["includes"]["users"] = [self._user(user, query) for user in payload["includes"]["users"]]
+                    else:
+                        payload = {"data": {"id": payload["data"]["id"], "text": payload["data"]["text"]},
+                                   "matching_rules": payload["matching_rules"]}
+                    self._chunk(json.dumps(payload).encode() + b"\r\n")
+                    last_sent = time.monotonic()
+                elif time.monotonic() - last_sent >= self.heartbeat:
+                    self._chunk(b"\r\n")
+                    last_sent = time.monotonic()
+        except (BrokenPipeError, ConnectionResetError):
+            logging.info("Stream client disconnected")
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Twitter API v2 endpoints used by the pipeline")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--rate", type=float, default=10, help="tweets emitted per second on the stream")
+    parser.add_argument("--heartbeat", type=float, default=20, help="seconds between keep-alives when idle")
+    parser.add_argument("--users", type=int, default=1000, help="the number of fake users")
+    parser.add_argument("--days", type=int, default=30, help="days of timeline generated per user")
+    parser.add_argument("--pfp-folder", action="append", default=[],
+                        help="reference image folder served as pfps of holders (repeatable)")
+    parser.add_argument("--holder-rate", type=float, default=0.2, help="fraction of users wearing a reference pfp")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="max random seconds added to every response")
+    parser.add_argument("--error-429", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="fraction of calls answered with 503")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="chance per second of a stream stall")
+    parser.add_argument("--stall-seconds", type=float, default=60, help="length of a stream stall")
+    parser.add_argument("--rate-limit", type=int, default=900, help="calls per endpoint per 15 minute window")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    base_url = f"http://{args.host}:{args.port}"
+    Handler.api = FakeTwitter(args.users, base_url, args.pfp_folder, args.holder_rate, args.days, args.seed)
+    Handler.faults = Faults(args.latency, args.jitter, args.error_429, args.error_5xx,
+                            args.stall_rate, args.stall_seconds, args.rate_limit)
+    Handler.emission_rate = args.rate
+    Handler.heartbeat = args.heartbeat
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    logging.info(f"Fake Twitter API serving {args.users} users on {base_url} - set TWITTER_API_BASE={base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,32 @@
 import json
+import math
 import os
 import pandas as pd
 import requests
 from dotenv import load_dotenv
-import time
 import cv2
 import numpy as np
 from utils import stream_tools as st
 from utils import postgres_tools as pg
 from utils import pfp_check as nft
 from utils import chat_gpt_tools as gpt
+from utils import pipeline_tools as pt
+from utils import connection_tools as ct
+from utils import replay_tools as rt
+from utils import dedupe_tools as dt
+from utils import metrics_tools as mt
+from utils import match_tools as mat
+from utils import verdict_cache_tools as vct
+from utils import log_tools as lt
+from utils import rate_limit_tools as rl
 from utils.config import Config
+from utils.user_tools import UserProfile
 from PIL import Image
-from io import BytesIO
-import random
-from typing import List
+from concurrent.futures import Future
+import queue
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -73,6 +85,21 @@ usersTable = params.aggregated_table_name
 pfpTable = params.pfp_table_name
 newpfpTable = params.new_pfp_table_name
 
+# the leaderboard is read and replaced whole so only one worker may write it at a time
+leaderboard_lock = threading.Lock()
+
+# usernames on the leaderboard, used to prioritise their tweets during spikes
+leaderboard_members = pt.RefreshingSet(
+    lambda: pd.read_sql_table(newpfpTable, engine)["index"].values,
+    params.priority_refresh_interval, name="leaderboard-members")
+
+# process pool comparing pfps against the collections - started by run_pipeline
+pfp_matcher: Optional[mat.PfpMatcher] = None
+verdict_cache: Optional[vct.VerdictCache] = None
+
+# pfps waiting to be shown - OpenCV windows are only drawn by the thread reading the stream
+display_queue: "queue.Queue[Tuple[Image.Image, str]]" = queue.Queue(maxsize=16)
+
 # check if tables exist and create if not
 # pg.check_metrics_table(engine, tweetsTable)
 # pg.check_users_table(engine, usersTable)
@@ -83,337 +110,370 @@ newpfpTable = params.new_pfp_table_name
 
 def display_image(img1: Image, pfp_link: str):
     """
-    Display the image using openCV for similarity comparison
+    Queue the image to be displayed using openCV for similarity comparison (only with params.display_pfps).
+    Called from the enrichment workers - the window itself is drawn by show_queued_images.
 
     :param img1: the image to display
     :param pfp_link: the link for the pfp of the image
     """
-    img1_cv = np.array(img1)
-    img1_cv = cv2.cvtColor(img1_cv, cv2.COLOR_BGR2RGB)
-    img1_cv = cv2.resize(img1_cv, (500, 500))
-    cv2.imshow(f"Image {pfp_link}", img1_cv)
+    if not params.display_pfps:
+        return
+    try:
+        display_queue.put_nowait((img1, pfp_link))
+    except queue.Full:
+        pass
+
+
+def show_queued_images():
+    """
+    Replace the open openCV windows with the queued images - runs on the stream reader thread
+    as OpenCV's window functions are not thread-safe and need a desktop OpenCV build
+    """
+    if display_queue.empty():
+        return
+    cv2.destroyAllWindows()
+    while not display_queue.empty():
+        img1, pfp_link = display_queue.get_nowait()
+        img1_cv = np.array(img1)
+        img1_cv = cv2.cvtColor(img1_cv, cv2.COLOR_BGR2RGB)
+        img1_cv = cv2.resize(img1_cv, (500, 500))
+        cv2.imshow(f"Image {pfp_link}", img1_cv)
     cv2.waitKey(1)
 
-def process_files(pfp: Image, files: List[str], folder_path: str):
-    for file in files:
-        if file.endswith((".png", ".jpg")):
-            with open(os.path.join(folder_path, file), "rb") as f:
-                img2_data = f.read()
-                img = Image.open(BytesIO(img2_data))
-                img_resized = np.array(img.convert("L").resize((pfp.width, pfp.height)))
-                wearing_pfp = nft.check_pfp(pfp, img_resized, folder_path, file)
-                return wearing_pfp
+def has_expansions(json_response: Dict) -> bool:
+    """
+    Whether a streamed tweet already carries its expanded users
+    """
+    return "users" in json_response.get("includes", {})
 
 
-def get_stream():
+def score_tweet(json_response: Dict) -> float:
     """
-    Run the twitter API stream and execute aggregation logic
+    Priority of a streamed tweet for the enrichment workers - higher goes first.
+    Scored by the weight of its matching rule tags, whether the author is already on
+    the leaderboard and the author's reach (log10 of followers, from the stream expansions).
+
+    :param json_response: the parsed tweet payload from the stream
     """
     config = Config.get_config(params)
-    response = requests.get(
-        "https://api.twitter.com/2/tweets/search/stream", auth=st.bearer_oauth, stream=True,
-    )
+    score = sum(config.priority_tag_weights.get(rule.get("tag"), 0)
+                for rule in json_response.get("matching_rules", []))
+    author_id = json_response["data"].get("author_id")
+    for user in json_response.get("includes", {}).get("users", []):
+        if user["id"] == author_id:
+            if user["username"] in leaderboard_members:
+                score += config.priority_member_weight
+            followers = user.get("public_metrics", {}).get("followers_count", 0)
+            score += math.log10(followers + 1)
+            break
+    return score
+
+
+def lookup_tweets(tweet_ids: List[str]) -> Dict[str, Union[Dict, Exception]]:
+    """
+    Resolve a micro-batch of streamed tweet IDs with a single multi-ID tweet lookup
+    """
+    return st.split_tweet_lookup(tweet_ids, st.get_data_by_ids(tweet_ids))
 
-    logging.info(f"Status: {response.status_code}")
-
-    if response.status_code == 429:
-        logging.error("TOO MANY REQUESTS")
-        time.sleep(300)  # wait 5 minutes
-        # waiting only 60 seconds doesn't seem to solve the problem
-        get_stream()
-
-    if response.status_code != 200:
-        try:
-            logging.info("Reconnecting to the stream...")
-            config.recount += 1
-            st.set_rules(st.delete_all_rules(st.get_rules()))
-        except Exception as e:
-            raise Exception(
-                "Cannot get stream (HTTP {}): {}: {}".format(
-                    response.status_code, response.text, e
-                )
-            )
-    # Per line in the response, store the user data and the corresponding tweet data
-    for response_line in response.iter_lines():
-        if response_line:
-            logging.info("\n\nGOT RESPONSE!")
-            cv2.destroyAllWindows()
-            if config.update_flag == True:
-                st.update_rules()
-                config.update_flag = False
 
-            json_response = json.loads(response_line)
+def process_tweet(json_response: Dict, tweet_lookup: Optional[Future] = None):
+    """
+    Enrich a single streamed tweet and update the leaderboard for its users.
+    Runs on the enrichment workers - never on the thread reading the stream.
 
-            logging.info(f"JSON Response: {json_response}")
+    :param json_response: the parsed tweet payload from the stream
+    :param tweet_lookup: future for the batched tweet lookup of this tweet - not needed when the
+        stream payload already carries its expansions, looked up alone otherwise
+    """
+    lt.log_sampled(logging.DEBUG, "tweet_payload", payload=json_response)
 
-            _id = json_response["data"]["id"]
-            # matching_rules = json_response["matching_rules"]
-            # tag = matching_rules[0]["tag"]
-            full_text = json_response["data"]["text"]
+    _id = json_response["data"]["id"]
+    # matching_rules = json_response["matching_rules"]
+    # tag = matching_rules[0]["tag"]
+    full_text = json_response["data"]["text"]
 
-            logging.info(f"\nTEXT: {full_text}")
 
-            # TODO: if original tweet or quoted/retweeted do we reward engager + author?
-            # aggregate (x/y)*engagement to original author
-            # aggregate (x/x)*engagement to quote/retweeter
+    # TODO: if original tweet or quoted/retweeted do we reward engager + author?
+    # aggregate (x/y)*engagement to original author
+    # aggregate (x/x)*engagement to quote/retweeter
 
-            pfp_link_list: List[str] = []
-            matched_users: List[str] = []
-            matched_ids: List[str] = []
-            non_holders: List[str]= []
+    matched_users: List[UserProfile] = []
+    pfp_link_list: List[str] = []
 
-            members = pd.DataFrame()
-            logging.info(f"\nTweet_ID: {_id}")
+    members = pd.DataFrame()
+    lt.log_event(logging.INFO, "tweet_received", tweet_id=_id, text=full_text)
+    with mt.timed("tweet_lookup"):
+        if tweet_lookup is not None:
+            tweet_data = tweet_lookup.result()
+        elif has_expansions(json_response):
+            tweet_data = json_response
+        else:
             tweet_data = st.get_data_by_id(str(_id))
-            logging.debug(f"Tweet Data: {tweet_data}")
-            for user in tweet_data["includes"]["users"]:
-                pfps = st.get_profile_picture_metadata(
-                    str(user["username"]))
-                pfp_link = pfps[0]
-                logging.info(f"Username: {user['username']}")
-
-                response1 = requests.get(pfp_link)
-                pfp = Image.open(BytesIO(response1.content)).convert("L")
+    lt.log_sampled(logging.DEBUG, "tweet_data", tweet_id=_id, data=tweet_data)
+    # the streamed tweet's own metrics update its author's daily buckets without a timeline call
+    st.timelines.observe(tweet_data["data"].get("author_id", ""), tweet_data["data"])
+    gpt4_response = "No match for this user"
+    # users missing their pfp or bio fields are resolved together in one batched lookup
+    with mt.timed("profile_lookup"):
+        profiles = st.users.resolve_many(tweet_data["includes"]["users"])
+    for user in profiles:
+        pfp_link = user.profile_image_url
+        lt.log_event(logging.INFO, "user", tweet_id=_id, username=user.username)
+
+        # an avatar seen before keeps its verdict until its url changes - no download or match
+        wearing_pfps = verdict_cache.get_by_url(pfp_link)
+        if wearing_pfps is None:
+            with mt.timed("image_download"):
+                image = st.images.get(pfp_link)
+            wearing_pfps = verdict_cache.get_by_content(image.content_hash)
+            if wearing_pfps is None:
+                pfp = Image.fromarray(image.gray)
                 display_image(pfp, pfp_link)
 
                 '''
-                Take a random sample of 7 y00ts images and
-                compare the structural similarity of the pfp
-                to the y00ts images. Thresholds are as follows:
+                Find the top-k reference images per collection nearest to the pfp by
+                perceptual hash, then compare the structural similarity of the pfp
+                to only those on the matcher process pool. Thresholds are as follows:
                 - >= 0.925: 100% match
                 - >= 0.90: Twinsies
                 - >= 0.50: Likely in collection
                 - <= 0.40: Not in collection
                 '''
-                y00t_folder_path = "outputs/y00ts_imgs"
-                degod_folder_path = "outputs/degods_imgs"
-                y00t_filenames = [f for f in os.listdir(
-                    y00t_folder_path) if f.endswith(("png", "jpg"))]
-                degod_filenames = [f for f in os.listdir(
-                    degod_folder_path) if f.endswith(("png", "jpg"))]
-                random_y00ts = random.sample(
-                    y00t_filenames, min(5, len(y00t_filenames)))
-                random_degods = random.sample(
-                    degod_filenames, min(5, len(degod_filenames)))
-
-                gpt4_response = "No match for this user"
-
-                # Filter out non-image files
-                y00t_files = [file for file in random_y00ts if file.endswith((".png", ".jpg"))]
-                degod_files = [file for file in random_degods if file.endswith((".png", ".jpg"))]
-
-                wearing_y00t_pfp = process_files(pfp, y00t_files, y00t_folder_path)
-                wearing_degod_pfp = process_files(pfp, degod_files, degod_folder_path)
-                ############################################################################################################
-
-                # for y00t_file in random_y00ts:
-                #     for degod_file in random_degods:
-                #         if y00t_file.endswith(".png") or y00t_file.endswith(".jpg"):
-                #             with open(os.path.join(y00t_folder_path, y00t_file), "rb") as f:
-                #                 img2_data = f.read()
-                #                 y00t = np.array(Image.open(BytesIO(img2_data)).convert(
-                #                     "L").resize((pfp.width, pfp.height)))
-
-                #                 wearing_y00t_pfp = nft.check_pfp(
-                #                     pfp, y00t, y00t_folder_path, y00t_file)
-
-                #         if degod_file.endswith(".png") or degod_file.endswith(".jpg"):
-                #             with open(os.path.join(degod_folder_path, degod_file), "rb") as f:
-                #                 img2_data = f.read()
-                #                 degod = np.array(Image.open(BytesIO(img2_data)).convert(
-                #                     "L").resize((pfp.width, pfp.height)))
-
-                #                 wearing_degod_pfp = nft.check_pfp(
-                #                     pfp, degod, degod_folder_path, degod_file)
-                ############################################################################################################
-                    # If running in debug mode - test the chat GPT response script 
-
-                if logging.basicConfig(level=logging.DEBUG):
-                    system_intel = "You are GPT-4, answer my question as as a twitter meme and comedy expert. Your goal is to use crypto twitter relevant jokes and memes \
-                            in order to generate a response that will make the user laugh and go viral. You are not allowed to use any personaly identifiable information about the user. \
-                                You are not allowed to use any information about the user that is not publicly available on twitter. You can use the user's profile picture, \
-                                    their username, their bio, their tweets, their followers, their following, their likes, their retweets, their quotes, their replies, \
-                                        their media, their website, their birthday, their join date, their pinned tweet, their lists, and their moments. \
-                                            You can also use gifs and images or short clips from the internet to generate your response. "
-
-                    prompt = f"Your system intel is as follows: {system_intel} and your task is as follows: Generate a funny and potentially viral reponse to the following tweet: \n\n{full_text}\n\nUser: {user['username']}\n\n \
-                        Use twitter memes, jokes, gifs, images, and other references to generate your response. \n\n"
-
-                    model = "gpt-3.5-turbo-0301"
-                    # model = "gpt-4-32k"
-
-                    gpt4_response = gpt.chat_gpt_call(
-                            model, prompt, 0.9, 1000)
-                    
-                logging.info(f"Wearing Y00t PFP: {wearing_y00t_pfp}")
-                logging.info(f"Wearing Degod PFP: {wearing_degod_pfp}")
-
-                # if wearing_y00t_pfp[0] == True:
-                #     logging.debug(
-                #         f"User {user['username']} is wearing pfp similar to {y00t_file} or {degod_file}!")
-                #     matched_users.append(user["username"])
-                #     matched_ids.append(user["id"])
-
-                #     # gpt4_response = gpt.ask_GPT4(
-                #     #     system_intel, prompt, model)
-                #     break
-                # elif wearing_degod_pfp[0] == True:
-                #     logging.debug(
-                #         f"User {user['username']} is wearing pfp similar to {degod_file}!")
-                #     matched_users.append(user["username"])
-                #     matched_ids.append(user["id"])
-
-                #     gpt4_response = gpt.chatGPTcall(
-                #         model, prompt, 0.9, 1000)
-
-                #     # gpt4_response = gpt.ask_GPT4(
-                #     #     system_intel, prompt, model)
-                #     break
-                # else:
-                #     logging.debug(
-                #         f"User {user['username']} is not wearing pfp similar to {y00t_file} or {degod_file}!")
-                #     non_holders.append(user["username"])
-
+                with mt.timed("pfp_match"):
+                    wearing_pfps, match_seconds = pfp_matcher.match(pfp, pfp_link)
+                for stage, seconds in match_seconds.items():
+                    mt.registry.observe("stream_stage_latency_seconds", seconds, stage=stage)
+            verdict_cache.put(pfp_link, image.content_hash, wearing_pfps)
+
+        # If running in debug mode - test the chat GPT response script
+        if logging.basicConfig(level=logging.DEBUG):
+            system_intel = "You are GPT-4, answer my question as as a twitter meme and comedy expert. Your goal is to use crypto twitter relevant jokes and memes \
+                    in order to generate a response that will make the user laugh and go viral. You are not allowed to use any personaly identifiable information about the user. \
+                        You are not allowed to use any information about the user that is not publicly available on twitter. You can use the user's profile picture, \
+                            their username, their bio, their tweets, their followers, their following, their likes, their retweets, their quotes, their replies, \
+                                their media, their website, their birthday, their join date, their pinned tweet, their lists, and their moments. \
+                                    You can also use gifs and images or short clips from the internet to generate your response. "
+
+            prompt = f"Your system intel is as follows: {system_intel} and your task is as follows: Generate a funny and potentially viral reponse to the following tweet: \n\n{full_text}\n\nUser: {user.username}\n\n \
+                Use twitter memes, jokes, gifs, images, and other references to generate your response. \n\n"
+
+            model = "gpt-3.5-turbo-0301"
+            # model = "gpt-4-32k"
+
+            gpt4_response = gpt.chat_gpt_call(
+                    model, prompt, 0.9, 1000)
+
+        for collection, wearing_pfp in wearing_pfps.items():
+            lt.log_event(logging.INFO, "pfp_match", username=user.username, collection=collection,
+                         matched=wearing_pfp.matched, token=wearing_pfp.token, tier=wearing_pfp.tier)
+
+        if any(wearing_pfp.matched for wearing_pfp in wearing_pfps.values()):
+            lt.log_event(logging.DEBUG, "holder", username=user.username)
+            matched_users.append(user)
             pfp_link_list.append(pfp_link)
+        else:
+            # not removed from the leaderboard: a miss can be a failed download or a borderline match
+            lt.log_event(logging.DEBUG, "non_holder", username=user.username)
+
+    lt.log_event(logging.DEBUG, "holders", tweet_id=_id, pfp_links=pfp_link_list)
+    for user, pfp_link in zip(matched_users, pfp_link_list):
+        username = user.username
+        # update metrics
+        with mt.timed("metrics_fetch"):
+            metrics = st.get_user_metrics_by_days(user.id, params.history)
+        lt.log_event(logging.DEBUG, "user_metrics", username=username, metrics=metrics)
+        description, bio_link = user.description, user.url
+        member_data = pd.DataFrame(
+            [[username, user.name, metrics["likes"], metrics["retweets"], metrics["replies"], metrics["impressions"],
+              pfp_link, description, bio_link]])
+        member_data.columns = [
+            "index", "Name", "Favorites", "Retweets", "Replies", "Impressions", "PFP_Url", "Description", "URL"]
+        lt.log_event(logging.DEBUG, "member_data", username=username, data=member_data)
+        lt.log_event(logging.INFO, "leaderboard_update", username=username)
+        with leaderboard_lock, mt.timed("update_pfp_tracked_table"):
+            st.update_pfp_tracked_table(
+                engine, user.name, username, metrics["likes"], metrics["retweets"], metrics["replies"], metrics["impressions"], pfp_link, description, bio_link)
+        leaderboard_members.add(username)
+        members = pd.concat([members, member_data])
+
+    if gpt4_response != "No match for this user" and logging.basicConfig(level=logging.DEBUG):
+        logging.debug(f"Sending response: {gpt4_response} to tweet...")
+
+    '''
+        TODO:
+        - determine why frank and y00ts are not in the list of holders
+        - determine if we can get pfp metadata without nft inspect
+        - perfect sim score or other image detection method for why y00ts have the wrong pfp
+    '''
+
+
+def reset_stream_rules():
+    """
+    Sync the rules on the stream with config again
+    """
+    st.set_rules()
 
-            # set default table before each read
-            pfp_table = pd.read_sql_table(newpfpTable, engine)
-            logging.debug(f"PFP List: {pfp_link_list}")
-            for username in matched_users:
-                logging.debug(f"User {username} already in database")
-                # update metrics
-                metrics = st.get_user_metrics_by_days(
-                    matched_ids[matched_users.index(username)], params.history)
-                logging.debug(f"Metrics: {metrics}")
-                bio_link, description = st.get_bio_url(str(username))
-                member_data = pd.DataFrame(
-                    [[username, user["name"], metrics["likes"], metrics["retweets"], metrics["replies"], metrics["impressions"],
-                      pfp_link_list[matched_users.index(username)], description, bio_link]])
-                member_data.columns = [
-                    "index", "Name", "Favorites", "Retweets", "Replies", "Impressions", "PFP_Url", "Description", "URL"]
-                logging.debug(f"Member Data: {member_data}")
-
-                # pfp_table = pd.read_sql_table(newpfpTable, engine)
-                # pfp_table is now read inside update_pfp_tracked_table
-                logging.info("Calling update pfp tracked table...")
-                st.update_pfp_tracked_table(
-                    engine, user["name"], username, metrics["likes"], metrics["retweets"], metrics["replies"], metrics["impressions"], pfp_link_list[matched_users.index(username)], description, bio_link)
-                members = pd.concat([members, member_data])
-
-            for non_holder in non_holders:
-                if non_holder in pfp_table["index"].values:
-                    logging.debug("Non holder already in database - removing...")
-                    pfp_table = pfp_table.drop(
-                        pfp_table[pfp_table["index"] == non_holder].index)
-                    pfp_table.to_sql(
-                        newpfpTable, engine, if_exists="replace", index=False)
-                else:
-                    logging.debug("Non holder not in database")
-
-            if gpt4_response != "No match for this user" and logging.basicConfig(level=logging.DEBUG):
-                logging.debug(f"Sending response: {gpt4_response} to tweet...")
-
-            # determine ways to get rank, reach, and pfp status
-            # nft-inspect api may be limiting/blocking my ip address
-            '''
-            totals = pd.DataFrame()
-            total_members = pd.DataFrame()
-            for collection in params.collections:
-                print("Collection: ", collection)
-                # total_members = nft.get_members(engine, collection, usersTable)
-
-                totals = pd.concat([totals, total_members])
-
-            # see all the dudes in nft inspect datatbase wearing pfps and the metadata of the twitter image
-            # for dude in totals["Name"]:
-            #     if totals["Wearing PFP"][totals["Name"] == dude].values[0] == True:
-            #         time.sleep(5)
-            #         # print("Dude is wearing PFP: ", dude)
-            #         thisUrl, thisMetadta = st.get_profile_picture_metadata(
-            #             totals["Username"][totals["Name"] == dude].values[0])
-
-            #         with open("outputs/pfp_metadata.txt", "a") as f:
-            #             f.write(
-            #                 f"{dude} is wearing NFT with metadata: {thisMetadta}\n")
-            #         print(
-            #             f"User {dude} is wearing NFT {thisUrl}with metadata: {thisMetadta}\n")
-
-            
-            wearing_list, usernames, rank_list, global_reach_list, pfpUrl_list = nft.get_wearing_list(
-                totals)
-
-            non_holders = []
-            memebers = pd.DataFrame(
-                columns=["index", "Name", "Favorites", "Retweets", "Replies", "Impressions",
-                         "Rank", "Global_Reach", "PFP_URL", "Description", "Bio_Link"]
-            )
-            '''
-
-            '''
-            if tweet_data["includes"] and "tweets" in tweet_data["includes"]:
-                print("Users: ", tweet_data["includes"]["users"])
-                for user in tweet_data["includes"]["users"]:
-                    # print("Author: ", user)
-                    name = user["name"]
-                    username = user["username"]
-                    # if user["name"] in wearing_list:
-                    # pfpurl, metadata = st.get_profile_picture_metadata(
-                    #     username)
-                    # print(
-                    #     f"User {name}, username {username} is wearing NFT with metadata: {metadata}")
-                    if username in usernames and name in wearing_list:
-                        rank = rank_list[usernames.index(username)]
-                        global_reach = global_reach_list[usernames.index(
-                            username)]
-                        pfp_url = pfpUrl_list[usernames.index(username)]
-                        metrics = st.get_user_metrics_by_days(
-                            user["id"], params.history)
-                        description, url = st.get_bio_url(username)
-                        member_data = pd.DataFrame(
-                            [[username, user["name"], metrics["likes"], metrics["retweets"], metrics["replies"], metrics["impressions"], rank, global_reach, pfp_url, description, url]])
-                        member_data.columns = [
-                            "index", "Name", "Favorites", "Retweets", "Replies", "Impressions", "Rank", "Global_Reach", "PFP_Url", "Description", "Bio_Link"]
-
-                        pfp_table = pd.read_sql_table(newpfpTable, engine)
-                        print("Calling update pfp tracked table...")
-                        st.update_pfp_tracked_table(
-                            engine, pfp_table, user["name"], username, metrics["likes"], metrics["retweets"], metrics[
-                                "replies"], metrics["impressions"], rank, global_reach, pfp_url, description, url
-                        )
-                        # print("Member Data: ", member_data)
-                        memebers = pd.concat([memebers, member_data])
-                    else:
-                        print("Updating non holders...")
-                        non_holders.append(user["username"])
-                        pfp_table = pd.read_sql_table(newpfpTable, engine)
-                        if user["name"] in pfp_table["Name"].values:
-                            # remove from pfp table
-                            print(
-                                "No longer wearing PFP - Removing from pfp table...")
-                            pfp_table = pfp_table[pfp_table["Name"]
-                                                  != user["name"]]
-                            pfp_table.to_sql(
-                                newpfpTable, engine, if_exists="replace")
-                        else:
-                            print("Not in pfp table, skipping...")
-
-                print("Holders: ", memebers["Name"].values.tolist())
-                print("Non Holders: ", non_holders)
-                '''
 
-            '''
-                TODO:
-                - determine why frank and y00ts are not in the list of holders
-                - determine if we can get pfp metadata without nft inspect
-                - perfect sim score or other image detection method for why y00ts have the wrong pfp
-            '''
+def count_reconnect():
+    """
+    Track the number of times the stream has been restarted
+    """
+    config = Config.get_config(params)
+    config.recount += 1
+    logging.info(f"Reconnecting to the stream... (reconnect #{config.recount})")
+
+
+def process_queued_tweet(item: Tuple[Dict, Optional[Future], float]):
+    """
+    Worker handler timing the whole enrichment of a queued tweet.
+    Every Twitter call made for the tweet waits on the rate limit with the tweet's priority.
+    """
+    json_response, tweet_lookup, priority = item
+    with mt.timed("tweet"), rl.prioritized(priority):
+        process_tweet(json_response, tweet_lookup)
+
+
+def run_pipeline(lines: Iterable[bytes], recorder: Optional[rt.StreamRecorder] = None) -> pt.WorkerPool:
+    """
+    Parse and queue stream lines for the enrichment workers until the lines run out.
+    Shared by the live stream and the replay driver so both exercise the same processing.
+
+    :param lines: raw (non keep-alive) stream lines
+    :param recorder: optional recorder every raw line is appended to
+
+    return: the stopped worker pool with its processed/failed counts
+    """
+    config = Config.get_config(params)
+    lt.sample_rate = config.log_sample_rate
+    if config.priority_scheduling:
+        work_queue = pt.PriorityWorkQueue(
+            config.queue_size, config.priority_backlog, config.priority_min_score,
+            config.priority_shed_policy, block=config.queue_drop_policy == "block")
+        leaderboard_members.start()
+    else:
+        work_queue = pt.WorkQueue(config.queue_size, config.queue_drop_policy)
+    workers = pt.WorkerPool(
+        work_queue, process_queued_tweet, config.enrichment_workers)
+    tweet_batcher = pt.MicroBatcher(
+        lookup_tweets, config.lookup_batch_size, config.lookup_batch_wait, name="tweet-lookup")
+    seen_tweets = dt.SeenTweets.load(
+        config.dedupe_path, config.dedupe_size, config.dedupe_bloom_capacity, config.dedupe_error_rate)
+    metrics_server = mt.serve_metrics(config.metrics_port) if config.metrics_port else None
+    metrics_dump = mt.start_json_dump(
+        config.metrics_dump_path, config.metrics_dump_interval) if config.metrics_dump_path else None
+    global pfp_matcher, verdict_cache
+    pfp_matcher = mat.PfpMatcher(
+        config.reference_folders, config.match_workers, config.pfp_top_k, config.pfp_threshold,
+        config.reference_index_dir, config.reference_size, config.pfp_hash, config.pfp_hash_distance)
+    verdict_cache = vct.VerdictCache(
+        config.verdict_cache_size, config.verdict_cache_max_age, pfp_matcher.version, config.verdict_cache_path)
+    tweet_batcher.start()
+    workers.start()
+    try:
+        # Per line in the response, parse and queue the tweet for the enrichment workers
+        for response_line in lines:
+            lt.log_event(logging.DEBUG, "stream_line", length=len(response_line))
+            if recorder is not None:
+                recorder.record(response_line)
+            if config.display_pfps:
+                show_queued_images()
+            if config.update_flag == True:
+                st.update_rules()
+                config.update_flag = False
+
+            mt.registry.inc("stream_lines_total")
+            with mt.timed("json_parse"):
+                json_response = pt.parse_line(response_line)
+            if json_response is None:
+                continue
+            # drop redelivered tweets before any network or CPU work
+            if seen_tweets.check_and_add(json_response["data"]["id"]):
+                lt.log_event(logging.INFO, "duplicate_tweet", tweet_id=json_response["data"]["id"])
+                mt.registry.inc("stream_dedupe_total", result="hit")
+                continue
+            mt.registry.inc("stream_dedupe_total", result="miss")
+            if config.dedupe_path and seen_tweets.misses % config.dedupe_save_every == 0:
+                seen_tweets.save_in_background(config.dedupe_path)
+            # start the tweet lookup now so it is batched with every other tweet in flight
+            priority = score_tweet(json_response) if config.priority_scheduling else 0
+            tweet_lookup = None
+            if not has_expansions(json_response):
+                tweet_lookup = tweet_batcher.submit(str(json_response["data"]["id"]), priority)
+            if config.priority_scheduling:
+                work_queue.put((json_response, tweet_lookup, priority), priority)
+            else:
+                work_queue.put((json_response, tweet_lookup, priority))
+            mt.registry.set_gauge("stream_queue_depth", work_queue.qsize())
+            mt.registry.set_gauge("stream_queue_dropped", work_queue.dropped)
+    finally:
+        # flush the last lookup batch first - the workers may be waiting on it
+        tweet_batcher.stop()
+        workers.stop()
+        pfp_matcher.close()
+        verdict_cache.flush()
+        leaderboard_members.stop()
+        st.users.stop()
+        logging.info(
+            f"Seen tweets - duplicates: {seen_tweets.hits}, new: {seen_tweets.misses}")
+        if config.dedupe_path:
+            seen_tweets.save(config.dedupe_path)
+        if config.timeline_path:
+            st.timelines.save(config.timeline_path)
+        if metrics_dump is not None:
+            metrics_dump.set()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+    return workers
+
+
+def get_stream():
+    """
+    Run the twitter API stream and execute aggregation logic.
+    The stream is only read, parsed and queued here - enrichment runs on the worker pool.
+    Reconnects (rate limits, errors and stalls) are handled by the connection manager in a loop.
+    Every raw line is also recorded when config.record_path is set.
+    """
+    config = Config.get_config(params)
+    connection = ct.StreamConnection(
+        f"{st.API_BASE}/2/tweets/search/stream",
+        auth=st.bearer_oauth,
+        params=st.STREAM_PARAMS if config.stream_expansions else None,
+        stall_timeout=config.stream_stall_timeout,
+        healthy_after=config.stream_healthy_after,
+        on_client_error=reset_stream_rules,
+        on_reconnect=count_reconnect,
+    )
+    recorder = rt.StreamRecorder(config.record_path) if config.record_path else None
+    try:
+        run_pipeline(connection.lines(), recorder)
+    finally:
+        connection.close()
+        if recorder is not None:
+            recorder.close()
+
+
+def replay_stream(path: str, speed: float = 1.0) -> float:
+    """
+    Feed a recorded stream log back through the processing pipeline
+
+    :param path: the recording written by get_stream with config.record_path set
+    :param speed: 1.0 for real time, N for N x real time, 0 for as fast as possible
+
+    return: processed tweets per second
+    """
+    started = time.monotonic()
+    workers = run_pipeline(rt.replay_lines(path, speed))
+    elapsed = time.monotonic() - started
+    tweets_per_sec = workers.processed / elapsed if elapsed > 0 else 0.0
+    logging.info(
+        f"Replayed {path} at speed {speed}: {workers.processed} tweets in {elapsed:.2f}s ({tweets_per_sec:.2f} tweets/sec), {workers.failed} failed")
+    return tweets_per_sec
 
 
 def main():
     """
     Main function for setting the desired rules and activating the twitter stream
     """
-    st.delete_all_rules(st.get_rules())
     config = Config.get_config(params)
     config.history = 30  # number of days to track back tweet metrics
     config.set_add_rule(["y00ts", "DeGods"], ["y00ts", "degods"])
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+
+def random_image(rng: np.random.Generator, size: int = 64) -> Image.Image:
+    """
+    A blocky random grayscale image - distinct enough to hash and match reliably
+    """
+    blocks = rng.integers(0, 256, (8, 8), dtype=np.uint8)
+    return Image.fromarray(blocks).resize((size, size), Image.NEAREST)
+
+
+@pytest.fixture
+def reference_folder(tmp_path):
+    """
+    Create a folder of count random reference images and return its path
+    """
+    def make(name: str, count: int, seed: int = 0) -> str:
+        folder = tmp_path / name
+        folder.mkdir()
+        rng = np.random.default_rng(seed)
+        for i in range(count):
+            random_image(rng).save(folder / f"{i}.png")
+        return str(folder)
+
+    return make
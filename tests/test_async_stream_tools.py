@@ -0,0 +1,102 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils import async_stream_tools as ast
+from utils import rate_limit_tools as rl
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    calls = []
+
+    def do_GET(self):
+        Handler.calls.append(self.path)
+        self.reply({"data": [{"id": "1"}]})
+
+    def do_POST(self):
+        Handler.calls.append(self.path)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.reply({"errors": [{"value": "from:", "title": "Invalid Rule"}]})
+
+    def reply(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def base_url(monkeypatch):
+    Handler.calls = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    netloc = f"127.0.0.1:{server.server_port}"
+    # rate limited like the real API
+    monkeypatch.setattr(rl, "TWITTER_HOSTS", rl.TWITTER_HOSTS | {netloc})
+    yield f"http://{netloc}"
+    server.shutdown()
+
+
+def exhausted(family_url: str) -> rl.RateLimitScheduler:
+    scheduler = rl.RateLimitScheduler()
+    scheduler.update_from(family_url, 200, {"x-rate-limit-limit": "300",
+                                            "x-rate-limit-remaining": "0",
+                                            "x-rate-limit-reset": str(time.time() + 600)})
+    return scheduler
+
+
+def test_add_rules_raises_on_errors(base_url, monkeypatch):
+    monkeypatch.setattr(ast, "RULES_URL", f"{base_url}/2/tweets/search/stream/rules")
+
+    async def main():
+        async with ast.AsyncTwitterClient(scheduler=rl.RateLimitScheduler()) as client:
+            await client.add_rules([{"value": "from:", "tag": "bad"}])
+
+    with pytest.raises(Exception, match="Cannot add rules: .*Invalid Rule"):
+        asyncio.run(main())
+
+
+def test_exhausted_family_does_not_block_the_others(base_url):
+    scheduler = exhausted(f"{base_url}/2/tweets?ids=1")
+
+    async def main():
+        async with ast.AsyncTwitterClient(concurrency=1, scheduler=scheduler) as client:
+            waiting = asyncio.ensure_future(client.request("GET", f"{base_url}/2/tweets?ids=1", deadline=10))
+            await asyncio.sleep(0.2)
+            # the only slot must still be free while the tweet lookup waits for its window
+            users = await client.request("GET", f"{base_url}/2/users?ids=1", deadline=2)
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            return users
+
+    assert asyncio.run(main()) == {"data": [{"id": "1"}]}
+    assert Handler.calls == ["/2/users?ids=1"]
+
+
+def test_call_past_its_deadline_leaves_the_queue_without_budget(base_url):
+    scheduler = exhausted(f"{base_url}/2/tweets?ids=1")
+
+    async def main():
+        async with ast.AsyncTwitterClient(scheduler=scheduler) as client:
+            await client.request("GET", f"{base_url}/2/tweets?ids=1", deadline=0.3)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(main())
+    # the thread waiting on the scheduler is told to give up, not left to take the next token
+    deadline = time.monotonic() + 2
+    while scheduler._waiters["tweet_lookup"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert scheduler._waiters["tweet_lookup"] == []
+    assert scheduler.remaining()["tweet_lookup"] == 0
+    assert Handler.calls == []
@@ -0,0 +1,77 @@
+import requests
+
+from utils import connection_tools as ct
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None, lines=()):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = ""
+        self._lines = lines
+
+    def iter_lines(self):
+        yield from self._lines
+        raise requests.exceptions.ConnectionError("read timed out")
+
+    def close(self):
+        pass
+
+
+def connect_with(monkeypatch, responses, max_reconnects):
+    """
+    A StreamConnection answered by responses in turn, closed after max_reconnects, and the delays it slept
+    """
+    delays = []
+    monkeypatch.setattr(ct.requests, "get", lambda *args, **kwargs: responses.pop(0))
+    monkeypatch.setattr(ct.time, "sleep", delays.append)
+    connection = ct.StreamConnection("http://stream", auth=None)
+
+    def reconnected():
+        if connection.reconnects >= max_reconnects:
+            connection.close()
+
+    connection.on_reconnect = reconnected
+    return connection, delays
+
+
+def test_classify_status():
+    assert ct.classify_status(429) == "rate_limit"
+    assert ct.classify_status(503) == "server"
+    assert ct.classify_status(401) == "client"
+
+
+def test_backoff_delay_grows_with_jitter_up_to_the_cap():
+    for attempt in range(10):
+        initial, cap = ct.BACKOFF_POLICIES["server"]
+        delay = min(cap, initial * 2 ** attempt)
+        assert delay / 2 <= ct.backoff_delay("server", attempt) <= delay
+
+
+def test_rate_limit_delay():
+    assert ct.rate_limit_delay({"x-rate-limit-reset": "160"}, now=100) == 60
+    assert ct.rate_limit_delay({"x-rate-limit-reset": "50"}, now=100) == 0
+    assert ct.rate_limit_delay({}) is None
+    assert ct.rate_limit_delay({"x-rate-limit-reset": "soon"}) is None
+
+
+def test_repeated_stalls_keep_backing_off(monkeypatch):
+    connection, delays = connect_with(monkeypatch, [FakeResponse() for _ in range(5)], max_reconnects=5)
+    assert list(connection.lines()) == []
+    # each stall right after connecting waits at least the lower bound of the next backoff step
+    initial = ct.BACKOFF_POLICIES["stall"][0]
+    assert len(delays) == 5
+    assert all(delay >= initial * 2 ** attempt / 2 for attempt, delay in enumerate(delays))
+
+def test_backoff_starts_over_after_a_healthy_connection(monkeypatch):
+    connection, delays = connect_with(monkeypatch, [FakeResponse() for _ in range(3)], max_reconnects=3)
+    connection.healthy_after = 0
+    list(connection.lines())
+    assert all(delay <= ct.BACKOFF_POLICIES["stall"][0] for delay in delays)
+
+
+def test_rate_limit_reset_in_the_past_still_backs_off(monkeypatch):
+    responses = [FakeResponse(429, {"x-rate-limit-reset": "0"}), FakeResponse(lines=[b"{}"])]
+    connection, delays = connect_with(monkeypatch, responses, max_reconnects=1)
+    assert list(connection.lines()) == [b"{}"]
+    assert delays[0] >= ct.BACKOFF_POLICIES["rate_limit"][0] / 2
@@ -0,0 +1,56 @@
+import time
+
+from utils import dedupe_tools as dt
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = dt.BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(str(i))
+    assert all(str(i) in bloom for i in range(1000))
+    false_positives = sum(str(i) in bloom for i in range(1000, 11000))
+    assert false_positives < 300
+
+
+def test_rolling_bloom_filter_forgets_the_oldest_generation():
+    bloom = dt.RollingBloomFilter(10, 0.001)
+    for i in range(10):
+        bloom.add(f"first-{i}")
+    # the second generation starts with the 11th key - the first is still remembered
+    for i in range(10):
+        bloom.add(f"second-{i}")
+    assert all(f"first-{i}" in bloom for i in range(10))
+    # the third generation retires the first
+    bloom.add("third-0")
+    assert not any(f"first-{i}" in bloom for i in range(10))
+    assert all(f"second-{i}" in bloom for i in range(10)) and "third-0" in bloom
+
+
+def test_seen_tweets_counts_duplicates():
+    seen = dt.SeenTweets(lru_size=2, bloom_capacity=100, error_rate=0.001)
+    assert [seen.check_and_add(tweet_id) for tweet_id in ["1", "2", "1", "3", "1"]] == \
+        [False, False, True, False, True]
+    assert (seen.hits, seen.misses, len(seen)) == (2, 3, 2)
+    # out of the LRU, still caught by the Bloom filter
+    assert seen.check_and_add("2")
+
+
+def test_seen_tweets_survive_a_restart(tmp_path):
+    path = str(tmp_path / "seen.pickle")
+    seen = dt.SeenTweets(lru_size=10, bloom_capacity=100, error_rate=0.001)
+    for i in range(5):
+        seen.check_and_add(str(i))
+    seen.save_in_background(path)
+    for _ in range(100):
+        if (tmp_path / "seen.pickle").exists():
+            break
+        time.sleep(0.01)
+    loaded = dt.SeenTweets.load(path, lru_size=3, bloom_capacity=100, error_rate=0.001)
+    assert len(loaded) == 3
+    assert all(loaded.check_and_add(str(i)) for i in range(5))
+    assert not loaded.check_and_add("5")
+
+
+def test_seen_tweets_load_starts_empty_without_a_file(tmp_path):
+    seen = dt.SeenTweets.load(str(tmp_path / "missing"), lru_size=3, bloom_capacity=100, error_rate=0.001)
+    assert len(seen) == 0
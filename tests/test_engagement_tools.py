@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from utils import engagement_tools as et
+
+DAY = et.DAY_SECONDS
+START = 19000 * DAY
+
+
+def test_totals_per_window():
+    window = et.EngagementWindow(max_days=30, windows=(7, 30))
+    window.add("u", START - 2 * DAY, {"likes": 5, "impressions": 100}, now=START)
+    window.add("u", START - 10 * DAY, {"likes": 3}, now=START)
+    window.add("u", START - 40 * DAY, {"likes": 1000}, now=START)
+    assert window.totals("u", 7, now=START) == {"likes": 5, "retweets": 0, "replies": 0, "impressions": 100}
+    assert window.totals("u", 30, now=START)["likes"] == 8
+    # a window that is not kept running is summed from the buckets
+    assert window.totals("u", 3, now=START)["likes"] == 5
+    assert window.totals("nobody", 7, now=START)["likes"] == 0
+
+
+def test_buckets_expire_as_days_roll_over():
+    window = et.EngagementWindow(max_days=30, windows=(7, 30))
+    window.add("u", START, {"likes": 4}, now=START)
+    assert window.totals("u", 7, now=START + 6 * DAY)["likes"] == 4
+    assert window.totals("u", 7, now=START + 7 * DAY)["likes"] == 0
+    assert window.totals("u", 30, now=START + 29 * DAY)["likes"] == 4
+    assert window.totals("u", 30, now=START + 100 * DAY)["likes"] == 0
+
+
+def test_running_totals_match_summing_every_tweet():
+    rng = random.Random(0)
+    window = et.EngagementWindow(max_days=30, windows=(1, 7, 30), capacity=2)
+    added = []
+    now = START
+    for _ in range(2000):
+        now += rng.randrange(0, 4 * 60 * 60)
+        user = rng.choice("abcde")
+        created_at = now - rng.randrange(0, 35 * DAY)
+        likes = rng.randrange(-3, 10)
+        window.add(user, created_at, {"likes": likes}, now=now)
+        added.append((user, created_at, likes))
+        if rng.random() < 0.1:
+            days = rng.choice((1, 5, 7, 30))
+            expected = sum(delta for u, created, delta in added
+                           if u == user and 0 <= et.day_of(now) - et.day_of(created) < days)
+            assert window.totals(user, days, now=now)["likes"] == expected
+    assert len(window) == 5
+
+
+def test_window_longer_than_the_ring_is_rejected():
+    with pytest.raises(ValueError):
+        et.EngagementWindow(max_days=30).totals("u", 31)
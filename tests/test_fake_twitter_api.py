@@ -0,0 +1,66 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from standalone_utils import fake_twitter_api as fake
+from utils import stream_tools as st
+
+EXPANSIONS = "expansions=author_id,entities.mentions.username,geo.place_id,referenced_tweets.id"
+
+
+@pytest.fixture
+def server():
+    class Handler(fake.Handler):
+        pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    base_url = f"http://127.0.0.1:{httpd.server_port}"
+    Handler.api = fake.FakeTwitter(20, base_url, [], 0, days=1, seed=0)
+    Handler.faults = fake.Faults(0, 0, 0, 0, 0, 0, rate_limit=3)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield base_url, Handler.api
+    httpd.shutdown()
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, response.headers, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, json.loads(e.read())
+
+
+def test_tweet_lookup_returns_the_fields_of_the_requested_expansions(server):
+    base_url, api = server
+    tweet_ids = api.timeline("1000000")[:3]
+    status, _, payload = get(f"{base_url}/2/tweets?ids={','.join(tweet_ids)}&{EXPANSIONS}"
+                             f"&tweet.fields=public_metrics,created_at")
+    assert status == 200
+    assert all(tweet["author_id"] == "1000000" and "entities" in tweet for tweet in payload["data"])
+    # without them the includes of a batch could not be routed back to their tweet
+    results = st.split_tweet_lookup(tweet_ids, payload)
+    for tweet_id in tweet_ids:
+        usernames = {user["username"] for user in results[tweet_id]["includes"]["users"]}
+        mentions = {mention["username"] for mention in api.tweets[tweet_id]["entities"]["mentions"]}
+        assert usernames == {"user0"} | mentions
+
+
+def test_fields_are_only_returned_when_asked_for(server):
+    base_url, api = server
+    tweet_id = api.timeline("1000001")[0]
+    _, _, payload = get(f"{base_url}/2/tweets?ids={tweet_id}")
+    assert set(payload["data"][0]) == {"id", "text"}
+
+
+def test_calls_past_the_rate_limit_get_429_until_the_window_resets(server):
+    base_url, _ = server
+    remaining = [get(f"{base_url}/2/users?ids=1000000")[1]["x-rate-limit-remaining"] for _ in range(3)]
+    assert remaining == ["2", "1", "0"]
+    status, headers, _ = get(f"{base_url}/2/users?ids=1000000")
+    assert status == 429 and headers["x-rate-limit-remaining"] == "0"
+    # the other endpoint families have a window of their own
+    assert get(f"{base_url}/2/tweets/search/stream/rules")[0] == 200
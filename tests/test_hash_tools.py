@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from tests.conftest import random_image
+from utils import hash_tools as ht
+from utils import reference_tools as rt
+
+
+def test_hamming():
+    assert ht.hamming(0, 0) == 0
+    assert ht.hamming(0b1011, 0b0001) == 2
+    assert ht.hamming(0, (1 << 64) - 1) == 64
+
+
+def test_masks_are_every_chunk_mask_within_the_radius_fewest_bits_first():
+    masks = ht._masks(2)
+    assert len(masks) == 1 + ht.CHUNK_BITS + ht.CHUNK_BITS * (ht.CHUNK_BITS - 1) // 2
+    assert masks[0] == 0 and len(set(masks)) == len(masks)
+    assert [ht.hamming(mask, 0) for mask in masks] == sorted(ht.hamming(mask, 0) for mask in masks)
+
+
+@pytest.mark.parametrize("max_distance", [0, 3, 8, 12, 20])
+def test_multi_index_search_matches_a_brute_force_scan(max_distance):
+    rng = np.random.default_rng(max_distance)
+    base = [int(value) for value in rng.integers(0, 1 << 63, 50, dtype=np.uint64)]
+    # near copies of the first hashes so every distance up to 20 is represented
+    hashes = base + [value ^ int(sum(1 << int(bit) for bit in rng.choice(64, flips, replace=False)))
+                     for value, flips in zip(base, range(21))]
+    table = ht.MultiIndexHash(hashes)
+    for query in base[:10]:
+        expected = sorted((ht.hamming(query, value), row) for row, value in enumerate(hashes)
+                          if ht.hamming(query, value) <= max_distance)
+        assert table.search(query, max_distance) == expected
+
+
+@pytest.mark.parametrize("kind", sorted(ht.HASHES))
+def test_hashes_are_64_bit_and_stable_under_small_changes(kind):
+    rng = np.random.default_rng(0)
+    img = np.array(random_image(rng, size=64), dtype=np.uint8)
+    other = np.array(random_image(rng, size=64), dtype=np.uint8)
+    noisy = np.clip(img.astype(int) + rng.integers(-3, 4, img.shape), 0, 255).astype(np.uint8)
+    hash_image = ht.HASHES[kind]
+    assert 0 <= hash_image(img) < 1 << 64
+    assert ht.hamming(hash_image(img), hash_image(noisy)) < ht.hamming(hash_image(img), hash_image(other))
+
+
+def test_hash_index_finds_the_reference_and_is_cached(reference_folder, tmp_path):
+    reference = rt.ReferenceIndex.build("degods", reference_folder("degods", 20), str(tmp_path), size=64)
+    index = ht.HashIndex.open(reference, "phash")
+    assert len(index) == 20
+    assert index.nearest(np.asarray(reference.images[7]), max_distance=0)[0] == (0, 7)
+    assert ht.HashIndex.open(reference, "phash").hashes.tolist() == index.hashes.tolist()
+    with pytest.raises(ValueError):
+        ht.HashIndex.open(reference, "xhash")
@@ -0,0 +1,68 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils import http_tools as ht
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    calls = {}
+    connections = set()
+
+    def do_GET(self):
+        Handler.calls[self.path] = Handler.calls.get(self.path, 0) + 1
+        Handler.connections.add(self.client_address)
+        status = 503 if self.path == "/flaky" and Handler.calls[self.path] <= 2 else 200
+        status = 503 if self.path == "/down" else status
+        body = b"ok"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    Handler.calls, Handler.connections = {}, set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_calls_reuse_one_kept_alive_connection(base_url):
+    client = ht.TwitterClient()
+    for _ in range(5):
+        assert client.get(f"{base_url}/ok").status_code == 200
+    assert len(Handler.connections) == 1
+
+
+def test_get_is_retried_on_transient_server_errors(base_url):
+    client = ht.TwitterClient(retry=ht.default_retry(3, 0))
+    assert client.get(f"{base_url}/flaky").status_code == 200
+    assert Handler.calls["/flaky"] == 3
+    # the last response is handed back once the retries run out
+    assert client.get(f"{base_url}/down").status_code == 503
+    assert Handler.calls["/down"] == 4
+
+
+def test_post_is_not_retried(base_url):
+    client = ht.TwitterClient(retry=ht.default_retry(3, 0))
+    assert client.post(f"{base_url}/flaky").status_code == 503
+    assert Handler.calls["/flaky"] == 1
+
+
+def test_response_hooks_run_and_their_errors_are_contained(base_url):
+    client = ht.TwitterClient()
+    seen = []
+    client.add_response_hook(lambda response: seen.append(response.status_code))
+    client.add_response_hook(lambda response: 1 / 0)
+    assert client.get(f"{base_url}/ok").status_code == 200
+    assert seen == [200]
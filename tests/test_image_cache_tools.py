@@ -0,0 +1,105 @@
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+import pytest
+
+from tests.conftest import random_image
+from utils import image_cache_tools as ict
+
+
+class Response:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeClient:
+    """
+    Serves one png per url, answering 304 to a matching If-None-Match
+    """
+
+    def __init__(self, images):
+        self.images = images
+        self.calls = []
+
+    def get(self, url, headers=None):
+        self.calls.append((url, dict(headers or {})))
+        content = self.images[url]
+        etag = f'"{hash(content)}"'
+        if (headers or {}).get("If-None-Match") == etag:
+            return Response(304)
+        return Response(200, content, {"ETag": etag, "Content-Type": "image/png"})
+
+
+def png(seed):
+    buffer = BytesIO()
+    random_image(np.random.default_rng(seed)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def client():
+    return FakeClient({"https://pbs.twimg.com/a_normal.png": png(0),
+                       "https://pbs.twimg.com/b_normal.png": png(1),
+                       "https://pbs.twimg.com/a_copy_normal.png": png(0)})
+
+
+def test_folders_are_created_on_first_get(tmp_path, client):
+    folder = str(tmp_path / "cache")
+    cache = ict.ImageCache(folder, client, ttl=60)
+    assert not os.path.exists(folder)
+    cache.get("https://pbs.twimg.com/a_normal.png")
+    assert sorted(os.listdir(folder)) == ["blobs", "urls"]
+
+
+def test_hit_and_conditional_revalidation(tmp_path, client):
+    url = "https://pbs.twimg.com/a_normal.png"
+    cache = ict.ImageCache(str(tmp_path), client, ttl=60)
+    image = cache.get(url)
+    assert image.gray.shape == (64, 64)
+    assert cache.content(image) == client.images[url]
+    cache.get(url)
+    assert len(client.calls) == 1
+    # past the ttl a fresh cache (nothing in memory) revalidates with the stored ETag
+    cache = ict.ImageCache(str(tmp_path), client, ttl=0)
+    assert cache.get(url).content_hash == image.content_hash
+    assert client.calls[-1][1]["If-None-Match"] == image.etag
+
+
+def test_prune_removes_stale_urls_and_unreferenced_blobs(tmp_path, client):
+    cache = ict.ImageCache(str(tmp_path), client, ttl=60, max_age=100)
+    old_a = cache.get("https://pbs.twimg.com/a_normal.png")
+    cache.get("https://pbs.twimg.com/b_normal.png")
+    # a second url with the same image content keeps the shared blob alive
+    later = time.time() + 150
+    cache._store("https://pbs.twimg.com/a_copy_normal.png", client.images["https://pbs.twimg.com/a_copy_normal.png"],
+                  {}, later)
+    removed = cache.prune(now=later)
+    # 2 url files and the .bin/.npy of b
+    assert removed == 4
+    assert sorted(os.listdir(tmp_path / "urls")) == [ict._sha256(b"https://pbs.twimg.com/a_copy_normal.png") + ".json"]
+    assert sorted(os.listdir(tmp_path / "blobs")) == [old_a.content_hash + ".bin", old_a.content_hash + ".npy"]
+    assert not cache._memory
+
+
+def test_prune_keeps_recent_blobs_without_a_url(tmp_path, client):
+    cache = ict.ImageCache(str(tmp_path), client, ttl=60, max_age=100)
+    cache.get("https://pbs.twimg.com/a_normal.png")
+    for name in os.listdir(tmp_path / "urls"):
+        os.remove(tmp_path / "urls" / name)
+    # a store in progress has written its blobs but not its url yet
+    assert cache.prune() == 0
+    assert len(os.listdir(tmp_path / "blobs")) == 2
+
+
+def test_prune_runs_every_prune_every_stores(tmp_path, client, monkeypatch):
+    cache = ict.ImageCache(str(tmp_path), client, ttl=60, max_age=100, prune_every=2)
+    prunes = []
+    monkeypatch.setattr(cache, "prune", lambda now=None: prunes.append(now))
+    cache.get("https://pbs.twimg.com/a_normal.png")
+    assert prunes == []
+    cache.get("https://pbs.twimg.com/b_normal.png")
+    assert len(prunes) == 1
@@ -0,0 +1,32 @@
+import logging
+
+from utils import log_tools as lt
+
+
+class Exploding:
+    def __repr__(self):
+        raise AssertionError("formatted a record that was not emitted")
+
+
+def test_record_format():
+    record = lt._Record("user", {"username": "alice", "metrics": {"likes": 2}, "text": "gm all", "empty": ""}, 500)
+    assert str(record) == 'user username=alice metrics={"likes":2} text="gm all" empty=""'
+
+
+def test_long_values_are_truncated():
+    assert str(lt._Record("tweet", {"text": "x" * 20}, 5)) == 'tweet text="xxxxx...(+15 chars)"'
+
+
+def test_disabled_levels_are_never_formatted(caplog):
+    caplog.set_level(logging.INFO)
+    lt.log_event(logging.DEBUG, "payload", data=Exploding())
+    lt.log_sampled(logging.DEBUG, "payload", rate=1, data=Exploding())
+    assert caplog.records == []
+
+
+def test_log_sampled_rate(caplog):
+    caplog.set_level(logging.DEBUG)
+    for _ in range(10):
+        lt.log_sampled(logging.DEBUG, "never", rate=0)
+        lt.log_sampled(logging.DEBUG, "always", rate=1)
+    assert [record.getMessage() for record in caplog.records] == ["always"] * 10
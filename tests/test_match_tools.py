@@ -0,0 +1,31 @@
+import os
+
+from PIL import Image
+
+from utils import match_tools as mat
+
+
+def test_matcher_finds_the_reference_a_pfp_was_taken_from(tmp_path, reference_folder):
+    folders = {"y00ts": reference_folder("y00ts", 20, seed=1), "degods": reference_folder("degods", 20, seed=2)}
+    matcher = mat.PfpMatcher(folders, workers=2, top_k=3, threshold=0.5,
+                             index_dir=str(tmp_path / "index"), size=32)
+    try:
+        pfp = Image.open(os.path.join(folders["y00ts"], "7.png")).resize((48, 48))
+        verdicts, timings = matcher.match(pfp, "https://pbs.twimg.com/pfp.png")
+        assert verdicts["y00ts"].matched and verdicts["y00ts"].token == "7.png"
+        assert verdicts["y00ts"].tier == "match"
+        assert not verdicts["degods"].matched
+        assert set(timings) == {"hash_prefilter", "reference_loading", "ssim"}
+    finally:
+        matcher.close()
+
+
+def test_matcher_version_changes_with_its_settings(tmp_path, reference_folder):
+    folders = {"y00ts": reference_folder("y00ts", 3)}
+    first = mat.PfpMatcher(folders, 1, 3, 0.5, str(tmp_path / "index"), 32)
+    second = mat.PfpMatcher(folders, 1, 3, 0.6, str(tmp_path / "index"), 32)
+    try:
+        assert first.version != second.version
+    finally:
+        first.close()
+        second.close()
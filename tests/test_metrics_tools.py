@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from utils import metrics_tools as mt
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = mt.Histogram(buckets=(1, 5))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value)
+    assert histogram.cumulative() == [("1", 2), ("5", 3), ("+Inf", 4)]
+    assert (histogram.count, histogram.sum) == (4, 14.5)
+
+
+def test_render_prometheus():
+    registry = mt.MetricsRegistry()
+    registry.describe("calls_total", "Calls by outcome")
+    registry.inc("calls_total", outcome="ok")
+    registry.inc("calls_total", 2, outcome="ok")
+    registry.set_gauge("depth", 7)
+    registry.observe("latency", 0.002, stage="a")
+    text = registry.render_prometheus()
+    assert "# HELP calls_total Calls by outcome\n# TYPE calls_total counter\n" in text
+    assert 'calls_total{outcome="ok"} 3' in text
+    assert "depth 7" in text
+    assert 'latency_bucket{stage="a",le="0.005"} 1' in text
+    assert 'latency_count{stage="a"} 1' in text
+
+
+def test_timed_records_the_outcome_and_in_flight(monkeypatch):
+    registry = mt.MetricsRegistry()
+    monkeypatch.setattr(mt, "registry", registry)
+    with mt.timed("lookup"):
+        pass
+    with pytest.raises(KeyError):
+        with mt.timed("lookup"):
+            raise KeyError("missing")
+    snapshot = registry.to_dict()
+    assert snapshot["counters"]["stream_stage_total"] == {
+        '{outcome="ok",stage="lookup"}': 1, '{outcome="error",stage="lookup"}': 1}
+    assert snapshot["gauges"]["stream_stage_in_flight"] == {'{stage="lookup"}': 0}
+    assert snapshot["histograms"]["stream_stage_latency_seconds"]['{stage="lookup"}']["count"] == 2
+
+
+def test_dump_json(tmp_path, monkeypatch):
+    registry = mt.MetricsRegistry()
+    registry.inc("lines_total")
+    monkeypatch.setattr(mt, "registry", registry)
+    mt.dump_json(str(tmp_path / "metrics.json"))
+    with open(tmp_path / "metrics.json") as file:
+        assert json.load(file)["counters"] == {"lines_total": {"{}": 1}}
@@ -0,0 +1,146 @@
+import queue
+import threading
+
+import pytest
+
+from utils import pipeline_tools as pt
+
+
+def drain(work_queue):
+    items = []
+    while True:
+        try:
+            items.append(work_queue.get(timeout=0))
+        except queue.Empty:
+            return items
+        work_queue.task_done()
+
+
+def test_parse_line():
+    assert pt.parse_line(b'{"data": {"id": "1"}}') == {"data": {"id": "1"}}
+    assert pt.parse_line(b'{"errors": []}') is None
+    assert pt.parse_line(b"not json") is None
+
+
+def test_unknown_drop_policy():
+    with pytest.raises(ValueError):
+        pt.WorkQueue(1, "drop_random")
+
+
+def test_drop_newest_keeps_the_queued_tweets():
+    work_queue = pt.WorkQueue(2, "drop_newest")
+    assert [work_queue.put(i) for i in range(3)] == [True, True, False]
+    assert drain(work_queue) == [0, 1]
+    assert (work_queue.enqueued, work_queue.dropped) == (2, 1)
+
+
+def test_drop_oldest_keeps_the_newest_tweets():
+    work_queue = pt.WorkQueue(2, "drop_oldest")
+    assert all(work_queue.put(i) for i in range(4))
+    assert drain(work_queue) == [2, 3]
+    assert work_queue.dropped == 2
+
+
+def test_worker_pool_processes_every_item_and_counts_failures():
+    work_queue = pt.WorkQueue(100, "block")
+    seen, lock = [], threading.Lock()
+
+    def handler(item):
+        if item % 10 == 0:
+            raise ValueError(item)
+        with lock:
+            seen.append(item)
+
+    pool = pt.WorkerPool(work_queue, handler, workers=4, poll_interval=0.01)
+    pool.start()
+    for i in range(50):
+        work_queue.put(i)
+    pool.stop(drain=True)
+    assert sorted(seen) == [i for i in range(50) if i % 10]
+    assert (pool.processed, pool.failed) == (45, 5)
+
+
+def test_refreshing_set_keeps_the_last_keys_when_a_refresh_fails():
+    loads = [["a", "b"]]
+
+    def loader():
+        if not loads:
+            raise RuntimeError("database down")
+        return loads.pop()
+
+    keys = pt.RefreshingSet(loader, interval=60)
+    keys.refresh()
+    keys.refresh()
+    keys.add("c")
+    assert "a" in keys and "c" in keys and "d" not in keys
+
+
+def test_micro_batcher_sends_full_batches_and_routes_results():
+    calls = []
+
+    def fetch(keys):
+        calls.append(keys)
+        return {key: ValueError(key) if key == 3 else key * 2 for key in keys if key != 4}
+
+    batcher = pt.MicroBatcher(fetch, max_batch=3, max_wait=60)
+    batcher.start()
+    futures = [batcher.submit(key) for key in range(6)]
+    assert [future.result(timeout=5) for future in futures[:3]] == [0, 2, 4]
+    with pytest.raises(ValueError):
+        futures[3].result(timeout=5)
+    with pytest.raises(KeyError):
+        futures[4].result(timeout=5)
+    batcher.stop()
+    assert calls == [[0, 1, 2], [3, 4, 5]]
+
+
+def test_micro_batcher_sends_a_partial_batch_after_max_wait():
+    batcher = pt.MicroBatcher(lambda keys: {key: key for key in keys}, max_batch=100, max_wait=0.05)
+    batcher.start()
+    assert batcher.submit("a").result(timeout=5) == "a"
+    batcher.stop()
+    assert batcher.batches == 1
+
+
+def test_micro_batcher_fails_the_whole_batch_when_the_fetch_fails():
+    def fetch(keys):
+        raise ConnectionError("lookup failed")
+
+    batcher = pt.MicroBatcher(fetch, max_batch=2, max_wait=60)
+    batcher.start()
+    futures = [batcher.submit(key) for key in "ab"]
+    batcher.stop()
+    assert all(isinstance(future.exception(timeout=5), ConnectionError) for future in futures)
+
+
+def shed_counts(registry):
+    return registry.to_dict()["counters"].get("stream_shed_total", {})
+
+
+def test_priority_queue_serves_the_highest_priority_first():
+    work_queue = pt.PriorityWorkQueue(maxsize=10, backlog=10, min_priority=0)
+    for item, priority in [("a", 1), ("b", 5), ("c", 1), ("d", 3)]:
+        work_queue.put(item, priority)
+    assert drain(work_queue) == ["b", "d", "a", "c"]
+
+
+def test_priority_queue_drops_low_priority_tweets_past_the_backlog():
+    work_queue = pt.PriorityWorkQueue(maxsize=10, backlog=2, min_priority=5, shed_policy="drop")
+    assert [work_queue.put(item, priority) for item, priority in [("a", 1), ("b", 1), ("c", 1), ("d", 9)]] == \
+        [True, True, False, True]
+    assert drain(work_queue) == ["d", "a", "b"]
+
+
+def test_priority_queue_counts_one_outcome_per_tweet(monkeypatch):
+    registry = pt.mt.MetricsRegistry()
+    monkeypatch.setattr(pt.mt, "registry", registry)
+    work_queue = pt.PriorityWorkQueue(maxsize=3, backlog=1, min_priority=5, shed_policy="defer")
+    work_queue.put("a", 9)
+    work_queue.put("b", 1)
+    work_queue.put("c", 2)
+    # full: the newest lowest priority deferred tweet is shed, not counted as deferred as well
+    assert not work_queue.put("d", 1)
+    assert work_queue.put("e", 9)
+    assert drain(work_queue) == ["a", "e", "c"]
+    assert shed_counts(registry) == {'{reason="queue_full"}': 2, '{reason="deferred"}': 1}
+    assert (work_queue.enqueued, work_queue.dropped, work_queue.deferred) == (4, 2, 1)
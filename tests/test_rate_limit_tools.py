@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+from utils import rate_limit_tools as rl
+
+TWEETS_URL = "https://api.twitter.com/2/tweets?ids=1"
+
+
+@pytest.mark.parametrize("url, family", [
+    ("https://api.twitter.com/2/tweets/search/stream/rules", "rules"),
+    ("https://api.twitter.com/2/tweets/search/stream?expansions=author_id", "stream"),
+    ("https://api.twitter.com/2/users/12/tweets", "user_timeline"),
+    ("https://api.twitter.com/2/users?ids=12", "user_lookup"),
+    (TWEETS_URL, "tweet_lookup"),
+    ("https://api.twitter.com/1.1/statuses/show.json?id=1", "tweet_lookup_v1"),
+    ("https://api.twitter.com/2/spaces", "other"),
+    ("https://pbs.twimg.com/profile_images/1/a_normal.png", None),
+])
+def test_endpoint_family(url, family):
+    assert rl.endpoint_family(url) == family
+
+
+def test_burst_is_enforced_before_the_budget_is_known():
+    bucket = rl.TokenBucket("tweet_lookup", burst=3, default_limit=300)
+    now = time.time()
+    for _ in range(3):
+        assert bucket.wait_time(now) == 0
+        bucket.take()
+    # paced at the default budget of 300 calls per 15 minutes
+    assert bucket.wait_time(now) == pytest.approx(3.0)
+
+
+def test_headers_spread_the_remaining_budget_over_the_window():
+    bucket = rl.TokenBucket("tweet_lookup", burst=1, default_limit=300)
+    now = time.time()
+    bucket.update(limit=300, remaining=10, reset_at=now + 100, now=now)
+    bucket.take()
+    assert bucket.wait_time(now) == pytest.approx(10.0)
+    bucket.update(limit=300, remaining=0, reset_at=now + 50, now=now)
+    assert bucket.wait_time(now) == pytest.approx(50.0)
+
+
+def test_window_reset_goes_back_to_the_default_budget():
+    bucket = rl.TokenBucket("tweet_lookup", burst=2, default_limit=300)
+    now = time.time()
+    bucket.update(limit=300, remaining=0, reset_at=now + 10, now=now)
+    bucket.refill(now + 11)
+    assert (bucket.remaining, bucket.rate, bucket.tokens) == (None, bucket.default_rate, 2)
+
+
+def test_waiting_calls_are_released_highest_priority_first():
+    scheduler = rl.RateLimitScheduler(burst=1)
+    scheduler.acquire(TWEETS_URL)
+    # one call every 0.05s from here on
+    scheduler.update_from(TWEETS_URL, 200, {"x-rate-limit-limit": "300", "x-rate-limit-remaining": "20",
+                                            "x-rate-limit-reset": str(time.time() + 1)})
+    order = []
+    threads = [threading.Thread(target=lambda p=p: (scheduler.acquire(TWEETS_URL, p), order.append(p)))
+               for p in (1, 5, 3)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    assert order == [5, 3, 1] or order[1:] == [5, 3]
+
+
+def test_prioritized_sets_the_call_priority_of_the_block():
+    assert rl.call_priority.get() == 0
+    with rl.prioritized(7):
+        assert rl.call_priority.get() == 7
+    assert rl.call_priority.get() == 0
@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from utils import reference_tools as rt
+
+
+def test_build_stores_the_preprocessed_references(reference_folder, tmp_path):
+    folder = reference_folder("degods", 3)
+    index = rt.ReferenceIndex.build("degods", folder, str(tmp_path / "index"), size=16)
+    assert index.files == ["0.png", "1.png", "2.png"] and len(index) == 3
+    assert isinstance(index.images, np.memmap)
+    assert index.images.shape == (3, 16, 16)
+    with Image.open(os.path.join(folder, "1.png")) as img:
+        assert np.array_equal(index.images[1], rt.preprocess(img, 16))
+
+
+def test_open_reuses_an_up_to_date_index(reference_folder, tmp_path, monkeypatch):
+    folder = reference_folder("degods", 2)
+    index_dir = str(tmp_path / "index")
+    built = rt.ReferenceIndex.open("degods", folder, index_dir, size=16)
+    builds = []
+    monkeypatch.setattr(rt.ReferenceIndex, "build", classmethod(lambda cls, *args: builds.append(args)))
+    opened = rt.ReferenceIndex.open("degods", folder, index_dir, size=16)
+    assert builds == []
+    assert opened.fingerprint == built.fingerprint
+    assert np.array_equal(opened.images, built.images)
+
+
+def test_open_rebuilds_when_the_folder_or_size_changes(reference_folder, tmp_path):
+    folder = reference_folder("degods", 2)
+    index_dir = str(tmp_path / "index")
+    rt.ReferenceIndex.open("degods", folder, index_dir, size=16)
+    Image.new("L", (32, 32), 7).save(os.path.join(folder, "2.png"))
+    index = rt.ReferenceIndex.open("degods", folder, index_dir, size=16)
+    assert len(index) == 3 and index.images[2].tolist() == [[7] * 16] * 16
+    assert rt.ReferenceIndex.open("degods", folder, index_dir, size=8).images.shape == (3, 8, 8)
+
+
+def test_empty_collection(tmp_path):
+    folder = tmp_path / "empty"
+    folder.mkdir()
+    indexes = rt.open_indexes({"empty": str(folder)}, str(tmp_path / "index"), size=16)
+    assert len(indexes["empty"]) == 0
+    assert indexes["empty"].images.shape == (0, 16, 16)
@@ -0,0 +1,55 @@
+import gzip
+import os
+
+from utils import replay_tools as rt
+
+
+def record(path, count, flush_every):
+    recorder = rt.StreamRecorder(path, flush_every=flush_every)
+    for i in range(count):
+        recorder.record(f'{{"data": {{"id": "{i}"}}}}'.encode("utf-8"), ts=1000 + i)
+    return recorder
+
+
+def test_recording_round_trip(tmp_path):
+    path = str(tmp_path / "stream.jsonl.gz")
+    record(path, 5, flush_every=2).close()
+    record(path, 2, flush_every=2).close()
+    lines = list(rt.read_recording(path))
+    assert [ts for ts, _ in lines] == [1000, 1001, 1002, 1003, 1004, 1000, 1001]
+    assert lines[2][1] == b'{"data": {"id": "2"}}'
+
+
+def test_crashed_recording_replays_up_to_its_last_flush(tmp_path):
+    path = str(tmp_path / "stream.jsonl.gz")
+    # never closed - the lines after the last flush are lost
+    record(path, 25, flush_every=10)
+    assert len(list(rt.read_recording(path))) == 20
+
+
+def test_truncated_recording_replays_the_complete_members(tmp_path):
+    path = str(tmp_path / "stream.jsonl.gz")
+    record(path, 30, flush_every=10).close()
+    with open(path, "rb") as file:
+        data = file.read()
+    with open(path, "wb") as file:
+        file.write(data[:len(data) - 20])
+    # the complete members, and whatever could be decoded of the cut off one
+    timestamps = [ts for ts, _ in rt.read_recording(path)]
+    assert timestamps == list(range(1000, 1000 + len(timestamps)))
+    assert 20 <= len(timestamps) < 30
+
+
+def test_recording_cut_off_mid_stream_replays_what_was_decoded(tmp_path):
+    path = str(tmp_path / "stream.jsonl.gz")
+    with gzip.open(path, "wb") as file:
+        file.write(b"".join(b'{"ts": %d, "line": "x"}\n' % i for i in range(1000)))
+    os.truncate(path, os.path.getsize(path) // 2)
+    lines = list(rt.read_recording(path))
+    assert 0 < len(lines) < 1000
+
+
+def test_replay_as_fast_as_possible(tmp_path):
+    path = str(tmp_path / "stream.jsonl.gz")
+    record(path, 3, flush_every=1).close()
+    assert len(list(rt.replay_lines(path, speed=0))) == 3
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils import rule_tools as rut
+from utils import stream_tools as st
+
+CURRENT = [
+    {"id": "1", "value": "from:degods", "tag": "degods"},
+    {"id": "2", "value": "from:y00ts", "tag": "y00ts"},
+    {"id": "3", "value": "from:y00ts", "tag": "y00ts"},
+    {"id": "4", "value": "from:okaybears", "tag": "okay bears"},
+]
+
+
+def test_diff_keeps_unchanged_rules_and_drops_duplicates():
+    diff = rut.diff_rules(CURRENT, ["from:degods", "from:y00ts", "from:btc"], ["degods", "y00ts", "btc"])
+    assert diff.unchanged == 2
+    assert diff.delete == ["3", "4"]
+    assert diff.add == [{"value": "from:btc", "tag": "btc"}]
+    # adds go first so the stream never matches less than it should
+    assert diff.payloads(CURRENT) == [{"add": diff.add}, {"delete": {"ids": ["3", "4"]}}]
+
+
+def test_retagged_rule_is_deleted_before_it_is_added_again():
+    diff = rut.diff_rules(CURRENT[:2], ["from:degods", "from:y00ts"], ["degods", "y00ts v2"])
+    assert diff.retagged(CURRENT[:2]) == {"from:y00ts"}
+    assert diff.payloads(CURRENT[:2]) == [{"delete": {"ids": ["2"]}},
+                                          {"add": [{"value": "from:y00ts", "tag": "y00ts v2"}]}]
+
+
+def test_in_sync_rules_give_an_empty_diff():
+    diff = rut.diff_rules(CURRENT[:2], ["from:degods", "from:y00ts", "from:degods"], ["degods", "y00ts", "dup"])
+    assert diff.empty and diff.unchanged == 2 and diff.payloads(CURRENT[:2]) == []
+
+
+def test_every_rule_needs_a_tag():
+    with pytest.raises(ValueError):
+        rut.desired_rules(["from:degods"], [])
+
+
+def test_sync_rules_skips_the_dry_run_of_retagged_adds(monkeypatch):
+    posted = []
+    monkeypatch.setattr(st.Config, "get_config", lambda params: SimpleNamespace(
+        rules=["from:degods", "from:y00ts", "from:btc"], tags=["degods", "y00ts v2", "btc"]))
+    monkeypatch.setattr(st, "post_rules", lambda payload, dry_run=False: posted.append((payload, dry_run)) or {})
+    diff = st.sync_rules({"data": CURRENT[:2]})
+    assert diff.delete == ["2"]
+    assert posted == [
+        ({"delete": {"ids": ["2"]}}, True),
+        ({"add": [{"value": "from:btc", "tag": "btc"}]}, True),
+        ({"delete": {"ids": ["2"]}}, False),
+        ({"add": [{"value": "from:y00ts", "tag": "y00ts v2"}, {"value": "from:btc", "tag": "btc"}]}, False),
+    ]
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from skimage import metrics
+
+from utils import ssim_tools as sst
+
+
+def reference_ssim(image, references):
+    return np.array([metrics.structural_similarity(image, reference, data_range=255) for reference in references])
+
+
+@pytest.mark.parametrize("shape", [(7, 7), (16, 16), (33, 47), (64, 31), (48, 64)])
+@pytest.mark.parametrize("count", [1, 5])
+def test_matches_skimage(shape, count):
+    rng = np.random.default_rng(shape[0] * 100 + shape[1] + count)
+    image = rng.integers(0, 256, shape, dtype=np.uint8)
+    references = rng.integers(0, 256, (count,) + shape, dtype=np.uint8)
+    # a near copy, so scores close to 1 are covered too
+    references[0] = np.clip(image.astype(int) + rng.integers(-10, 11, shape), 0, 255)
+    np.testing.assert_allclose(sst.structural_similarity(image, references),
+                               reference_ssim(image, references), rtol=0, atol=1e-9)
+
+
+def test_batches_give_the_same_scores():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (21, 19), dtype=np.uint8)
+    references = rng.integers(0, 256, (9, 21, 19), dtype=np.uint8)
+    # one reference per batch, then several with a smaller last batch
+    for batch_pixels in (1, 4 * image.size):
+        np.testing.assert_allclose(sst.BatchedSSIM(image, batch_pixels=batch_pixels).score(references),
+                                   reference_ssim(image, references), rtol=0, atol=1e-9)
+
+
+def test_identical_images_score_one():
+    image = np.random.default_rng(1).integers(0, 256, (32, 32), dtype=np.uint8)
+    assert sst.structural_similarity(image, image[None])[0] == pytest.approx(1.0)
+
+
+def test_shapes_are_checked():
+    with pytest.raises(ValueError):
+        sst.BatchedSSIM(np.zeros((5, 32)))
+    with pytest.raises(ValueError):
+        sst.structural_similarity(np.zeros((32, 32)), np.zeros((2, 32, 31)))
@@ -0,0 +1,24 @@
+from utils import stream_tools as st
+
+
+def test_split_tweet_lookup_routes_includes_to_their_tweet():
+    json_response = {
+        "data": [
+            {"id": "1", "author_id": "10", "entities": {"mentions": [{"username": "Bob"}]},
+             "referenced_tweets": [{"type": "quoted", "id": "3"}]},
+            {"id": "2", "author_id": "20", "geo": {"place_id": "p"}},
+        ],
+        "includes": {
+            "users": [{"id": "10", "username": "alice"}, {"id": "20", "username": "bob"}],
+            "tweets": [{"id": "3", "text": "quoted"}],
+            "places": [{"id": "p", "full_name": "Somewhere"}],
+        },
+        "errors": [{"resource_id": "4", "title": "Not Found Error"}],
+    }
+    results = st.split_tweet_lookup(["1", "2", "4", "5"], json_response)
+    assert [user["id"] for user in results["1"]["includes"]["users"]] == ["10", "20"]
+    assert results["1"]["includes"]["tweets"] == [{"id": "3", "text": "quoted"}]
+    assert results["2"]["includes"] == {"users": [{"id": "20", "username": "bob"}],
+                                        "places": [{"id": "p", "full_name": "Somewhere"}]}
+    assert "Not Found Error" in str(results["4"])
+    assert "not returned by lookup" in str(results["5"])
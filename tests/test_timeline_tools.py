@@ -0,0 +1,86 @@
+import time
+
+from utils import timeline_tools as tt
+
+
+def tweet(tweet_id, likes, age=0.0):
+    return {"id": tweet_id, "created_at": tt.format_time(time.time() - age),
+            "public_metrics": {"like_count": likes, "retweet_count": 1, "reply_count": 0, "impression_count": 10}}
+
+
+class FakeTimeline:
+    """
+    The user tweets endpoint over a list of tweets, newest first, two per page
+    """
+
+    def __init__(self, tweets):
+        self.tweets = tweets
+        self.calls = []
+
+    def fetch_page(self, user_id, start_time, since_id, pagination_token):
+        self.calls.append((start_time is not None, since_id, pagination_token))
+        tweets = self.tweets
+        if since_id is not None:
+            tweets = [t for t in tweets if int(t["id"]) > int(since_id)]
+        start = int(pagination_token or 0)
+        meta = {"newest_id": tweets[0]["id"]} if tweets else {}
+        if start + 2 < len(tweets):
+            meta["next_token"] = str(start + 2)
+        return {"data": tweets[start:start + 2], "meta": meta}
+
+    def fetch_metrics(self, tweet_ids):
+        return {"data": [t for t in self.tweets if t["id"] in tweet_ids]}
+
+
+def test_parse_and_format_time_round_trip():
+    assert tt.parse_created_at(tt.format_time(1680307200)) == 1680307200
+    assert tt.parse_created_at("2023-04-01T00:00:00.000Z") == 1680307200
+
+
+def test_backfill_paginates_the_whole_timeline_then_only_fetches_new_tweets():
+    api = FakeTimeline([tweet(str(i), likes=i) for i in range(5, 0, -1)])
+    aggregator = tt.TimelineAggregator(api.fetch_page, api.fetch_metrics, fetch_interval=0)
+    assert aggregator.totals("u", 7) == {"likes": 15, "retweets": 5, "replies": 0, "impressions": 50}
+    assert [call[2] for call in api.calls] == [None, "2", "4"]
+
+    api.tweets.insert(0, tweet("6", likes=6))
+    api.calls = []
+    assert aggregator.totals("u", 7)["likes"] == 21
+    assert api.calls == [(False, "5", None)]
+
+
+def test_refresh_updates_metrics_and_forgets_deleted_tweets():
+    api = FakeTimeline([tweet("2", likes=2), tweet("1", likes=1)])
+    aggregator = tt.TimelineAggregator(api.fetch_page, api.fetch_metrics, fetch_interval=60, refresh_interval=0)
+    assert aggregator.totals("u", 7)["likes"] == 3
+    api.tweets = [tweet("2", likes=10)]
+    assert aggregator.totals("u", 7)["likes"] == 10
+
+
+def test_observe_takes_stream_metrics_of_stored_users_only():
+    api = FakeTimeline([tweet("1", likes=1)])
+    aggregator = tt.TimelineAggregator(api.fetch_page, api.fetch_metrics, fetch_interval=60)
+    aggregator.observe("u", tweet("2", likes=5))
+    aggregator.totals("u", 7)
+    aggregator.observe("u", tweet("2", likes=5))
+    aggregator.observe("u", tweet("1", likes=3))
+    assert aggregator.totals("u", 7)["likes"] == 8
+
+
+def test_old_tweets_only_count_in_the_longer_window():
+    api = FakeTimeline([tweet("2", likes=2), tweet("1", likes=1, age=10 * 86400)])
+    aggregator = tt.TimelineAggregator(api.fetch_page, api.fetch_metrics)
+    assert aggregator.totals("u", 30)["likes"] == 3
+    assert aggregator.totals("u", 7)["likes"] == 2
+
+
+def test_timelines_survive_a_restart(tmp_path):
+    path = str(tmp_path / "timelines.pickle")
+    api = FakeTimeline([tweet("1", likes=4)])
+    aggregator = tt.TimelineAggregator(api.fetch_page, api.fetch_metrics, fetch_interval=60)
+    aggregator.totals("u", 7)
+    aggregator.save(path)
+    api.calls = []
+    loaded = tt.TimelineAggregator.load(path, api.fetch_page, api.fetch_metrics, fetch_interval=0)
+    assert loaded.totals("u", 7)["likes"] == 4
+    assert api.calls == [(False, "1", None)]
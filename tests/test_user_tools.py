@@ -0,0 +1,99 @@
+import pytest
+
+from utils import user_tools as ut
+
+ALICE = {"id": "1", "username": "Alice", "name": "Alice A", "profile_image_url": "https://pbs/a_normal.png",
+         "description": "gm", "public_metrics": {"followers_count": 10}}
+BOB = {"id": "2", "username": "bob", "name": "Bob"}
+
+
+def test_profile_from_user_fills_in_missing_fields():
+    profile = ut.UserProfile.from_user(BOB)
+    assert (profile.profile_image_url, profile.description, profile.url, profile.followers) == \
+        ("None", "None", "None", 0)
+    assert ut.UserProfile.from_user(ALICE).followers == 10
+
+
+def test_has_profile_fields():
+    assert ut.has_profile_fields(ALICE)
+    assert not ut.has_profile_fields(BOB)
+
+
+def test_split_user_lookup_by_id():
+    json_response = {"data": [ALICE, BOB], "errors": [{"value": "3", "title": "Not Found Error"}]}
+    results = ut.split_user_lookup(["2", "1", "3", "4"], json_response, "id")
+    assert [results[key].username for key in ("1", "2")] == ["Alice", "bob"]
+    assert "Not Found Error" in str(results["3"])
+    assert "not returned by lookup" in str(results["4"])
+
+
+def test_split_user_lookup_by_username_ignores_case():
+    json_response = {"data": [ALICE], "errors": [{"value": "Ghost", "title": "Not Found Error"}]}
+    results = ut.split_user_lookup(["alice", "ghost"], json_response, "username")
+    assert results["alice"].id == "1"
+    assert "Not Found Error" in str(results["ghost"])
+
+
+def test_resolver_batches_the_users_of_a_tweet():
+    calls = []
+
+    def fetch_by_ids(ids):
+        calls.append(ids)
+        return {"data": [user for user in (ALICE, BOB) if user["id"] in ids]}
+
+    resolver = ut.UserResolver(fetch_by_ids, lambda usernames: {}, max_batch=100, max_wait=0.05)
+    try:
+        profiles = resolver.resolve_many([{"id": "1"}, {"id": "2"}, dict(ALICE, id="5")])
+    finally:
+        resolver.stop()
+    assert [profile.username for profile in profiles] == ["Alice", "bob", "Alice"]
+    # the user that already carried its profile fields was not looked up
+    assert calls == [["1", "2"]]
+
+
+def test_resolver_raises_for_a_missing_user():
+    resolver = ut.UserResolver(lambda ids: {"data": []}, lambda usernames: {}, max_wait=0.01)
+    try:
+        with pytest.raises(Exception, match="Cannot get user data"):
+            resolver.resolve(user_id="9")
+    finally:
+        resolver.stop()
+
+
+def test_profile_cache_ttl_and_max_age(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ut.time, "time", lambda: now[0])
+    cache = ut.ProfileCache(max_size=10, ttl=60, max_age=600)
+    cache.put(ut.UserProfile.from_user(ALICE))
+    assert cache.get(user_id="1") == (ut.UserProfile.from_user(ALICE), True)
+    assert cache.get(username="ALICE")[0].id == "1"
+    now[0] += 120
+    assert cache.get(user_id="1")[1] is False
+    now[0] += 600
+    assert cache.get(user_id="1") == (None, False)
+
+
+def test_profile_cache_evicts_the_least_recently_used():
+    cache = ut.ProfileCache(max_size=2, ttl=60, max_age=600)
+    cache.put(ut.UserProfile.from_user(ALICE))
+    cache.put(ut.UserProfile.from_user(BOB))
+    cache.get(user_id="1")
+    cache.put(ut.UserProfile.from_user(dict(BOB, id="3", username="carol")))
+    assert len(cache) == 2
+    assert cache.get(username="bob") == (None, False)
+    assert cache.get(user_id="1")[0] is not None
+
+
+def test_profile_cache_survives_a_restart_and_batches_writes(tmp_path):
+    path = str(tmp_path / "profiles.sqlite")
+    cache = ut.ProfileCache(max_size=10, ttl=60, max_age=600, path=path, flush_every=2, flush_interval=60)
+    cache.put(ut.UserProfile.from_user(ALICE))
+    assert ut.ProfileCache(10, 60, 600, path=path).get(user_id="1")[0] is None
+    # an unchanged fresh profile is not queued again
+    cache.put(ut.UserProfile.from_user(ALICE))
+    cache.put(ut.UserProfile.from_user(BOB))
+    reloaded = ut.ProfileCache(10, 60, 600, path=path)
+    assert [reloaded.get(user_id=user_id)[0].username for user_id in ("1", "2")] == ["Alice", "bob"]
+    cache.put(ut.UserProfile.from_user(dict(ALICE, name="Alice B")))
+    cache.flush()
+    assert ut.ProfileCache(10, 60, 600, path=path).get(user_id="1")[0].name == "Alice B"
@@ -0,0 +1,54 @@
+import pytest
+
+from utils import match_tools as mat
+from utils import verdict_cache_tools as vct
+
+URL = "https://pbs.twimg.com/profile_images/1/abc_normal.jpg"
+VERDICTS = {"degods": mat.PfpVerdict(True, "12.png", "match", 0.97), "y00ts": mat.PfpVerdict()}
+
+
+@pytest.mark.parametrize("url", [
+    URL,
+    "http://PBS.twimg.com/profile_images/1/abc_400x400.jpg",
+    "https://pbs.twimg.com/profile_images/1/abc_bigger.jpg?format=jpg#x",
+    "https://pbs.twimg.com/profile_images/1/abc.jpg",
+])
+def test_size_variants_share_one_key(url):
+    assert vct.normalize_url(url) == "https://pbs.twimg.com/profile_images/1/abc.jpg"
+
+
+def test_lookup_by_url_and_by_content(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(vct.time, "time", lambda: now[0])
+    cache = vct.VerdictCache(max_size=10, max_age=60, version="v1")
+    assert cache.get_by_url(URL) is None
+    cache.put(URL, "sha", VERDICTS)
+    assert cache.get_by_url(URL.replace("_normal", "_400x400")) == VERDICTS
+    assert cache.get_by_content("sha") == VERDICTS
+    now[0] += 61
+    assert cache.get_by_url(URL) is None
+
+
+def test_evicts_the_least_recently_used():
+    cache = vct.VerdictCache(max_size=3, max_age=60, version="v1")
+    cache.put(URL, "a", VERDICTS)
+    cache.get_by_url(URL)
+    cache.put(URL.replace("abc", "def"), "b", VERDICTS)
+    assert len(cache) == 3
+    assert cache.get_by_content("a") is None
+    assert cache.get_by_url(URL) == VERDICTS
+
+
+def test_survives_a_restart_batches_writes_and_drops_other_versions(tmp_path):
+    path = str(tmp_path / "verdicts.sqlite")
+    cache = vct.VerdictCache(10, 60, "v1", path=path, flush_every=4, flush_interval=60)
+    cache.put(URL, "a", VERDICTS)
+    # 2 keys per put - nothing is committed until the 4th
+    assert vct.VerdictCache(10, 60, "v1", path=path).get_by_content("a") is None
+    cache.put(URL.replace("abc", "def"), "b", VERDICTS)
+    assert vct.VerdictCache(10, 60, "v1", path=path).get_by_content("a") == VERDICTS
+    cache.put(URL.replace("abc", "ghi"), "c", VERDICTS)
+    cache.flush()
+    assert vct.VerdictCache(10, 60, "v1", path=path).get_by_content("c") == VERDICTS
+    assert len(vct.VerdictCache(10, 60, "v2", path=path)) == 0
+    assert len(vct.VerdictCache(10, 60, "v1", path=path)) == 0
@@ -0,0 +1,337 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Dict, List, Optional, Tuple, Union
+
+import aiohttp
+
+from utils import rate_limit_tools as rl
+from utils import stream_tools as st
+from utils import user_tools as ut
+
+'''
+Async counterparts of the Twitter calls in stream_tools, built on aiohttp - contains functions for:
+    - A client with one shared session and a semaphore capping the calls in flight
+    - A deadline per call covering the wait for rate limit budget, the semaphore and the response
+    - Tweet lookup, user lookup, user timeline, rules management and image download
+    - Running many calls at once under one deadline, cancelling whatever has not finished
+    - Enriching many tweets at once: their users and pfp images are fetched concurrently
+
+Calls wait on the same rate limit scheduler as st.client so the sync and async clients
+share one budget per endpoint family. Use from a running event loop:
+
+    async with AsyncTwitterClient() as client:
+        tweets = await client.get_data_by_ids(tweet_ids)
+'''
+
+RULES_URL = f"{st.API_BASE}/2/tweets/search/stream/rules"
+TWEET_EXPANSIONS = "author_id,entities.mentions.username,geo.place_id,referenced_tweets.id"
+
+
+class AsyncTwitterClient:
+    """
+    aiohttp client shared by all async Twitter calls
+
+    :param bearer_token: the API bearer token (defaults to the one stream_tools reads from the env)
+    :param concurrency: the maximum number of calls in flight
+    :param timeout: (connect, read) timeout in seconds for every call
+    :param deadline: default seconds a call may take in total, None for no deadline
+    :param scheduler: rate limit scheduler every call waits on (defaults to st.scheduler)
+    """
+
+    def __init__(self,
+                 bearer_token: Optional[str] = None,
+                 concurrency: int = st.params.async_concurrency,
+                 timeout: Tuple[float, float] = (st.params.http_connect_timeout, st.params.http_read_timeout),
+                 deadline: Optional[float] = st.params.async_deadline,
+                 scheduler: Optional[rl.RateLimitScheduler] = None):
+        self.bearer_token = bearer_token or st.bearer_token
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.deadline = deadline
+        self.scheduler = scheduler if scheduler is not None else st.scheduler
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> "AsyncTwitterClient":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def start(self) -> None:
+        """
+        Open the shared session - must be called from the event loop it will be used on
+        """
+        if self.session is None:
+            connect, read = self.timeout
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(connect=connect, sock_read=read),
+                headers={"User-Agent": "v2FilteredStreamPython"},
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self,
+                      method: str,
+                      url: str,
+                      expected: Tuple[int, ...] = (200,),
+                      error: str = "Cannot get data",
+                      read: str = "json",
+                      deadline: Optional[float] = None,
+                      priority: float = 0,
+                      auth: bool = True,
+                      **kwargs) -> Any:
+        """
+        Send a request on the shared session and return its body
+
+        :param method: HTTP method
+        :param url: (Self-explanatory)
+        :param expected: the status codes that are not an error
+        :param error: start of the exception message on any other status code
+        :param read: "json" or "bytes" - how the body is returned
+        :param deadline: seconds the whole call may take (defaults to the client deadline) -
+            asyncio.TimeoutError is raised and the call cancelled when it runs out
+        :param priority: calls waiting on the rate limit with a higher priority are sent first
+        :param auth: whether to send the bearer token (not needed for images)
+        :param kwargs: any aiohttp request keyword argument (json, params, headers...)
+        """
+        await self.start()
+        deadline = self.deadline if deadline is None else deadline
+        call = self._request(method, url, expected, error, read, priority, auth, deadline, **kwargs)
+        if deadline is None:
+            return await call
+        return await asyncio.wait_for(call, deadline)
+
+    async def _request(self, method, url, expected, error, read, priority, auth, deadline, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        give_up_at = loop.time() + deadline if deadline is not None else None
+        # budget first: a call waiting for its family's window to reset must not hold a slot
+        # other families could be sending on
+        if self.scheduler is not None:
+            await self._acquire(url, priority, give_up_at)
+        async with self._semaphore:
+            headers = dict(kwargs.pop("headers", {}))
+            if auth:
+                headers["Authorization"] = f"Bearer {self.bearer_token}"
+            async with self.session.request(method, url, headers=headers, **kwargs) as response:
+                if self.scheduler is not None:
+                    self.scheduler.update_from(url, response.status, response.headers)
+                if response.status not in expected:
+                    raise Exception(
+                        "{} (HTTP {}): {}".format(error, response.status, await response.text()))
+                if read == "bytes":
+                    return await response.read()
+                return await response.json()
+
+    async def _acquire(self, url: str, priority: float, give_up_at: Optional[float]) -> None:
+        """
+        Wait for rate limit budget for a call to url. The scheduler blocks on a thread condition so
+        the wait runs off the event loop - bounded by what is left of the deadline, and told to give
+        up when the call is cancelled, so no budget is taken for a call that will never be sent.
+        """
+        timeout = None
+        if give_up_at is not None:
+            timeout = max(0.0, give_up_at - asyncio.get_running_loop().time())
+        cancelled = threading.Event()
+        try:
+            acquired = await asyncio.to_thread(self.scheduler.acquire, url, priority, timeout, cancelled)
+        except asyncio.CancelledError:
+            self.scheduler.cancel(cancelled)
+            raise
+        if not acquired:
+            raise asyncio.TimeoutError(f"No rate limit budget for {url} before the deadline")
+
+    # RULES
+    async def get_rules(self) -> Dict:
+        return await self.request("GET", RULES_URL, error="Cannot get rules")
+
+    async def add_rules(self, rules: List[Dict[str, str]], dry_run: bool = False) -> Dict:
+        """
+        :param rules: list of {"value": rule, "tag": tag}
+        :param dry_run: validate the rules without changing the stream
+        """
+        json_response = await self.request(
+            "POST", RULES_URL, expected=(200, 201), error="Cannot add rules",
+            json={"add": rules}, params={"dry_run": "true"} if dry_run else None)
+        if json_response.get("errors"):
+            raise Exception(
+                "Cannot add rules{}: {}".format(" (dry run)" if dry_run else "", json_response["errors"]))
+        return json_response
+
+    async def delete_rules(self, rule_ids: List[str], dry_run: bool = False) -> Dict:
+        json_response = await self.request(
+            "POST", RULES_URL, error="Cannot delete rules",
+            json={"delete": {"ids": [str(rule_id) for rule_id in rule_ids]}},
+            params={"dry_run": "true"} if dry_run else None)
+        if json_response.get("errors"):
+            raise Exception(
+                "Cannot delete rules{}: {}".format(" (dry run)" if dry_run else "", json_response["errors"]))
+        return json_response
+
+    # TWEETS
+    async def get_data_by_id(self, tweet_id: str, **kwargs) -> Dict:
+        return await self.request(
+            "GET",
+            f"{st.API_BASE}/2/tweets/{str(tweet_id)}?expansions={TWEET_EXPANSIONS}&media.fields=url&poll.fields=options&tweet.fields=public_metrics,created_at&user.fields={ut.USER_FIELDS}",
+            error="Cannot get tweet data", **kwargs)
+
+    async def get_data_by_ids(self, tweet_ids: List[str], **kwargs) -> Dict:
+        if len(tweet_ids) > 100:
+            raise ValueError(
+                f"Tweet lookup accepts at most 100 IDs, got {len(tweet_ids)}")
+        ids = ",".join(str(tweet_id) for tweet_id in tweet_ids)
+        return await self.request(
+            "GET",
+            f"{st.API_BASE}/2/tweets?ids={ids}&expansions={TWEET_EXPANSIONS}&media.fields=url&poll.fields=options&tweet.fields=public_metrics,created_at&user.fields={ut.USER_FIELDS}",
+            error="Cannot get tweet data", **kwargs)
+
+    async def get_tweet_metrics_by_ids(self, tweet_ids: List[str], **kwargs) -> Dict:
+        ids = ",".join(str(tweet_id) for tweet_id in tweet_ids)
+        return await self.request(
+            "GET", f"{st.API_BASE}/2/tweets?ids={ids}&tweet.fields=public_metrics,created_at",
+            error="Cannot get tweet metrics", **kwargs)
+
+    # USERS
+    async def get_users_by_ids(self, user_ids: List[str], **kwargs) -> Dict:
+        ids = ",".join(str(user_id) for user_id in user_ids)
+        return await self.request(
+            "GET", f"{st.API_BASE}/2/users?ids={ids}&user.fields={ut.USER_FIELDS}",
+            error="Cannot get user data", **kwargs)
+
+    async def get_users_by_usernames(self, usernames: List[str], **kwargs) -> Dict:
+        names = ",".join(str(username) for username in usernames)
+        return await self.request(
+            "GET", f"{st.API_BASE}/2/users/by?usernames={names}&user.fields={ut.USER_FIELDS}",
+            error="Cannot get user data", **kwargs)
+
+    async def get_user_tweets_page(self,
+                                   user_id: str,
+                                   start_time: Optional[str] = None,
+                                   since_id: Optional[str] = None,
+                                   pagination_token: Optional[str] = None,
+                                   **kwargs) -> Dict:
+        url = f"{st.API_BASE}/2/users/{str(user_id)}/tweets?max_results=100&tweet.fields=public_metrics,created_at"
+        if since_id:
+            url += f"&since_id={since_id}"
+        elif start_time:
+            url += f"&start_time={start_time}"
+        if pagination_token:
+            url += f"&pagination_token={pagination_token}"
+        return await self.request("GET", url, error="Failed to get user metrics", **kwargs)
+
+    # IMAGES
+    async def download_image(self, url: str, **kwargs) -> bytes:
+        return await self.request(
+            "GET", url, read="bytes", auth=False, error="Cannot download image", **kwargs)
+
+
+async def gather_with_deadline(calls: List[Awaitable], deadline: Optional[float]) -> List[Any]:
+    """
+    Run calls concurrently and cancel the ones still running when the deadline passes
+
+    :param calls: the coroutines to run
+    :param deadline: seconds all calls may take together, None for no deadline
+
+    return: the result of each call in order, or the exception it raised
+        (asyncio.TimeoutError for calls cancelled at the deadline)
+    """
+    tasks = [asyncio.ensure_future(call) for call in calls]
+    if not tasks:
+        return []
+    try:
+        _, pending = await asyncio.wait(tasks, timeout=deadline)
+    except asyncio.CancelledError:
+        # cancelled by the caller - take every call down with it
+        for task in tasks:
+            task.cancel()
+        raise
+    for task in pending:
+        task.cancel()
+    if pending:
+        logging.warning(f"Cancelled {len(pending)} of {len(tasks)} calls at the {deadline}s deadline")
+        await asyncio.gather(*pending, return_exceptions=True)
+    return [asyncio.TimeoutError() if task in pending
+            else task.exception() or task.result() for task in tasks]
+
+
+async def lookup_tweets(client: AsyncTwitterClient, tweet_ids: List[str]) -> Dict[str, Union[Dict, Exception]]:
+    """
+    Look up any number of tweets, 100 per call with all calls in flight at once
+
+    return: dict of tweet ID to its tweet data (see st.split_tweet_lookup), or to an Exception
+    """
+    chunks = [tweet_ids[i:i + 100] for i in range(0, len(tweet_ids), 100)]
+    responses = await asyncio.gather(*(client.get_data_by_ids(chunk) for chunk in chunks),
+                                     return_exceptions=True)
+    results: Dict[str, Union[Dict, Exception]] = {}
+    for chunk, response in zip(chunks, responses):
+        if isinstance(response, Exception):
+            results.update({tweet_id: response for tweet_id in chunk})
+        else:
+            results.update(st.split_tweet_lookup(chunk, response))
+    return results
+
+
+async def resolve_users(client: AsyncTwitterClient, users: List[Dict]) -> List[Union[ut.UserProfile, Exception]]:
+    """
+    Resolve the profiles of users from tweet includes - users that already carry the
+    profile fields are not looked up, the others are looked up 100 per call concurrently
+
+    return: the profile of each user in order, or the Exception it could not be resolved with
+    """
+    missing = list(dict.fromkeys(str(user["id"]) for user in users if not ut.has_profile_fields(user)))
+    chunks = [missing[i:i + 100] for i in range(0, len(missing), 100)]
+    responses = await asyncio.gather(*(client.get_users_by_ids(chunk) for chunk in chunks),
+                                     return_exceptions=True)
+    found: Dict[str, Union[ut.UserProfile, Exception]] = {}
+    for chunk, response in zip(chunks, responses):
+        if isinstance(response, Exception):
+            found.update({user_id: response for user_id in chunk})
+        else:
+            found.update(ut.split_user_lookup(chunk, response, "id"))
+    return [ut.UserProfile.from_user(user) if ut.has_profile_fields(user) else found[str(user["id"])]
+            for user in users]
+
+
+async def enrich_tweets(client: AsyncTwitterClient,
+                        tweet_ids: List[str],
+                        deadline: Optional[float] = None) -> Dict[str, Union[Tuple[Dict, List[Tuple[ut.UserProfile, Union[bytes, Exception]]]], Exception]]:
+    """
+    Fetch everything process_tweet needs from the network for many tweets at once: the tweets,
+    the profiles of all of their users and every pfp image, each step fully concurrent
+
+    :param tweet_ids: (Self-explanatory)
+    :param deadline: seconds the pfp downloads may take together - slower ones are cancelled
+
+    return: dict of tweet ID to (tweet data, [(profile, pfp image bytes or Exception)]), or to an Exception
+    """
+    tweets = await lookup_tweets(client, tweet_ids)
+    users = {}
+    for tweet_data in tweets.values():
+        if not isinstance(tweet_data, Exception):
+            for user in tweet_data["includes"]["users"]:
+                users.setdefault(user["id"], user)
+    profiles = dict(zip(users, await resolve_users(client, list(users.values()))))
+    resolved = [profile for profile in profiles.values() if not isinstance(profile, Exception)]
+    images = dict(zip(
+        (profile.id for profile in resolved),
+        await gather_with_deadline(
+            [client.download_image(profile.profile_image_url) for profile in resolved], deadline)))
+
+    results = {}
+    for tweet_id, tweet_data in tweets.items():
+        if isinstance(tweet_data, Exception):
+            results[tweet_id] = tweet_data
+            continue
+        results[tweet_id] = (tweet_data, [
+            (profiles[user["id"]], images[user["id"]])
+            for user in tweet_data["includes"]["users"]
+            if not isinstance(profiles[user["id"]], Exception)])
+    return results
@@ -1,6 +1,6 @@
 from dataclasses import dataclass, field
 import os
-from typing import List
+from typing import Dict, List
 from dotenv import load_dotenv
 if 'GITHUB_ACTION' not in os.environ:
     load_dotenv()
@@ -27,6 +27,69 @@ class Config:
     :param database_host: the hostname of the render endpoint hosting the api
     :param update_flag: bool telling whether or not to update the stream rules
     :param timeout: the length of the timeout wait for discord (TODO: and twitter?) stream - currently just discord
+    :param history: the number of days of tweet metrics to aggregate per user
+    :param pfp_threshold: the minimum structural similarity for a pfp to be a likely collection match
+    :param queue_size: the maximum number of streamed tweets buffered for the enrichment workers
+    :param queue_drop_policy: what to do when the queue is full - block, drop_newest or drop_oldest
+    :param enrichment_workers: the number of worker threads enriching streamed tweets
+    :param stream_stall_timeout: seconds without data or keep-alive heartbeat before the stream is reconnected
+    :param stream_healthy_after: seconds the stream has to stay connected before its reconnect backoff starts over
+    :param record_path: when set, every raw stream line is appended to this gzipped recording for replay
+    :param lookup_batch_size: the maximum number of streamed tweets resolved per tweet lookup call (max 100)
+    :param lookup_batch_wait: the maximum seconds a streamed tweet waits for its lookup batch to fill
+    :param stream_expansions: request users, metrics, pfp and bio fields on the stream itself instead of per-tweet lookups
+    :param dedupe_size: the number of recent tweet IDs remembered exactly to drop redelivered tweets
+    :param dedupe_bloom_capacity: the number of older tweet IDs per Bloom filter generation
+    :param dedupe_error_rate: the Bloom filter false positive rate (new tweets wrongly dropped)
+    :param dedupe_path: when set, seen tweet IDs are persisted here so they survive restarts
+    :param dedupe_save_every: the number of new tweets between saves of the seen tweet IDs
+    :param metrics_port: when set, stream pipeline metrics are served in Prometheus format on this port
+    :param metrics_dump_path: when set, stream pipeline metrics are dumped as JSON to this file
+    :param metrics_dump_interval: seconds between JSON metric dumps
+    :param reference_folders: collection name -> folder of reference images pfps are matched against
+    :param pfp_top_k: the number of nearest perceptual hash candidates per collection a pfp is verified against with SSIM
+    :param match_workers: the number of processes matching pfps (0 for one per core)
+    :param priority_scheduling: process streamed tweets by priority instead of arrival order
+    :param priority_tag_weights: matching rule tag -> score added to tweets matching it
+    :param priority_member_weight: score added to tweets whose author is already on the leaderboard
+    :param priority_backlog: past this many queued tweets, tweets scoring below priority_min_score are shed
+    :param priority_min_score: the score a tweet needs to be queued normally while over the backlog
+    :param priority_shed_policy: drop tweets scoring below priority_min_score while over the backlog, or defer them until no other tweet is waiting
+    :param priority_refresh_interval: seconds between reloads of the leaderboard members
+    :param log_sample_rate: fraction of streamed tweets whose full payloads are logged at DEBUG
+    :param display_pfps: show the pfps being matched in OpenCV windows (drawn by the stream reader thread, needs a desktop OpenCV build)
+    :param http_pool_size: the maximum number of kept-alive connections per host shared by all Twitter calls
+    :param http_connect_timeout: seconds to wait for a connection to a Twitter endpoint
+    :param http_read_timeout: seconds to wait for a Twitter endpoint to respond
+    :param http_retries: the maximum number of retries of a GET/HEAD on transient server errors
+    :param http_backoff_factor: exponential backoff factor in seconds between those retries
+    :param rate_limit_burst: the maximum number of calls per endpoint family sent back to back before pacing
+    :param user_batch_size: the maximum number of users resolved per user lookup call (max 100)
+    :param user_batch_wait: the maximum seconds a user waits for its lookup batch to fill
+    :param profile_cache_size: the maximum number of user profiles cached in memory
+    :param profile_cache_ttl: seconds before a cached profile is refreshed in the background
+    :param profile_cache_max_age: seconds before a cached profile is no longer served at all
+    :param profile_cache_path: when set, user profiles are also cached in this sqlite file so restarts start warm
+    :param timeline_fetch_interval: seconds during which a user's stored engagement totals are served without fetching new tweets
+    :param timeline_refresh_interval: seconds between metrics refreshes of a user's older tweets still in the window
+    :param timeline_path: when set, the stored user timelines are saved to this file and reloaded on restart
+    :param engagement_windows: the windows in days whose engagement totals are kept running per user (read in O(1))
+    :param async_concurrency: the maximum number of calls in flight on the async Twitter client
+    :param async_deadline: default seconds an async Twitter call may take in total before it is cancelled
+    :param image_cache_path: the folder pfp images are cached in, by profile image url
+    :param image_cache_ttl: seconds a cached pfp is used before it is revalidated with a conditional GET
+    :param image_cache_memory: the number of decoded pfps also kept in memory
+    :param image_cache_max_age: seconds a pfp url not validated since is removed from the disk cache, with its
+        image once no other url refers to it
+    :param reference_index_dir: the folder the preprocessed, memory-mapped reference image indexes are kept in
+    :param reference_size: the resolution pfps and reference images are compared at (size x size)
+    :param pfp_hash: the perceptual hash references are indexed by for full-collection search - ahash, dhash or phash
+    :param pfp_hash_distance: the maximum Hamming distance of a hash candidate - collections with none skip SSIM
+    :param verdict_cache_size: the number of profile image urls and image hashes whose pfp verdicts are kept in memory
+    :param verdict_cache_max_age: seconds a pfp verdict is reused before the avatar is matched again
+    :param verdict_cache_path: when set, pfp verdicts are also cached in this sqlite file so restarts start warm
+    :param twitter_api_base: base url of the Twitter API - point it at standalone_utils/fake_twitter_api.py
+        (or set TWITTER_API_BASE) to load test offline
     """
 
 
@@ -51,6 +114,69 @@ class Config:
     update_flag: bool = False
     timeout: int = 10
     history: int = 30
+    pfp_threshold: float = 0.5
+    queue_size: int = 1000
+    queue_drop_policy: str = "drop_oldest"
+    enrichment_workers: int = 4
+    stream_stall_timeout: int = 30
+    stream_healthy_after: int = 60
+    record_path: str = ""
+    lookup_batch_size: int = 100
+    lookup_batch_wait: float = 0.5
+    stream_expansions: bool = True
+    dedupe_size: int = 100000
+    dedupe_bloom_capacity: int = 1000000
+    dedupe_error_rate: float = 0.0001
+    dedupe_path: str = ""
+    dedupe_save_every: int = 1000
+    metrics_port: int = 0
+    metrics_dump_path: str = ""
+    metrics_dump_interval: int = 60
+    reference_folders: Dict[str, str] = field(default_factory=lambda: {
+        "y00ts": "outputs/y00ts_imgs",
+        "degods": "outputs/degods_imgs",
+    })
+    pfp_top_k: int = 5
+    match_workers: int = 0
+    priority_scheduling: bool = True
+    priority_tag_weights: Dict[str, float] = field(default_factory=dict)
+    priority_member_weight: float = 10
+    priority_backlog: int = 200
+    priority_min_score: float = 3
+    priority_shed_policy: str = "drop"
+    priority_refresh_interval: int = 300
+    log_sample_rate: float = 0.01
+    display_pfps: bool = False
+    http_pool_size: int = 20
+    http_connect_timeout: float = 5
+    http_read_timeout: float = 30
+    http_retries: int = 3
+    http_backoff_factor: float = 0.5
+    rate_limit_burst: int = 5
+    user_batch_size: int = 100
+    user_batch_wait: float = 0.2
+    profile_cache_size: int = 10000
+    profile_cache_ttl: int = 60 * 60
+    profile_cache_max_age: int = 7 * 24 * 60 * 60
+    profile_cache_path: str = ""
+    timeline_fetch_interval: int = 60
+    timeline_refresh_interval: int = 60 * 60
+    timeline_path: str = ""
+    engagement_windows: List[int] = field(default_factory=lambda: [7, 30])
+    async_concurrency: int = 20
+    async_deadline: float = 60
+    image_cache_path: str = "outputs/pfp_cache"
+    image_cache_ttl: int = 24 * 60 * 60
+    image_cache_memory: int = 1000
+    image_cache_max_age: int = 30 * 24 * 60 * 60
+    reference_index_dir: str = "outputs/reference_index"
+    reference_size: int = 64
+    pfp_hash: str = "phash"
+    pfp_hash_distance: int = 10
+    verdict_cache_size: int = 100000
+    verdict_cache_max_age: int = 7 * 24 * 60 * 60
+    verdict_cache_path: str = ""
+    twitter_api_base: str = os.environ.get("TWITTER_API_BASE", "https://api.twitter.com")
 
     # Retrieval functions for apis to use in the case of no local config instance at call-time
     def get_config(self):
@@ -0,0 +1,203 @@
+import logging
+import random
+import time
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import requests
+
+'''
+Tools for keeping the filtered stream connected - contains functions for:
+    - Classifying stream errors (rate limit, server, client, network, stall)
+    - Exponential backoff with jitter per error class
+    - Waiting until the advertised x-rate-limit-reset time on HTTP 429
+    - Detecting stalls from missing keep-alive heartbeats
+    - Reconnecting in a loop instead of recursing into get_stream
+
+Twitter sends a keep-alive newline every 20 seconds, so a read timeout a little
+above that means the connection has stalled and should be dropped and resumed.
+'''
+
+# error class -> (initial backoff seconds, max backoff seconds)
+BACKOFF_POLICIES: Dict[str, Tuple[float, float]] = {
+    "network": (0.25, 16),
+    "stall": (0.25, 16),
+    "server": (5, 320),
+    "client": (5, 320),
+    "rate_limit": (60, 900),
+}
+
+
+def classify_status(status_code: int) -> str:
+    """
+    Map an HTTP status code of the stream connection to an error class
+    """
+    if status_code == 429:
+        return "rate_limit"
+    if status_code >= 500:
+        return "server"
+    return "client"
+
+
+def backoff_delay(error_class: str, attempt: int) -> float:
+    """
+    Exponential backoff with equal jitter for the given error class
+
+    :param error_class: one of the BACKOFF_POLICIES keys
+    :param attempt: the number of consecutive failures of this class (starting at 0)
+
+    :return: seconds to wait before reconnecting
+    """
+    initial, cap = BACKOFF_POLICIES[error_class]
+    delay = min(cap, initial * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def rate_limit_delay(headers: Dict[str, str], now: Optional[float] = None) -> Optional[float]:
+    """
+    Seconds until the advertised rate limit reset, None if not advertised
+
+    :param headers: response headers of the rejected request
+    :param now: current epoch time (defaults to time.time())
+    """
+    reset = headers.get("x-rate-limit-reset")
+    if reset is None:
+        return None
+    try:
+        reset_at = float(reset)
+    except ValueError:
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, reset_at - now)
+
+
+class StreamConnection:
+    """
+    Connection manager for the filtered stream that reconnects in a loop
+
+    :param url: the stream endpoint
+    :param auth: requests auth callable for the bearer token
+    :param params: query parameters for the stream connection
+    :param stall_timeout: seconds without any data or heartbeat before the connection is treated as stalled
+    :param connect_timeout: seconds to wait for the connection to open
+    :param on_client_error: called once per client error (4xx) before retrying - e.g. to reset the stream rules
+    :param on_reconnect: called each time the stream has to be reconnected
+    :param max_client_errors: consecutive client errors tolerated before giving up
+    :param healthy_after: seconds a connection has to stay up before the backoff starts over -
+        a stream that connects and then keeps stalling backs off further each time
+    """
+
+    def __init__(self,
+                 url: str,
+                 auth: Callable,
+                 params: Optional[Dict] = None,
+                 stall_timeout: float = 30,
+                 connect_timeout: float = 10,
+                 on_client_error: Optional[Callable[[], None]] = None,
+                 on_reconnect: Optional[Callable[[], None]] = None,
+                 max_client_errors: int = 3,
+                 healthy_after: float = 60):
+        self.url = url
+        self.auth = auth
+        self.params = params or {}
+        self.stall_timeout = stall_timeout
+        self.connect_timeout = connect_timeout
+        self.on_client_error = on_client_error
+        self.on_reconnect = on_reconnect
+        self.max_client_errors = max_client_errors
+        self.healthy_after = healthy_after
+        self.reconnects = 0
+        self._attempts: Dict[str, int] = {}
+        self._response: Optional[requests.Response] = None
+        self._connected_at = 0.0
+        self._closed = False
+
+    def connect(self) -> requests.Response:
+        """
+        Open the stream, retrying with backoff until it returns HTTP 200
+        """
+        while not self._closed:
+            try:
+                response = requests.get(
+                    self.url,
+                    auth=self.auth,
+                    params=self.params,
+                    stream=True,
+                    timeout=(self.connect_timeout, self.stall_timeout),
+                )
+            except requests.exceptions.RequestException as e:
+                self._wait("network", reason=str(e))
+                continue
+
+            logging.info(f"Status: {response.status_code}")
+            if response.status_code == 200:
+                self._connected_at = time.monotonic()
+                self._response = response
+                return response
+
+            error_class = classify_status(response.status_code)
+            text = response.text
+            response.close()
+            if error_class == "rate_limit":
+                logging.error("TOO MANY REQUESTS")
+                delay = rate_limit_delay(response.headers)
+                if delay is not None:
+                    # the backoff is the floor - a reset already in the past must not retry at once
+                    self._wait(error_class, f"rate limit resets in {delay:.0f}s", at_least=delay)
+                    continue
+            elif error_class == "client":
+                if self._attempts.get("client", 0) >= self.max_client_errors:
+                    raise Exception(
+                        "Cannot get stream (HTTP {}): {}".format(
+                            response.status_code, text)
+                    )
+                if self.on_client_error is not None:
+                    self.on_client_error()
+            self._wait(error_class, reason=f"HTTP {response.status_code}: {text}")
+        raise Exception("Stream connection closed")
+
+    def lines(self) -> Iterator[bytes]:
+        """
+        Yield non keep-alive lines from the stream forever, reconnecting on errors and stalls
+        """
+        while not self._closed:
+            response = self.connect()
+            try:
+                for response_line in response.iter_lines():
+                    if self._closed:
+                        return
+                    if response_line:
+                        yield response_line
+                # the server closed the stream cleanly
+                error_class, reason = "network", "stream closed by server"
+            except requests.exceptions.ConnectionError as e:
+                # urllib3 read timeouts surface as connection errors while streaming
+                error_class, reason = "stall", f"no data or heartbeat for {self.stall_timeout}s: {e}"
+            except requests.exceptions.RequestException as e:
+                error_class, reason = "network", str(e)
+            finally:
+                response.close()
+            if self._closed:
+                return
+            if time.monotonic() - self._connected_at >= self.healthy_after:
+                self._attempts.clear()
+            self.reconnects += 1
+            if self.on_reconnect is not None:
+                self.on_reconnect()
+            self._wait(error_class, reason=reason)
+
+    def close(self) -> None:
+        """
+        Stop reconnecting and close the current response
+        """
+        self._closed = True
+        if self._response is not None:
+            self._response.close()
+
+    def _wait(self, error_class: str, reason: str, at_least: float = 0) -> None:
+        attempt = self._attempts.get(error_class, 0)
+        self._attempts[error_class] = attempt + 1
+        self._sleep(max(at_least, backoff_delay(error_class, attempt)), f"{error_class} error: {reason}")
+
+    def _sleep(self, delay: float, reason: str) -> None:
+        logging.warning(f"Reconnecting to the stream in {delay:.2f}s ({reason})")
+        time.sleep(delay)
@@ -0,0 +1,188 @@
+import hashlib
+import logging
+import math
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+'''
+Tools for dropping tweets the stream redelivers after a reconnect or backfill - contains functions for:
+    - A Bloom filter sized from a capacity and false positive rate
+    - A rolling Bloom filter that ages out old tweet IDs in generations
+    - A bounded seen-tweet set (exact LRU backed by the rolling Bloom filter) with hit/miss counters
+    - Persisting the seen-tweet set so it survives restarts
+
+The LRU answers exactly for recent IDs, IDs that fall out of it are still remembered
+by the Bloom filter at the cost of a small false positive rate.
+'''
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter over string keys
+
+    :param capacity: the number of keys the filter is sized for
+    :param error_rate: the false positive rate at capacity
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+
+class RollingBloomFilter:
+    """
+    Two generation Bloom filter - once the current generation is full it becomes
+    the previous one and the oldest generation is forgotten
+
+    :param capacity: the number of keys per generation
+    :param error_rate: the false positive rate per generation
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous: Optional[BloomFilter] = None
+
+    def add(self, key: str) -> None:
+        if self.current.count >= self.capacity:
+            self.previous = self.current
+            self.current = BloomFilter(self.capacity, self.error_rate)
+        self.current.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.current or (self.previous is not None and key in self.previous)
+
+
+class SeenTweets:
+    """
+    Bounded set of already processed tweet IDs
+
+    :param lru_size: the number of recent tweet IDs remembered exactly
+    :param bloom_capacity: the number of tweet IDs per Bloom filter generation
+    :param error_rate: the Bloom filter false positive rate
+    """
+
+    def __init__(self, lru_size: int, bloom_capacity: int, error_rate: float):
+        self.lru_size = lru_size
+        self.hits = 0
+        self.misses = 0
+        self._recent: OrderedDict = OrderedDict()
+        self._bloom = RollingBloomFilter(bloom_capacity, error_rate)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._save_requested = threading.Event()
+        self._save_path = ""
+        self._saver: Optional[threading.Thread] = None
+
+    def check_and_add(self, tweet_id: str) -> bool:
+        """
+        Record a tweet ID and tell whether it was already seen
+
+        :param tweet_id: (Self-explanatory)
+
+        :return: True if the tweet is a duplicate
+        """
+        tweet_id = str(tweet_id)
+        with self._lock:
+            if tweet_id in self._recent:
+                self._recent.move_to_end(tweet_id)
+                self.hits += 1
+                return True
+            if tweet_id in self._bloom:
+                self.hits += 1
+                return True
+            self.misses += 1
+            self._recent[tweet_id] = None
+            self._bloom.add(tweet_id)
+            if len(self._recent) > self.lru_size:
+                self._recent.popitem(last=False)
+            return False
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    def save(self, path: str) -> None:
+        """
+        Persist the seen tweet IDs so a restart does not reprocess them.
+        Only the in-memory snapshot is taken under the lock, the disk write happens outside it.
+        """
+        with self._lock:
+            state = pickle.dumps((self._recent, self._bloom))
+            count = len(self._recent)
+        with self._save_lock:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(state)
+            os.replace(tmp_path, path)
+        logging.debug(f"Saved {count} seen tweet IDs to {path}")
+
+    def save_in_background(self, path: str) -> None:
+        """
+        Ask the background saver thread to persist the seen tweet IDs - returns immediately,
+        so the stream reader never waits on the disk. Requests made while a save is running
+        are coalesced into one more save.
+        """
+        self._save_path = path
+        if self._saver is None:
+            self._saver = threading.Thread(target=self._save_loop, name="seen-tweets-saver", daemon=True)
+            self._saver.start()
+        self._save_requested.set()
+
+    def _save_loop(self) -> None:
+        while True:
+            self._save_requested.wait()
+            self._save_requested.clear()
+            try:
+                self.save(self._save_path)
+            except Exception as e:
+                logging.error(f"Could not save seen tweet IDs to {self._save_path}: {e}")
+
+    @classmethod
+    def load(cls, path: str, lru_size: int, bloom_capacity: int, error_rate: float) -> "SeenTweets":
+        """
+        Load persisted seen tweet IDs, starting empty if there are none
+
+        :param path: the file written by save
+        """
+        seen = cls(lru_size, bloom_capacity, error_rate)
+        if not path or not os.path.exists(path):
+            return seen
+        try:
+            with open(path, "rb") as file:
+                recent, bloom = pickle.load(file)
+        except Exception as e:
+            logging.warning(f"Could not load seen tweet IDs from {path}: {e}")
+            return seen
+        if bloom.capacity == bloom_capacity and bloom.error_rate == error_rate:
+            seen._bloom = bloom
+        else:
+            for tweet_id in recent:
+                seen._bloom.add(tweet_id)
+        for tweet_id in list(recent)[-lru_size:]:
+            seen._recent[tweet_id] = None
+        logging.info(f"Loaded {len(seen)} seen tweet IDs from {path}")
+        return seen
@@ -0,0 +1,132 @@
+import threading
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+'''
+Tools for keeping rolling engagement totals per user in memory - contains functions for:
+    - A ring of per-day buckets (likes, retweets, replies, impressions) per user in one NumPy array
+    - Expiring buckets as days roll over
+    - Running totals for the configured windows (e.g. 7 and 30 days) so reading them is O(1)
+    - Summing any other window of up to the ring size from the buckets
+
+Metrics are added as deltas on the day the tweet was created, so a tweet whose likes
+go from 10 to 12 adds 2 to its day - see timeline_tools for where the deltas come from.
+'''
+
+METRICS = ("likes", "retweets", "replies", "impressions")
+
+DAY_SECONDS = 24 * 60 * 60
+
+
+def day_of(epoch: float) -> int:
+    """
+    UTC day number of epoch seconds
+    """
+    return int(epoch // DAY_SECONDS)
+
+
+class EngagementWindow:
+    """
+    Per-user ring of daily engagement buckets with running totals per window
+
+    :param max_days: the number of daily buckets kept per user - the longest window that can be read
+    :param windows: the windows in days kept as running totals
+    :param capacity: the number of users allocated up front (grows as needed)
+    """
+
+    def __init__(self, max_days: int, windows: Sequence[int] = (7, 30), capacity: int = 1024):
+        self.max_days = max_days
+        self.windows = tuple(sorted({min(window, max_days) for window in windows}))
+        self._rows: Dict[str, int] = {}
+        self._buckets = np.zeros((capacity, max_days, len(METRICS)), dtype=np.int64)
+        self._totals = np.zeros((capacity, len(self.windows), len(METRICS)), dtype=np.int64)
+        self._days = np.zeros(capacity, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def _row(self, user_id: str, today: int) -> int:
+        row = self._rows.get(user_id)
+        if row is None:
+            row = len(self._rows)
+            if row == len(self._days):
+                self._grow()
+            self._rows[user_id] = row
+            self._days[row] = today
+        return row
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self._days)
+        self._buckets = np.concatenate([self._buckets, np.zeros_like(self._buckets)])[:capacity]
+        self._totals = np.concatenate([self._totals, np.zeros_like(self._totals)])[:capacity]
+        self._days = np.concatenate([self._days, np.zeros_like(self._days)])[:capacity]
+
+    def _roll(self, row: int, today: int) -> None:
+        """
+        Advance the ring of a user to today, expiring the buckets that fall out of each window
+        """
+        last = int(self._days[row])
+        if today <= last:
+            return
+        if today - last >= self.max_days:
+            self._buckets[row] = 0
+            self._totals[row] = 0
+        else:
+            for day in range(last + 1, today + 1):
+                for i, window in enumerate(self.windows):
+                    self._totals[row, i] -= self._buckets[row, (day - window) % self.max_days]
+                # the slot of the new day held the bucket from max_days ago
+                self._buckets[row, day % self.max_days] = 0
+        self._days[row] = today
+
+    def add(self, user_id: str, created_at: float, deltas: Dict[str, int], now: Optional[float] = None) -> None:
+        """
+        Add metric deltas of a tweet to the bucket of the day it was created
+
+        :param user_id: the author of the tweet
+        :param created_at: epoch seconds the tweet was created
+        :param deltas: change per metric name (likes, retweets, replies, impressions) since the last add
+        :param now: epoch seconds of the current time (defaults to time.time())
+        """
+        today = day_of(time.time() if now is None else now)
+        day = day_of(created_at)
+        age = today - day
+        if age >= self.max_days:
+            return
+        values = np.array([deltas.get(metric, 0) for metric in METRICS], dtype=np.int64)
+        with self._lock:
+            row = self._row(str(user_id), today)
+            self._roll(row, today)
+            self._buckets[row, day % self.max_days] += values
+            for i, window in enumerate(self.windows):
+                if age < window:
+                    self._totals[row, i] += values
+
+    def totals(self, user_id: str, days: int, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Engagement of a user over the last days (today and the days - 1 before it)
+
+        :param user_id: (Self-explanatory)
+        :param days: the window - O(1) if it is one of the configured windows, at most max_days
+        :param now: epoch seconds of the current time (defaults to time.time())
+        """
+        if days > self.max_days:
+            raise ValueError(f"Window of {days} days is longer than the {self.max_days} days kept")
+        today = day_of(time.time() if now is None else now)
+        with self._lock:
+            row = self._rows.get(str(user_id))
+            if row is None:
+                return {metric: 0 for metric in METRICS}
+            self._roll(row, today)
+            if days in self.windows:
+                values = self._totals[row, self.windows.index(days)]
+            else:
+                slots = [day % self.max_days for day in range(today - days + 1, today + 1)]
+                values = self._buckets[row, slots].sum(axis=0)
+            return {metric: int(value) for metric, value in zip(METRICS, values)}
+
+    def __contains__(self, user_id: str) -> bool:
+        return str(user_id) in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
@@ -0,0 +1,196 @@
+import logging
+import os
+import time
+from collections import defaultdict
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from utils import reference_tools as rft
+
+'''
+Tools for finding the reference images nearest to a pfp by perceptual hash - contains functions for:
+    - 64-bit average (aHash), difference (dHash) and DCT (pHash) hashes of a grayscale image
+    - A multi-index hash table answering "every hash within Hamming distance d" without scanning the collection
+    - A per-collection hash index built from the reference index and cached next to it
+
+Hashes are taken of the preprocessed reference stack and of the pfp preprocessed the same
+way, so both sides go through identical resizing before they are compared.
+
+Layout added to the index folder:
+    <collection>.<kind>.npy     uint64 hash of every reference, in reference index row order
+'''
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def _resized(img: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    return np.asarray(Image.fromarray(img).resize(size, Image.LANCZOS), dtype=np.float64)
+
+
+def _pack(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def average_hash(img: np.ndarray) -> int:
+    """
+    aHash: which pixels of the 8x8 thumbnail are brighter than its mean
+    """
+    pixels = _resized(img, (8, 8))
+    return _pack(pixels > pixels.mean())
+
+
+def difference_hash(img: np.ndarray) -> int:
+    """
+    dHash: which pixels of the 9x8 thumbnail are brighter than their left neighbour
+    """
+    pixels = _resized(img, (9, 8))
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    matrix = np.sqrt(2 / n) * np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(32)
+
+
+def perceptual_hash(img: np.ndarray) -> int:
+    """
+    pHash: which of the 8x8 lowest frequencies of the 32x32 thumbnail's DCT are above their median
+    (the DC term is left out of the median as it only carries the overall brightness)
+    """
+    low = (_DCT @ _resized(img, (32, 32)) @ _DCT.T)[:8, :8]
+    return _pack(low > np.median(low.ravel()[1:]))
+
+
+HASHES: Dict[str, Callable[[np.ndarray], int]] = {
+    "ahash": average_hash,
+    "dhash": difference_hash,
+    "phash": perceptual_hash,
+}
+
+
+def _bit_count(value: int) -> int:
+    # int.bit_count needs Python 3.10
+    return bin(value).count("1")
+
+
+def hamming(a: int, b: int) -> int:
+    return _bit_count(a ^ b)
+
+
+@lru_cache(maxsize=None)
+def _masks(radius: int) -> Tuple[int, ...]:
+    """
+    Every CHUNK_BITS-bit mask with at most radius bits set, fewest first
+    """
+    masks = (mask for mask in range(1 << CHUNK_BITS) if _bit_count(mask) <= radius)
+    return tuple(sorted(masks, key=_bit_count))
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing over 64-bit hashes: each hash is split into CHUNKS chunks and
+    every chunk is indexed in its own table. Two hashes within distance d differ by at most
+    d // CHUNKS bits in one of their chunks, so a search only looks up the chunk values that
+    close to the query's in each table and checks the full distance of the rows it finds.
+
+    :param hashes: the hash of every row
+    """
+
+    def __init__(self, hashes: List[int]):
+        self.hashes = hashes
+        self._tables: List[Dict[int, List[int]]] = [defaultdict(list) for _ in range(CHUNKS)]
+        for row, value in enumerate(hashes):
+            for chunk, table in enumerate(self._tables):
+                table[(value >> (chunk * CHUNK_BITS)) & CHUNK_MASK].append(row)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """
+        Every row whose hash is within max_distance of value
+
+        return: (distance, row) pairs, nearest first
+        """
+        masks = _masks(min(max_distance // CHUNKS, CHUNK_BITS))
+        checked, found = set(), []
+        for chunk, table in enumerate(self._tables):
+            query = (value >> (chunk * CHUNK_BITS)) & CHUNK_MASK
+            for mask in masks:
+                for row in table.get(query ^ mask, ()):
+                    if row not in checked:
+                        checked.add(row)
+                        distance = hamming(value, self.hashes[row])
+                        if distance <= max_distance:
+                            found.append((distance, row))
+        return sorted(found)
+
+
+class HashIndex:
+    """
+    Perceptual hashes of every reference of a collection, searchable by Hamming distance
+
+    :param reference: the reference index the hashes were taken from
+    :param kind: ahash, dhash or phash
+    :param hashes: the hash of every reference index row
+    """
+
+    def __init__(self, reference: rft.ReferenceIndex, kind: str, hashes: np.ndarray):
+        self.reference = reference
+        self.kind = kind
+        self.hashes = hashes
+        self.table = MultiIndexHash(hashes.tolist())
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @classmethod
+    def open(cls, reference: rft.ReferenceIndex, kind: str) -> "HashIndex":
+        """
+        Load the cached hashes of a reference index, computing them if missing or older than the index
+        """
+        if kind not in HASHES:
+            raise ValueError(f"Unknown perceptual hash {kind} - expected one of {sorted(HASHES)}")
+        path = os.path.splitext(reference.path)[0] + f".{kind}.npy"
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(reference.path):
+            hashes = np.load(path)
+        else:
+            started = time.monotonic()
+            hash_image = HASHES[kind]
+            hashes = np.array([hash_image(np.asarray(img)) for img in reference.images], dtype=np.uint64)
+            np.save(path + ".tmp.npy", hashes)
+            os.replace(path + ".tmp.npy", path)
+            logging.info(
+                f"Hashed {len(hashes)} {reference.collection} references ({kind}) in {time.monotonic() - started:.1f}s")
+        return cls(reference, kind, hashes)
+
+    def nearest(self, img: np.ndarray, max_distance: int, k: int = 0) -> List[Tuple[int, int]]:
+        """
+        The references nearest to an image preprocessed like the reference index
+
+        :param img: the grayscale image (see reference_tools.preprocess)
+        :param max_distance: the maximum Hamming distance of a candidate
+        :param k: return at most this many candidates (0 for all within max_distance)
+
+        return: (distance, row) pairs, nearest first - empty when no reference is within max_distance
+        """
+        found = self.table.search(HASHES[self.kind](img), max_distance)
+        return found[:k] if k else found
+
+
+def open_hash_indexes(references: Dict[str, rft.ReferenceIndex], kind: str) -> Dict[str, HashIndex]:
+    """
+    Open the hash index of every collection
+    """
+    return {collection: HashIndex.open(reference, kind) for collection, reference in references.items()}
@@ -0,0 +1,110 @@
+import logging
+from typing import Callable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.rate_limit_tools import RateLimitScheduler
+
+'''
+Tools for making HTTP calls to the Twitter API - contains functions for:
+    - A shared session with connection pooling and keep-alive so calls reuse TCP+TLS connections
+    - Default connect/read timeouts applied to every call
+    - A retry policy for idempotent calls on transient server errors
+    - Response hooks run after every call
+    - Waiting on the rate limit scheduler before every call and feeding it every response
+
+Every Twitter call should go through the one client in stream_tools (st.client)
+rather than bare requests.get/requests.post, which open a new connection each time.
+'''
+
+# transient server errors retried by the default policy - 429 is left to the caller
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+def default_retry(retries: int, backoff_factor: float) -> Retry:
+    """
+    Retry idempotent calls (GET/HEAD) on connection errors and transient server errors
+
+    :param retries: the maximum number of retries per call
+    :param backoff_factor: exponential backoff factor between retries in seconds
+    """
+    return Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        # hand the last response back so callers raise their usual "Cannot get ..." errors
+        raise_on_status=False,
+    )
+
+
+class TwitterClient:
+    """
+    Pooled, keep-alive HTTP client shared by all Twitter calls
+
+    :param pool_size: the maximum number of kept-alive connections per host
+    :param timeout: default (connect, read) timeout in seconds for every call
+    :param retry: retry policy for the connection pool (see default_retry)
+    :param scheduler: rate limit scheduler every call waits on (see rate_limit_tools)
+    """
+
+    def __init__(self,
+                 pool_size: int = 20,
+                 timeout: Tuple[float, float] = (5, 30),
+                 retry: Optional[Retry] = None,
+                 scheduler: Optional[RateLimitScheduler] = None):
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry if retry is not None else default_retry(3, 0.5),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._response_hooks: List[Callable[[requests.Response], None]] = []
+
+    def add_response_hook(self, hook: Callable[[requests.Response], None]) -> None:
+        """
+        Run hook with every response received by the client
+        """
+        self._response_hooks.append(hook)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request on the shared session with the default timeout
+
+        :param method: HTTP method
+        :param url: (Self-explanatory)
+        :param kwargs: any requests keyword argument (auth, headers, json, timeout...) and
+            priority - calls waiting on the rate limit with a higher priority are sent first
+            (defaults to the priority set with rate_limit_tools.prioritized)
+        """
+        priority = kwargs.pop("priority", None)
+        kwargs.setdefault("timeout", self.timeout)
+        if self.scheduler is not None:
+            self.scheduler.acquire(url, priority)
+        response = self.session.request(method, url, **kwargs)
+        if self.scheduler is not None:
+            self.scheduler.update(response)
+        for hook in self._response_hooks:
+            try:
+                hook(response)
+            except Exception as e:
+                logging.error(f"Response hook failed for {url}: {e}")
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request("HEAD", url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
@@ -0,0 +1,287 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+from utils import metrics_tools as mt
+
+'''
+Tools for caching pfp images on disk - contains functions for:
+    - Looking up a pfp by its profile image url, which changes whenever the avatar changes
+    - Storing the image bytes and the decoded grayscale array once per distinct image content
+    - Keeping the ETag/Last-Modified of every url and revalidating with a conditional GET after a TTL
+    - Serving the stored response headers so no separate HEAD call is needed
+    - Pruning urls not validated for max_age and the blobs no url refers to any more
+
+Layout of the cache folder:
+    urls/<sha256 of url>.json      url, content hash, validators, headers and when it was validated
+    blobs/<sha256 of bytes>.bin    the image as downloaded
+    blobs/<sha256 of bytes>.npy    the image decoded to grayscale, ready for matching
+'''
+
+# response headers kept with every url and served in place of a HEAD
+KEPT_HEADERS = ("Content-Type", "Content-Length", "ETag", "Last-Modified", "Cache-Control")
+
+
+@dataclass
+class CachedImage:
+    """
+    DataModel for a cached pfp image
+
+    :param url: the profile image url
+    :param content_hash: sha256 of the image bytes - the name of its blobs
+    :param headers: the kept response headers of the last full download
+    :param validated_at: epoch seconds the cached copy was last confirmed current
+    :param gray: the decoded grayscale image (loaded on first use)
+    """
+    url: str
+    content_hash: str
+    headers: Dict[str, str] = field(default_factory=dict)
+    validated_at: float = 0.0
+    gray: Optional[np.ndarray] = None
+
+    @property
+    def etag(self) -> Optional[str]:
+        return self.headers.get("ETag")
+
+    @property
+    def last_modified(self) -> Optional[str]:
+        return self.headers.get("Last-Modified")
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    # a temp file of its own per write - concurrent writers of the same path must not share one
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class ImageCache:
+    """
+    Content-addressed on-disk pfp cache with conditional revalidation
+
+    :param folder: the cache folder (created if missing)
+    :param client: HTTP client the images are downloaded with (see http_tools.TwitterClient)
+    :param ttl: seconds a cached image is served without revalidating it
+    :param memory_size: the number of decoded images also kept in memory
+    :param max_age: seconds a url not validated since is removed from disk, None to keep everything
+    :param prune_every: the number of images stored between two prunes of the folder
+    """
+
+    def __init__(self,
+                 folder: str,
+                 client,
+                 ttl: float,
+                 memory_size: int = 1000,
+                 max_age: Optional[float] = 30 * 24 * 60 * 60,
+                 prune_every: int = 1000):
+        self.folder = folder
+        self.client = client
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.max_age = max_age
+        self.prune_every = prune_every
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._created = False
+        self._stored = 0
+        self._pruning = False
+
+    def _create_folders(self) -> None:
+        # on first use rather than at construction, so importing a module holding a cache writes nothing
+        if not self._created:
+            os.makedirs(os.path.join(self.folder, "urls"), exist_ok=True)
+            os.makedirs(os.path.join(self.folder, "blobs"), exist_ok=True)
+            self._created = True
+
+    def _url_path(self, url: str) -> str:
+        return os.path.join(self.folder, "urls", _sha256(url.encode("utf-8")) + ".json")
+
+    def _blob_path(self, content_hash: str, suffix: str) -> str:
+        return os.path.join(self.folder, "blobs", content_hash + suffix)
+
+    def _lookup(self, url: str) -> Optional[CachedImage]:
+        with self._lock:
+            if url in self._memory:
+                self._memory.move_to_end(url)
+                return self._memory[url]
+        try:
+            with open(self._url_path(url)) as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self._blob_path(meta["content_hash"], ".npy")):
+            return None
+        return CachedImage(url, meta["content_hash"], meta["headers"], meta["validated_at"])
+
+    def _remember(self, image: CachedImage) -> None:
+        with self._lock:
+            self._memory[image.url] = image
+            self._memory.move_to_end(image.url)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _save_meta(self, image: CachedImage) -> None:
+        meta = {"url": image.url, "content_hash": image.content_hash,
+                "headers": image.headers, "validated_at": image.validated_at}
+        _write_atomic(self._url_path(image.url), json.dumps(meta).encode("utf-8"))
+
+    def _store(self, url: str, content: bytes, headers, now: float) -> CachedImage:
+        content_hash = _sha256(content)
+        if not os.path.exists(self._blob_path(content_hash, ".npy")):
+            gray = np.array(Image.open(BytesIO(content)).convert("L"))
+            _write_atomic(self._blob_path(content_hash, ".bin"), content)
+            buffer = BytesIO()
+            np.save(buffer, gray)
+            _write_atomic(self._blob_path(content_hash, ".npy"), buffer.getvalue())
+        image = CachedImage(url, content_hash,
+                            {key: headers[key] for key in KEPT_HEADERS if key in headers}, now)
+        self._save_meta(image)
+        with self._lock:
+            self._stored += 1
+            due = self.max_age is not None and not self._pruning and self._stored >= self.prune_every
+            if due:
+                self._stored, self._pruning = 0, True
+        if due:
+            try:
+                self.prune(now)
+            finally:
+                self._pruning = False
+        return image
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """
+        Remove the urls not validated for max_age, then the blobs no remaining url refers to.
+        Blobs written less than a ttl ago are kept: a store in progress writes its blobs before its url.
+
+        :param now: epoch seconds to prune as of (defaults to now)
+
+        return: the number of files removed
+        """
+        if self.max_age is None or not os.path.isdir(self.folder):
+            return 0
+        now = time.time() if now is None else now
+        removed, referenced = 0, set()
+        urls_folder = os.path.join(self.folder, "urls")
+        for name in os.listdir(urls_folder):
+            path = os.path.join(urls_folder, name)
+            try:
+                with open(path) as file:
+                    meta = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if now - meta["validated_at"] < self.max_age:
+                referenced.add(meta["content_hash"])
+                continue
+            with self._lock:
+                self._memory.pop(meta["url"], None)
+            os.remove(path)
+            removed += 1
+        blobs_folder = os.path.join(self.folder, "blobs")
+        for name in os.listdir(blobs_folder):
+            path = os.path.join(blobs_folder, name)
+            if name.split(".")[0] in referenced:
+                continue
+            try:
+                if now - os.path.getmtime(path) >= self.ttl:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        logging.info(f"Pruned {removed} files from the image cache in {self.folder}")
+        return removed
+
+    def get(self, url: str) -> CachedImage:
+        """
+        Get a pfp from the cache, downloading it on a miss and revalidating it with a
+        conditional GET once it is older than the ttl. Concurrent calls for the same url
+        share one download.
+
+        :param url: the profile image url
+        """
+        self._create_folders()
+        image = self._lookup(url)
+        if image is not None and time.time() - image.validated_at < self.ttl:
+            return self._serve(image, "hit")
+        with self._lock:
+            future = self._in_flight.get(url)
+            fetching = future is None
+            if fetching:
+                future = self._in_flight[url] = Future()
+        if not fetching:
+            return self._serve(future.result(), "shared")
+        try:
+            image, result = self._fetch(url)
+            future.set_result(image)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[url]
+        return self._serve(image, result)
+
+    def _fetch(self, url: str):
+        now = time.time()
+        # looked up again: a download of the same url may have finished since the caller's lookup
+        image = self._lookup(url)
+        if image is not None and now - image.validated_at < self.ttl:
+            result = "hit"
+        else:
+            headers = {}
+            if image is not None and image.etag:
+                headers["If-None-Match"] = image.etag
+            if image is not None and image.last_modified:
+                headers["If-Modified-Since"] = image.last_modified
+            response = self.client.get(url, headers=headers)
+            if response.status_code == 304 and image is not None:
+                result = "revalidated"
+                image.validated_at = now
+                self._save_meta(image)
+            elif response.status_code == 200:
+                result = "miss" if image is None else "changed"
+                image = self._store(url, response.content, response.headers, now)
+            else:
+                raise Exception(
+                    "Cannot get profile image (HTTP {}): {}".format(response.status_code, url))
+        if image.gray is None:
+            image.gray = np.load(self._blob_path(image.content_hash, ".npy"))
+        return image, result
+
+    def _serve(self, image: CachedImage, result: str) -> CachedImage:
+        if image.gray is None:
+            image.gray = np.load(self._blob_path(image.content_hash, ".npy"))
+        self._remember(image)
+        mt.registry.inc("image_cache_total", result=result)
+        return image
+
+    def content(self, image: CachedImage) -> bytes:
+        """
+        The image bytes as downloaded
+        """
+        with open(self._blob_path(image.content_hash, ".bin"), "rb") as file:
+            return file.read()
+
+
+mt.registry.describe("image_cache_total", "Pfp image cache lookups by result (hit, shared, revalidated, changed, miss)")
@@ -0,0 +1,77 @@
+import json
+import logging
+import random
+from typing import Any, Dict, Optional
+
+'''
+Tools for logging from the stream hot loop - contains functions for:
+    - Structured key/value log records that are only formatted if they are emitted
+    - Sampling large per-tweet debug payloads at a configurable rate
+    - Truncating long values so one record never formats megabytes of JSON
+
+Use log_event instead of logging.info(f"...") anywhere that runs once per tweet or per user.
+'''
+
+# default max characters per logged value
+MAX_VALUE_LENGTH = 500
+
+# fraction of per-tweet payloads logged by log_sampled - set from Config.log_sample_rate
+sample_rate = 0.01
+
+
+class _Record:
+    """
+    Key/value log message formatted only when a handler emits it
+    """
+
+    __slots__ = ("event", "fields", "max_length")
+
+    def __init__(self, event: str, fields: Dict[str, Any], max_length: int):
+        self.event = event
+        self.fields = fields
+        self.max_length = max_length
+
+    def __str__(self) -> str:
+        parts = [self.event]
+        for key, value in self.fields.items():
+            if not isinstance(value, str):
+                try:
+                    value = json.dumps(value, default=str, separators=(",", ":"))
+                except (TypeError, ValueError):
+                    value = repr(value)
+            if len(value) > self.max_length:
+                value = value[:self.max_length] + f"...(+{len(value) - self.max_length} chars)"
+            if " " in value or not value:
+                value = json.dumps(value)
+            parts.append(f"{key}={value}")
+        return " ".join(parts)
+
+
+def log_event(level: int, event: str, max_length: int = MAX_VALUE_LENGTH, **fields) -> None:
+    """
+    Log a structured key/value record, skipping all formatting if the level is disabled
+
+    :param level: logging level, e.g. logging.INFO
+    :param event: short name of what happened
+    :param max_length: the maximum characters logged per value
+    :param fields: the key/value pairs of the record
+    """
+    logger = logging.getLogger()
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s", _Record(event, fields, max_length))
+
+
+def log_sampled(level: int, event: str, rate: Optional[float] = None, **fields) -> None:
+    """
+    Log a structured record for only a sample of calls - for full per-tweet payloads
+
+    :param level: logging level, e.g. logging.DEBUG
+    :param event: short name of what happened
+    :param rate: fraction of calls logged (defaults to the module sample_rate)
+    :param fields: the key/value pairs of the record
+    """
+    rate = sample_rate if rate is None else rate
+    if rate <= 0 or not logging.getLogger().isEnabledFor(level):
+        return
+    if rate >= 1 or random.random() < rate:
+        log_event(level, event, max_length=10 * MAX_VALUE_LENGTH, **fields)
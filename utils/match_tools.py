@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from utils import hash_tools as hst
+from utils import metrics_tools as mt
+from utils import pfp_check as nft
+from utils import reference_tools as rft
+from utils import ssim_tools as sst
+
+'''
+Tools for matching pfps against the collection reference images on every core - contains functions for:
+    - A process pool matching service that takes a decoded pfp and returns a verdict per collection
+    - A two stage cascade: the perceptual hash index of the full collection picks the top-k nearest
+      references, then SSIM verifies only those against the similarity tiers
+    - Reading the references from the preprocessed, memory-mapped index of each collection
+
+SSIM is CPU bound so it runs in worker processes, leaving the enrichment threads free
+to wait on the network. The candidates of a collection are scored in a single batched
+SSIM pass (see ssim_tools). The references are decoded and resized once when the index is
+built, and the workers map the same index file so its pages are shared between them.
+'''
+
+
+@dataclass
+class PfpVerdict:
+    """
+    DataModel for the verdict of a pfp against one collection
+
+    :param matched: whether the pfp is likely in the collection
+    :param token: the reference file name of the best candidate ("" when it is no match)
+    :param tier: the similarity tier - match, twinsies, likely or none
+    :param similarity: the SSIM of the best candidate (0 when no hash candidate was found)
+    """
+    matched: bool = False
+    token: str = ""
+    tier: str = "none"
+    similarity: float = 0.0
+
+
+# per worker process: index path -> memory-mapped reference stack
+_indexes: Dict[str, np.ndarray] = {}
+
+
+def _score_rows(index_path: str, rows: List[int], pfp: np.ndarray) -> Tuple[float, int, float, float]:
+    """
+    Worker task: the SSIM of a pfp against some rows of a reference index, scored in one batch
+
+    return: the highest similarity, its row, seconds spent reading references and seconds spent in SSIM
+    """
+    rows = sorted(rows)
+    started = time.perf_counter()
+    if index_path not in _indexes:
+        _indexes[index_path] = np.load(index_path, mmap_mode="r")
+    references = _indexes[index_path][rows]
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    sims = sst.structural_similarity(pfp, references)
+    ssim_seconds = time.perf_counter() - started
+    best = int(np.argmax(sims))
+    return float(sims[best]), rows[best], load_seconds, ssim_seconds
+
+
+class PfpMatcher:
+    """
+    Process pool matching service for pfps
+
+    :param folders: collection name -> folder of reference images
+    :param workers: the number of worker processes (0 for one per core)
+    :param top_k: the number of nearest hash candidates per collection verified with SSIM
+    :param threshold: the acceptable threshold for similarity
+    :param index_dir: the folder the reference indexes are kept in (see reference_tools)
+    :param size: the canonical resolution pfps and references are compared at
+    :param hash_kind: the perceptual hash candidates are searched by (ahash, dhash or phash)
+    :param max_distance: the maximum Hamming distance of a hash candidate
+    """
+
+    def __init__(self, folders: Dict[str, str], workers: int, top_k: int, threshold: float,
+                 index_dir: str, size: int, hash_kind: str = "phash", max_distance: int = 10):
+        self.folders = folders
+        self.workers = workers or os.cpu_count() or 1
+        self.top_k = top_k
+        self.threshold = threshold
+        self.size = size
+        self.hash_kind = hash_kind
+        self.max_distance = max_distance
+        self.indexes = rft.open_indexes(folders, index_dir, size)
+        self.hashes = hst.open_hash_indexes(self.indexes, hash_kind)
+        # the workers start on the first submit, from an enrichment thread while other threads hold
+        # locks - forking then could copy a held lock into the worker, so they come from a clean server
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context(start_method))
+        logging.info(
+            f"Started pfp matcher with {self.workers} processes: { {c: len(i) for c, i in self.indexes.items()} } references")
+
+    @property
+    def version(self) -> str:
+        """
+        Hash of the references and settings the verdicts depend on - verdicts cached under
+        another version are no longer valid
+        """
+        settings = {"references": {c: i.fingerprint for c, i in self.indexes.items()}, "size": self.size,
+                    "hash": self.hash_kind, "max_distance": self.max_distance, "top_k": self.top_k,
+                    "threshold": self.threshold}
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def nearest(self, pfp: Image, max_distance: int, k: int = 0) -> Dict[str, List[Tuple[int, str]]]:
+        """
+        Search every full collection for the references whose perceptual hash is nearest to a pfp
+
+        :param pfp: the grayscale pfp image of the user
+        :param max_distance: the maximum Hamming distance of a candidate
+        :param k: the maximum number of candidates per collection (0 for all within max_distance)
+
+        return: (distance, reference file name) pairs per collection, nearest first
+        """
+        pfp_array = rft.preprocess(pfp, self.size)
+        return {collection: [(distance, index.reference.files[row])
+                             for distance, row in index.nearest(pfp_array, max_distance, k)]
+                for collection, index in self.hashes.items()}
+
+    def match(self, pfp: Image, pfp_key: str = "") -> Tuple[Dict[str, PfpVerdict], Dict[str, float]]:
+        """
+        Match a pfp against every collection: search the full collection's hash index for the
+        top-k nearest references, then verify only those with SSIM on the pool. A collection with
+        no reference within max_distance is no match without running SSIM at all.
+
+        :param pfp: the grayscale pfp image of the user
+        :param pfp_key: what the pfp is logged as, e.g. its profile image link
+
+        return: verdict per collection and the seconds spent per stage (hash_prefilter,
+            reference_loading and ssim)
+        """
+        pfp_array = rft.preprocess(pfp, self.size)
+        started = time.perf_counter()
+        candidates = {collection: [row for _, row in index.nearest(pfp_array, self.max_distance, self.top_k)]
+                      for collection, index in self.hashes.items()}
+        timings = {"hash_prefilter": time.perf_counter() - started, "reference_loading": 0.0, "ssim": 0.0}
+
+        # the top-k are scored in one batch per collection, the collections in parallel
+        futures = {}
+        for collection, rows in candidates.items():
+            mt.registry.inc("pfp_match_stage_total", stage="hash_prefilter",
+                            result="candidates" if rows else "no_candidate")
+            if rows:
+                futures[collection] = self._pool.submit(_score_rows, self.indexes[collection].path, rows, pfp_array)
+
+        verdicts = {collection: PfpVerdict() for collection in candidates}
+        for collection, future in futures.items():
+            sim, row, load, ssim = future.result()
+            timings["reference_loading"] += load
+            timings["ssim"] += ssim
+            index = self.indexes[collection]
+            matched, _ = nft.ssim_verdict(
+                pfp_array, sim, index.folder_path, index.files[row], self.threshold, pfp_key)
+            verdicts[collection] = PfpVerdict(
+                matched, index.files[row] if matched else "", nft.similarity_tier(sim, self.threshold), sim)
+            mt.registry.inc("pfp_match_stage_total", stage="ssim", result="match" if matched else "no_match")
+        return verdicts, timings
+
+    def close(self) -> None:
+        self._pool.shutdown()
+
+
+mt.registry.describe("pfp_match_stage_total",
+                     "Collections checked per pfp matching stage by result - the pass-through rate of the cascade")
@@ -0,0 +1,239 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+'''
+Tools for instrumenting the stream pipeline - contains functions for:
+    - Counters, gauges and latency histograms with labels
+    - Timing a pipeline stage (latency histogram, outcome counter and in-flight gauge)
+    - Rendering every metric in the Prometheus text format
+    - Serving the metrics over HTTP or dumping them to a JSON file periodically
+
+All metrics live in the module level registry so every module records into the same place.
+'''
+
+# seconds - from a cached lookup up to a slow timeline fetch or table rewrite
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(label_key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(label_key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values
+
+    :param buckets: the upper bounds of the buckets
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """
+        (upper bound, cumulative count) pairs including +Inf
+        """
+        total, result = 0, []
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            result.append((str(bound), total))
+        return result
+
+
+class MetricsRegistry:
+    """
+    Thread safe store of counters, gauges and histograms keyed by name and labels
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, str] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def add_gauge(self, name: str, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def render_prometheus(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+                for name, series in sorted(metrics.items()):
+                    if name in self._help:
+                        lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in sorted(series.items()):
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, count in histogram.cumulative():
+                        lines.append(
+                            f"{name}_bucket{_format_labels(key, ('le', bound))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict:
+        """
+        Snapshot of every metric as plain json-serializable data
+        """
+        def labelled(key: LabelKey) -> str:
+            return _format_labels(key) or "{}"
+
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "counters": {name: {labelled(key): value for key, value in series.items()}
+                             for name, series in self._counters.items()},
+                "gauges": {name: {labelled(key): value for key, value in series.items()}
+                           for name, series in self._gauges.items()},
+                "histograms": {name: {labelled(key): {"count": h.count, "sum": h.sum, "buckets": dict(h.cumulative())}
+                                      for key, h in series.items()}
+                               for name, series in self._histograms.items()},
+            }
+
+
+registry = MetricsRegistry()
+registry.describe("stream_stage_latency_seconds", "Latency of each stream pipeline stage")
+registry.describe("stream_stage_total", "Calls of each stream pipeline stage by outcome")
+registry.describe("stream_stage_in_flight", "Calls of each stream pipeline stage currently running")
+registry.describe("stream_lines_total", "Non keep-alive lines read from the stream")
+registry.describe("stream_dedupe_total", "Streamed tweets checked against the seen-tweet cache by result")
+registry.describe("stream_queue_depth", "Tweets waiting for an enrichment worker")
+registry.describe("stream_queue_dropped", "Tweets dropped because the work queue was full")
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Time a pipeline stage - records its latency, outcome and in-flight count
+
+    :param stage: the name of the stage, used as the stage label
+    """
+    registry.add_gauge("stream_stage_in_flight", 1, stage=stage)
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        registry.observe("stream_stage_latency_seconds",
+                         time.perf_counter() - started, stage=stage)
+        registry.inc("stream_stage_total", stage=stage, outcome=outcome)
+        registry.add_gauge("stream_stage_in_flight", -1, stage=stage)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Metrics request: " + format % args)
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve the Prometheus text endpoint on /metrics from a background thread
+
+    :param port: the port to listen on
+    :param host: the interface to listen on
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever,
+                     name="metrics-server", daemon=True).start()
+    logging.info(f"Serving stream metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def dump_json(path: str) -> None:
+    """
+    Write a JSON snapshot of every metric to path
+    """
+    with open(path, "w") as file:
+        json.dump(registry.to_dict(), file, indent=2)
+
+
+def start_json_dump(path: str, interval: float) -> threading.Event:
+    """
+    Dump the metrics to path every interval seconds from a background thread
+
+    :return: event that stops the dumps when set
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                dump_json(path)
+            except OSError as e:
+                logging.error(f"Could not dump metrics to {path}: {e}")
+        dump_json(path)
+
+    threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+    logging.info(f"Dumping stream metrics to {path} every {interval}s")
+    return stop
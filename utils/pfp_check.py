@@ -3,10 +3,15 @@ import cv2
 from PIL import Image
 import numpy as np
 from utils import stream_tools as st
-from skimage.metrics import structural_similarity as ssim
+from utils import log_tools as lt
+from utils import ssim_tools as sst
 from typing import Tuple, List, Union
 params = st.params
 
+# SSIM above which a pfp is the reference token itself, or its twin
+MATCH_SIMILARITY = 0.925
+TWINSIES_SIMILARITY = 0.9
+
 
 def display_image(img1: Image, pfp_link: str) -> None:
     """
@@ -23,9 +28,9 @@ def check_pfp(pfp: Image,
               compare_image: np.ndarray, 
               folder_path: str, 
               filename: str, 
-              threshold: float) -> Tuple[bool, List[str] | str]:
+              threshold: float) -> Tuple[bool, Union[List[str], str]]:
     """
-    Using skimage structural similarity and compare against 5-7 images to determine if in collection or not
+    Using structural similarity and compare against 5-7 images to determine if in collection or not
 
     TODO: update this to use image proc ML model instead of heuristics comparison
 
@@ -35,45 +40,81 @@ def check_pfp(pfp: Image,
     :param filename: file name to compare against
     :param threshold: the acceptable threshold for similarity
 
+    return: boolean if true and list of matching ids found
+    """
+    return ssim_verdict(pfp, similarity(pfp, compare_image), folder_path, filename, threshold)
+
+
+def similarity(pfp: Image, compare_image: np.ndarray) -> float:
+    """
+    The structural similarity of a grayscale pfp and the image to compare against
+    (the batched engine of ssim_tools, equal to skimage's structural_similarity)
+    """
+    return float(sst.structural_similarity(np.array(pfp), compare_image[np.newaxis])[0])
+
+
+def similarity_tier(sim: float, threshold: float) -> str:
+    """
+    The similarity tier of an SSIM score - match, twinsies, likely or none
+    """
+    if sim > MATCH_SIMILARITY:
+        return "match"
+    if sim > TWINSIES_SIMILARITY:
+        return "twinsies"
+    if sim > threshold:
+        return "likely"
+    return "none"
+
+
+def ssim_verdict(pfp: Image,
+                 sim: float,
+                 folder_path: str,
+                 filename: str,
+                 threshold: float,
+                 pfp_key: str = "") -> Tuple[bool, Union[List[str], str]]:
+    """
+    Apply the similarity tiers to the SSIM of a pfp and a reference image:
+    > 0.925 is a match, > 0.9 twinsies and > threshold a likely match
+
+    :param pfp: the compared Image
+    :param sim: the structural similarity of the pfp and the reference
+    :param folder_path: the folder of the reference
+    :param filename: file name of the reference
+    :param threshold: the acceptable threshold for similarity
+    :param pfp_key: what the pfp is logged as, e.g. its profile image link
+
     return: boolean if true and list of matching ids found
     """
     matched_ids, missing_ids = [], []
     twinsies, likely_pfps, likely_matches = [], [], []
 
     sims, lowest_sim, highest_sim, average_sim = [], 100, 0, 0
-    logging.info("Displaying image...")
-
-    sim = ssim(np.array(pfp), compare_image, multichannel=True)
-    logging.info(f"SSIM: {sim}")
+    logging.info("SSIM: %s", sim)
     sims.append(sim)
     average_sim = sum(sims)/len(sims)
     lowest_sim = min(sims)
     highest_sim = max(sims)
-    logging.debug(f"\nLowest SSIM: {lowest_sim}\n Highest SSIM: {highest_sim}\nAverage SSIM: {average_sim}\n")
-    if sim > 0.925:
-        logging.info(f"\nMatched: {pfp} -> {filename}")
+    logging.debug("\nLowest SSIM: %s\n Highest SSIM: %s\nAverage SSIM: %s\n", lowest_sim, highest_sim, average_sim)
+    if sim > MATCH_SIMILARITY:
+        lt.log_event(logging.INFO, "pfp_matched", pfp=pfp_key, reference=filename, ssim=sim)
         if folder_path+"/"+filename not in matched_ids:
             matched_ids.append(
                 folder_path+"/"+filename)
-            cv2.destroyAllWindows()
         return True, matched_ids
-    if sim > 0.9:
-        logging.info(f"\nTwinsies: {pfp} -> {filename}")
+    if sim > TWINSIES_SIMILARITY:
+        lt.log_event(logging.INFO, "pfp_twinsies", pfp=pfp_key, reference=filename, ssim=sim)
         if folder_path+"/"+filename not in twinsies:
             twinsies.append(folder_path+"/"+filename)
-            cv2.destroyAllWindows()
         return True, twinsies
     if sim > threshold:
-        logging.info(f"\nLikely Match: {pfp} -> {filename}")
+        lt.log_event(logging.INFO, "pfp_likely_match", pfp=pfp_key, reference=filename, ssim=sim)
         if folder_path+"/"+filename not in likely_matches:
             likely_pfps.append(pfp)
             likely_matches.append(
                 folder_path+"/"+filename)
-            cv2.destroyAllWindows()
         return True, likely_pfps
     if sim < threshold and folder_path+"/"+filename not in missing_ids:
         missing_ids.append(folder_path+"/"+filename)
-        cv2.destroyAllWindows()
         return False, "No match found"
     else:
         return False, "No match found"
\ No newline at end of file
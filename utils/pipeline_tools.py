@@ -0,0 +1,468 @@
+import heapq
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple, Union
+
+from utils import metrics_tools as mt
+from utils import rate_limit_tools as rl
+
+'''
+Tools for decoupling the twitter stream reader from tweet enrichment - contains functions for:
+    - Framing and parsing raw lines from the filtered stream
+    - Buffering parsed tweets in a bounded work queue with a configurable drop policy
+    - Scheduling tweets by priority and shedding low-priority work when the backlog grows
+    - Running a pool of enrichment workers that drain the work queue
+    - Micro-batching single-item lookups into multi-item API calls
+
+The reader should only ever frame, parse and enqueue so that a slow lookup or
+database write never stops us from reading the socket.
+'''
+
+DROP_POLICIES = ("block", "drop_newest", "drop_oldest")
+
+
+def parse_line(response_line: bytes) -> Optional[Dict]:
+    """
+    Parse a single line from the filtered stream into a tweet payload
+
+    :param response_line: raw (non keep-alive) line read from the stream
+
+    :return: the json payload or None if the line is not a tweet
+    """
+    try:
+        json_response = json.loads(response_line)
+    except ValueError as e:
+        logging.warning(f"Could not parse stream line: {e}")
+        return None
+    if "data" not in json_response:
+        logging.warning(f"Stream message without tweet data: {json_response}")
+        return None
+    return json_response
+
+
+class WorkQueue:
+    """
+    Bounded queue between the stream reader and the enrichment workers
+
+    :param maxsize: the maximum number of tweets to buffer
+    :param drop_policy: what to do when the queue is full:
+        - block: wait for a free slot (the reader stops reading the socket)
+        - drop_newest: discard the incoming tweet
+        - drop_oldest: discard the oldest buffered tweet to make room
+    """
+
+    def __init__(self, maxsize: int, drop_policy: str = "drop_oldest"):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(
+                f"Unknown drop policy {drop_policy}, expected one of {DROP_POLICIES}")
+        self.drop_policy = drop_policy
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+
+    def put(self, item: Any) -> bool:
+        """
+        Add an item to the queue according to the drop policy
+
+        :param item: the parsed tweet payload
+
+        :return: True if the item was queued
+        """
+        if self.drop_policy == "block":
+            self._queue.put(item)
+            self._count(enqueued=1)
+            return True
+
+        with self._lock:
+            try:
+                self._queue.put_nowait(item)
+                self.enqueued += 1
+                return True
+            except queue.Full:
+                pass
+
+            if self.drop_policy == "drop_newest":
+                self.dropped += 1
+                logging.warning(
+                    f"Work queue full ({self._queue.maxsize}) - dropped incoming tweet")
+                return False
+
+            # drop_oldest: make room by discarding the head of the queue
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self.dropped += 1
+                logging.warning(
+                    f"Work queue full ({self._queue.maxsize}) - dropped oldest tweet")
+            except queue.Empty:
+                pass
+            self._queue.put_nowait(item)
+            self.enqueued += 1
+            return True
+
+    def get(self, timeout: float) -> Any:
+        """
+        Get the next item, raising queue.Empty after timeout seconds
+        """
+        return self._queue.get(timeout=timeout)
+
+    def task_done(self) -> None:
+        self._queue.task_done()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def join(self) -> None:
+        self._queue.join()
+
+    def _count(self, enqueued: int = 0, dropped: int = 0) -> None:
+        with self._lock:
+            self.enqueued += enqueued
+            self.dropped += dropped
+
+
+class PriorityWorkQueue:
+    """
+    Bounded priority queue between the stream reader and the enrichment workers.
+    Workers always take the highest priority tweet (oldest first among equals), and only take
+    deferred tweets once no other tweet is waiting.
+
+    :param maxsize: the maximum number of tweets to buffer - when full the lowest priority tweet is shed
+    :param backlog: past this many queued tweets, tweets below min_priority are shed or deferred
+    :param min_priority: the priority a tweet needs to be queued normally while over the backlog
+    :param shed_policy: drop - discard low priority tweets past the backlog,
+        defer - queue them in a deferred lane served only when no other tweet is waiting
+        (and shed first when the queue is full)
+    :param block: wait for a free slot when full instead of shedding (the reader stops reading the socket)
+    """
+
+    def __init__(self,
+                 maxsize: int,
+                 backlog: int,
+                 min_priority: float,
+                 shed_policy: str = "drop",
+                 block: bool = False):
+        if shed_policy not in ("drop", "defer"):
+            raise ValueError(f"Unknown shed policy {shed_policy}, expected drop or defer")
+        self.maxsize = maxsize
+        self.backlog = backlog
+        self.min_priority = min_priority
+        self.shed_policy = shed_policy
+        self.block = block
+        self.enqueued = 0
+        self.dropped = 0
+        self.deferred = 0
+        # (lane, -priority, seq, item) - lane 1 holds deferred tweets behind every lane 0 tweet
+        self._heap: List[Tuple[int, float, int, Any]] = []
+        self._seq = itertools.count()
+        self._unfinished = 0
+        self._cond = threading.Condition()
+
+    def put(self, item: Any, priority: float = 0) -> bool:
+        """
+        Add an item to the queue, shedding low priority work when over the backlog
+
+        :param item: the parsed tweet payload
+        :param priority: higher is processed first
+
+        :return: True if the item was queued
+        """
+        with self._cond:
+            lane = 0
+            if len(self._heap) >= self.backlog and priority < self.min_priority:
+                if self.shed_policy == "drop":
+                    self._shed("backlog")
+                    return False
+                lane = 1
+            if self.block:
+                while len(self._heap) >= self.maxsize:
+                    self._cond.wait()
+            elif len(self._heap) >= self.maxsize:
+                # the largest (lane, -priority, seq) is the newest lowest priority tweet, deferred ones first
+                lowest = max(range(len(self._heap)), key=lambda i: self._heap[i][:3])
+                if (lane, -priority, float("inf")) >= self._heap[lowest][:3]:
+                    self._shed("queue_full")
+                    return False
+                self._heap.pop(lowest)
+                heapq.heapify(self._heap)
+                self._unfinished -= 1
+                self._shed("queue_full")
+            heapq.heappush(self._heap, (lane, -priority, next(self._seq), item))
+            self._unfinished += 1
+            self.enqueued += 1
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout: float) -> Any:
+        """
+        Get the highest priority item, raising queue.Empty after timeout seconds
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._heap, timeout):
+                raise queue.Empty
+            lane, _, _, item = heapq.heappop(self._heap)
+            if lane == 1:
+                # counted once it is served - a deferred tweet shed later only counts as shed
+                self.deferred += 1
+                mt.registry.inc("stream_shed_total", reason="deferred")
+            self._cond.notify_all()
+            return item
+
+    def task_done(self) -> None:
+        with self._cond:
+            self._unfinished -= 1
+            self._cond.notify_all()
+
+    def qsize(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def join(self) -> None:
+        with self._cond:
+            self._cond.wait_for(lambda: self._unfinished <= 0)
+
+    def _shed(self, reason: str) -> None:
+        self.dropped += 1
+        mt.registry.inc("stream_shed_total", reason=reason)
+        logging.warning(
+            f"Shed low priority tweet ({reason}) - {len(self._heap)} tweets queued")
+
+
+class RefreshingSet:
+    """
+    Set of keys reloaded in the background every interval seconds, e.g. the leaderboard members
+
+    :param loader: function returning the current keys
+    :param interval: seconds between reloads
+    :param name: name used for the refresh thread and logging
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[str]], interval: float, name: str = "refreshing-set"):
+        self.loader = loader
+        self.interval = interval
+        self.name = name
+        self._keys: Set[str] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.refresh()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def refresh(self) -> None:
+        try:
+            self._keys = set(self.loader())
+            logging.debug(f"Refreshed {self.name}: {len(self._keys)} keys")
+        except Exception as e:
+            logging.error(f"Could not refresh {self.name}: {e}")
+
+    def add(self, key: str) -> None:
+        self._keys.add(key)
+
+    def discard(self, key: str) -> None:
+        self._keys.discard(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+
+class WorkerPool:
+    """
+    Pool of enrichment worker threads draining a WorkQueue
+
+    :param work_queue: the queue filled by the stream reader (WorkQueue or PriorityWorkQueue)
+    :param handler: function called with each queued item
+    :param workers: the number of worker threads to run
+    :param poll_interval: seconds a worker waits on an empty queue before checking for shutdown
+    """
+
+    def __init__(self,
+                 work_queue: Union[WorkQueue, PriorityWorkQueue],
+                 handler: Callable[[Any], None],
+                 workers: int,
+                 poll_interval: float = 0.5):
+        self.work_queue = work_queue
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.processed = 0
+        self.failed = 0
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Start the worker threads
+        """
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f"enrichment-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Started {self.workers} enrichment workers")
+
+    def stop(self, drain: bool = True) -> None:
+        """
+        Stop the worker threads
+
+        :param drain: finish the queued items before stopping
+        """
+        if drain:
+            self.work_queue.join()
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        logging.info(
+            f"Stopped enrichment workers - processed: {self.processed}, failed: {self.failed}, dropped: {self.work_queue.dropped}")
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                item = self.work_queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+            try:
+                self.handler(item)
+                with self._lock:
+                    self.processed += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logging.exception(f"Enrichment worker failed: {e}")
+            finally:
+                self.work_queue.task_done()
+
+
+class MicroBatcher:
+    """
+    Collect lookup keys over a short window and resolve them with one batched call.
+    Keys are submitted as soon as a tweet is read so the batch spans every tweet in flight,
+    not just the ones the workers are currently holding.
+
+    :param fetch: function resolving a list of keys to a dict of key -> result (or Exception)
+    :param max_batch: the maximum number of keys per call
+    :param max_wait: the maximum seconds the first key of a batch waits before the batch is sent
+    :param name: name used for the dispatcher thread and logging
+    """
+
+    def __init__(self,
+                 fetch: Callable[[List[Hashable]], Dict[Hashable, Any]],
+                 max_batch: int = 100,
+                 max_wait: float = 0.5,
+                 name: str = "batcher"):
+        self.fetch = fetch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.name = name
+        self.batches = 0
+        self.keys = 0
+        self._pending: List[Tuple[Hashable, Future, float]] = []
+        self._first_at: Optional[float] = None
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Start the dispatcher thread
+        """
+        self._stop = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"{self.name}-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Send the remaining keys and stop the dispatcher thread
+        """
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        logging.info(
+            f"Stopped {self.name} - {self.keys} keys in {self.batches} batches")
+
+    def submit(self, key: Hashable, priority: Optional[float] = None) -> Future:
+        """
+        Queue a key for the next batch without blocking
+
+        :param key: the key to resolve
+        :param priority: the rate limit priority of the key (defaults to the call priority of the context) -
+            a batch is fetched with the highest priority of its keys
+
+        :return: future resolved with the result for the key
+        """
+        future: Future = Future()
+        with self._cond:
+            if not self._pending:
+                self._first_at = time.monotonic()
+            self._pending.append((key, future, rl.call_priority.get() if priority is None else priority))
+            # wake the dispatcher to start the max_wait timer, or to send a full batch
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        return future
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._pending and (self._stop or len(self._pending) >= self.max_batch):
+                        break
+                    if self._pending:
+                        remaining = self.max_wait - (time.monotonic() - self._first_at)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    elif self._stop:
+                        return
+                    else:
+                        self._cond.wait()
+                batch = self._pending[:self.max_batch]
+                self._pending = self._pending[self.max_batch:]
+                self._first_at = time.monotonic() if self._pending else None
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: List[Tuple[Hashable, Future, float]]) -> None:
+        keys = list(dict.fromkeys(key for key, _, _ in batch))
+        self.batches += 1
+        self.keys += len(keys)
+        try:
+            with rl.prioritized(max(priority for _, _, priority in batch)):
+                results = self.fetch(keys)
+        except Exception as e:
+            logging.error(f"{self.name} batch of {len(keys)} failed: {e}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for key, future, _ in batch:
+            result = results.get(key)
+            if result is None:
+                future.set_exception(KeyError(f"{self.name} returned no result for {key}"))
+            elif isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+mt.registry.describe("stream_shed_total",
+                     "Low priority tweets by outcome - shed past the backlog or from a full queue, or served after being deferred")
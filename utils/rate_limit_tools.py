@@ -0,0 +1,267 @@
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Mapping, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from utils import metrics_tools as mt
+
+'''
+Tools for staying inside the Twitter API rate limits - contains functions for:
+    - Grouping API calls into the endpoint families that share a 15 minute rate limit window
+    - A token bucket per endpoint family fed by the x-rate-limit-* response headers
+    - A scheduler every Twitter call waits on, which delays and reorders calls to stay in budget
+    - Exporting the remaining budget of every endpoint family as metrics
+    - Tagging the calls made while handling a tweet with the tweet's priority
+
+Rather than spending the whole budget in a burst and then stalling until the window
+resets, each bucket spreads the remaining calls evenly over the rest of the window.
+'''
+
+# host[:port] of the Twitter API - stream_tools adds the configured base url (e.g. a local fake API)
+TWITTER_HOSTS = {"api.twitter.com"}
+
+# priority of the Twitter calls made in the current context - set per tweet with prioritized()
+call_priority: ContextVar[float] = ContextVar("call_priority", default=0)
+
+
+@contextmanager
+def prioritized(priority: float) -> Iterator[None]:
+    """
+    Send the Twitter calls made inside the block with this priority when they wait on the rate limit
+    """
+    token = call_priority.set(priority)
+    try:
+        yield
+    finally:
+        call_priority.reset(token)
+
+
+# (path pattern, endpoint family) - checked in order, first match wins
+ENDPOINT_FAMILIES = (
+    (re.compile(r"^/2/tweets/search/stream/rules"), "rules"),
+    (re.compile(r"^/2/tweets/search/stream"), "stream"),
+    (re.compile(r"^/2/users/[^/]+/tweets"), "user_timeline"),
+    (re.compile(r"^/2/users"), "user_lookup"),
+    (re.compile(r"^/2/tweets"), "tweet_lookup"),
+    (re.compile(r"^/1\.1/statuses/show"), "tweet_lookup_v1"),
+)
+
+
+# seconds in a rate limit window
+WINDOW = 15 * 60
+
+# calls per window assumed for a family until a response carries its x-rate-limit-* headers -
+# the app auth limits of the smallest tier, so an unknown budget is never spent faster than that
+DEFAULT_LIMITS: Dict[str, int] = {
+    "rules": 450,
+    "stream": 50,
+    "user_timeline": 1500,
+    "user_lookup": 300,
+    "tweet_lookup": 300,
+    "tweet_lookup_v1": 300,
+    "other": 15,
+}
+
+
+def endpoint_family(url: str) -> Optional[str]:
+    """
+    The rate limit family of a Twitter API url, None for urls that are not rate limited (e.g. images)
+    """
+    parsed = urlparse(url)
+    if parsed.netloc not in TWITTER_HOSTS or not parsed.path.startswith(("/2/", "/1.1/")):
+        return None
+    for pattern, family in ENDPOINT_FAMILIES:
+        if pattern.match(parsed.path):
+            return family
+    return "other"
+
+
+class TokenBucket:
+    """
+    Call budget of one endpoint family
+
+    :param name: the endpoint family
+    :param burst: the maximum number of calls allowed back to back
+    :param default_limit: calls per window paced at while the budget is not known (see DEFAULT_LIMITS)
+    """
+
+    def __init__(self, name: str, burst: int, default_limit: int):
+        self.name = name
+        self.burst = burst
+        self.default_rate = default_limit / WINDOW
+        self.tokens = float(burst)
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at: Optional[float] = None
+        self.rate = self.default_rate
+        self._refilled_at = time.time()
+
+    def refill(self, now: float) -> None:
+        if self.reset_at is not None and now >= self.reset_at:
+            # the window reset - budget unknown until the next response tells us
+            self.remaining, self.reset_at, self.rate = None, None, self.default_rate
+            self.tokens = float(self.burst)
+        else:
+            self.tokens = min(self.burst, self.tokens + self.rate * (now - self._refilled_at))
+        self._refilled_at = now
+
+    def wait_time(self, now: float) -> float:
+        """
+        Seconds until a call may be made, 0 if one may be made now
+        """
+        if self.remaining is not None and self.remaining <= 0:
+            return max(0.0, self.reset_at - now) if self.reset_at is not None else 1.0
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return max(0.0, self.reset_at - now) if self.reset_at is not None else 1.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens = max(0.0, self.tokens - 1)
+        if self.remaining is not None:
+            self.remaining -= 1
+
+    def update(self, limit: int, remaining: int, reset_at: float, now: float) -> None:
+        self.limit, self.remaining, self.reset_at = limit, remaining, reset_at
+        # spread what is left of the window evenly until it resets
+        self.rate = max(remaining, 0) / max(reset_at - now, 1.0)
+
+
+class RateLimitScheduler:
+    """
+    Scheduler every Twitter call goes through before it is sent
+
+    :param burst: the maximum number of calls per endpoint family allowed back to back
+    """
+
+    def __init__(self, burst: int = 5):
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._waiters: Dict[str, list] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _bucket(self, family: str) -> TokenBucket:
+        if family not in self._buckets:
+            self._buckets[family] = TokenBucket(family, self.burst, DEFAULT_LIMITS.get(family, DEFAULT_LIMITS["other"]))
+            self._waiters[family] = []
+        return self._buckets[family]
+
+    def acquire(self,
+                url: str,
+                priority: Optional[float] = None,
+                timeout: Optional[float] = None,
+                cancelled: Optional[threading.Event] = None) -> bool:
+        """
+        Wait until a call to url fits in its endpoint family budget.
+        Waiting calls of the same family are released highest priority first, then in arrival order.
+
+        :param url: the url about to be called
+        :param priority: higher is sent first when calls are waiting (defaults to the call_priority of the context)
+        :param timeout: give up after this many seconds (wait as long as it takes if None)
+        :param cancelled: give up as soon as this event is set (see cancel)
+
+        return: True once the call may be sent, False if it gave up - no budget is taken then
+        """
+        if priority is None:
+            priority = call_priority.get()
+        family = endpoint_family(url)
+        if family is None:
+            return True
+        started = time.monotonic()
+        give_up_at = started + timeout if timeout is not None else None
+        with self._cond:
+            bucket = self._bucket(family)
+            waiters = self._waiters[family]
+            waiter = (-priority, next(self._seq))
+            heapq.heappush(waiters, waiter)
+            while True:
+                now = time.time()
+                bucket.refill(now)
+                wait = bucket.wait_time(now)
+                if waiters[0] == waiter and wait <= 0:
+                    heapq.heappop(waiters)
+                    bucket.take()
+                    self._cond.notify_all()
+                    break
+                left = give_up_at - time.monotonic() if give_up_at is not None else None
+                if (cancelled is not None and cancelled.is_set()) or (left is not None and left <= 0):
+                    # leave the queue so the calls behind this one are not held up by it
+                    waiters.remove(waiter)
+                    heapq.heapify(waiters)
+                    self._cond.notify_all()
+                    return False
+                if wait > 0 and left is not None:
+                    wait = min(wait, left)
+                elif wait <= 0:
+                    wait = left
+                self._cond.wait(timeout=wait)
+        waited = time.monotonic() - started
+        mt.registry.observe("twitter_rate_limit_wait_seconds", waited, endpoint=family)
+        if waited > 1:
+            logging.info(f"Waited {waited:.1f}s for the {family} rate limit budget")
+        return True
+
+    def cancel(self, cancelled: threading.Event) -> None:
+        """
+        Make the acquire waiting on this event give up now rather than at its next wake up
+        """
+        with self._cond:
+            cancelled.set()
+            self._cond.notify_all()
+
+    def update(self, response: requests.Response) -> None:
+        """
+        Update the budget of the endpoint family from the x-rate-limit-* headers of a response
+        """
+        self.update_from(response.url, response.status_code, response.headers)
+
+    def update_from(self, url: str, status_code: int, headers: Mapping[str, str]) -> None:
+        """
+        Update the budget of the endpoint family of url from the status and headers of any
+        HTTP client's response (e.g. aiohttp)
+        """
+        family = endpoint_family(url)
+        if family is None:
+            return
+        try:
+            limit = int(headers["x-rate-limit-limit"])
+            remaining = int(headers["x-rate-limit-remaining"])
+            reset_at = float(headers["x-rate-limit-reset"])
+        except (KeyError, ValueError):
+            if status_code != 429:
+                return
+            # rate limited without headers - back off for a full window
+            limit, remaining, reset_at = 0, 0, time.time() + 15 * 60
+        if status_code == 429:
+            remaining = 0
+            logging.warning(f"Rate limited on {family} until {reset_at:.0f}")
+        with self._cond:
+            self._bucket(family).update(limit, remaining, reset_at, time.time())
+            self._cond.notify_all()
+        mt.registry.set_gauge("twitter_rate_limit_limit", limit, endpoint=family)
+        mt.registry.set_gauge("twitter_rate_limit_remaining", remaining, endpoint=family)
+        mt.registry.set_gauge("twitter_rate_limit_reset_seconds",
+                              max(0.0, reset_at - time.time()), endpoint=family)
+
+    def remaining(self) -> Dict[str, Optional[int]]:
+        """
+        Remaining calls per endpoint family, None where the budget is not known yet
+        """
+        with self._cond:
+            return {family: bucket.remaining for family, bucket in self._buckets.items()}
+
+
+mt.registry.describe("twitter_rate_limit_remaining", "Calls left in the current rate limit window per endpoint family")
+mt.registry.describe("twitter_rate_limit_limit", "Calls allowed per rate limit window per endpoint family")
+mt.registry.describe("twitter_rate_limit_reset_seconds", "Seconds until the rate limit window resets per endpoint family")
+mt.registry.describe("twitter_rate_limit_wait_seconds", "Time calls waited for rate limit budget per endpoint family")
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+'''
+Tools for preprocessing the collection reference images once - contains functions for:
+    - Building a per-collection stack of grayscale references at one canonical resolution
+    - Storing it as a .npy next to a manifest of the files it was built from
+    - Opening it memory-mapped, so startup reads nothing and worker processes share its pages
+    - Rebuilding it only when the reference folder changed
+
+Layout of the index folder:
+    <collection>.npy     uint8 array of shape (references, size, size)
+    <collection>.json    collection, folder, size, file names in row order and a fingerprint of the folder
+'''
+
+
+def list_references(folder_path: str) -> List[str]:
+    """
+    List the reference image file names of a collection folder
+    """
+    return sorted(f for f in os.listdir(folder_path) if f.endswith((".png", ".jpg")))
+
+
+def folder_fingerprint(folder_path: str, files: List[str]) -> str:
+    """
+    Hash of the names, sizes and modification times of the reference files
+    """
+    digest = hashlib.sha256()
+    for file in files:
+        stat = os.stat(os.path.join(folder_path, file))
+        digest.update(f"{file}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def preprocess(img: Image, size: int) -> np.ndarray:
+    """
+    Grayscale an image and resize it to the canonical size x size resolution
+    """
+    return np.array(img.convert("L").resize((size, size)))
+
+
+class ReferenceIndex:
+    """
+    Memory-mapped stack of the preprocessed reference images of one collection
+
+    :param collection: the collection name
+    :param folder_path: the folder of reference images it was built from
+    :param path: the .npy file holding the stack
+    :param files: the reference file name of each row
+    :param size: the canonical resolution of every reference
+    :param fingerprint: the folder fingerprint the index was built from (see folder_fingerprint)
+    """
+
+    def __init__(self, collection: str, folder_path: str, path: str, files: List[str], size: int,
+                 fingerprint: str = ""):
+        self.collection = collection
+        self.folder_path = folder_path
+        self.path = path
+        self.files = files
+        self.size = size
+        self.fingerprint = fingerprint
+        self._images: Optional[np.ndarray] = None
+
+    @property
+    def images(self) -> np.ndarray:
+        """
+        The (references, size, size) stack, mapped on first use
+        """
+        if self._images is None:
+            # an empty array cannot be mapped
+            self._images = np.load(self.path, mmap_mode="r" if self.files else None)
+        return self._images
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    @staticmethod
+    def _paths(index_dir: str, collection: str):
+        return os.path.join(index_dir, collection + ".npy"), os.path.join(index_dir, collection + ".json")
+
+    @classmethod
+    def build(cls, collection: str, folder_path: str, index_dir: str, size: int) -> "ReferenceIndex":
+        """
+        Decode, grayscale and resize every reference of a collection into a new index
+        """
+        started = time.monotonic()
+        os.makedirs(index_dir, exist_ok=True)
+        npy_path, manifest_path = cls._paths(index_dir, collection)
+        files = list_references(folder_path)
+        tmp_path = npy_path + ".tmp"
+        if files:
+            # written in place so a large collection never has to fit in memory
+            stack = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=(len(files), size, size))
+            for row, file in enumerate(files):
+                with Image.open(os.path.join(folder_path, file)) as img:
+                    stack[row] = preprocess(img, size)
+            stack.flush()
+            del stack
+        else:
+            with open(tmp_path, "wb") as file:
+                np.save(file, np.zeros((0, size, size), dtype=np.uint8))
+        os.replace(tmp_path, npy_path)
+
+        fingerprint = folder_fingerprint(folder_path, files)
+        manifest = {"collection": collection, "folder": folder_path, "size": size, "files": files,
+                    "fingerprint": fingerprint, "built_at": time.time()}
+        with open(manifest_path + ".tmp", "w") as file:
+            json.dump(manifest, file)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        logging.info(
+            f"Built {collection} reference index: {len(files)} images at {size}x{size} in {time.monotonic() - started:.1f}s")
+        return cls(collection, folder_path, npy_path, files, size, fingerprint)
+
+    @classmethod
+    def open(cls, collection: str, folder_path: str, index_dir: str, size: int) -> "ReferenceIndex":
+        """
+        Open the index of a collection, building it first if it is missing or out of date
+        """
+        npy_path, manifest_path = cls._paths(index_dir, collection)
+        try:
+            with open(manifest_path) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return cls.build(collection, folder_path, index_dir, size)
+        files = list_references(folder_path)
+        fingerprint = folder_fingerprint(folder_path, files)
+        if (manifest["size"] != size or manifest["files"] != files or not os.path.exists(npy_path)
+                or manifest["fingerprint"] != fingerprint):
+            logging.info(f"{collection} reference index is out of date - rebuilding")
+            return cls.build(collection, folder_path, index_dir, size)
+        return cls(collection, folder_path, npy_path, files, size, fingerprint)
+
+
+def open_indexes(folders: Dict[str, str], index_dir: str, size: int) -> Dict[str, ReferenceIndex]:
+    """
+    Open the reference index of every collection
+
+    :param folders: collection name -> folder of reference images
+    """
+    return {collection: ReferenceIndex.open(collection, folder_path, index_dir, size)
+            for collection, folder_path in folders.items()}
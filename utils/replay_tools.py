@@ -0,0 +1,109 @@
+import gzip
+import json
+import logging
+import time
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+'''
+Tools for recording and replaying the filtered stream - contains functions for:
+    - Appending raw stream lines to a compressed, timestamped, append-only log
+    - Reading a recorded log back
+    - Replaying a recorded log at real time, N x real time or as fast as possible
+
+Recordings are gzipped JSON lines of the form {"ts": <epoch seconds>, "line": <raw stream line>}.
+Every flush appends the buffered lines as a complete gzip member, which gzip reads back as one stream,
+so a recording cut off by a crash still reads back up to its last flush.
+'''
+
+
+class StreamRecorder:
+    """
+    Append raw stream lines to a gzipped JSON lines log
+
+    :param path: the recording file, created if missing and appended to otherwise
+    :param flush_every: number of lines between flushes so a crash loses at most this many lines
+    """
+
+    def __init__(self, path: str, flush_every: int = 100):
+        self.path = path
+        self.flush_every = flush_every
+        self.recorded = 0
+        self._buffer: List[bytes] = []
+        self._file = open(path, "ab")
+        logging.info(f"Recording stream to {path}")
+
+    def record(self, response_line: bytes, ts: Optional[float] = None) -> None:
+        """
+        Append a raw stream line with its arrival time
+
+        :param response_line: the raw line read from the stream
+        :param ts: arrival time in epoch seconds (defaults to now)
+        """
+        entry = {
+            "ts": time.time() if ts is None else ts,
+            "line": response_line.decode("utf-8"),
+        }
+        self._buffer.append((json.dumps(entry) + "\n").encode("utf-8"))
+        self.recorded += 1
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the buffered lines to the file as one complete gzip member
+        """
+        if self._buffer:
+            self._file.write(gzip.compress(b"".join(self._buffer)))
+            self._file.flush()
+            self._buffer = []
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+        logging.info(f"Recorded {self.recorded} stream lines to {self.path}")
+
+
+def read_recording(path: str) -> Iterator[Tuple[float, bytes]]:
+    """
+    Read a recorded stream log
+
+    :param path: the recording file
+
+    :return: generator of (arrival time, raw stream line)
+    """
+    with gzip.open(path, "rb") as file:
+        try:
+            for raw in file:
+                if not raw.strip():
+                    continue
+                try:
+                    entry = json.loads(raw)
+                except ValueError:
+                    # the last line of a recording cut off by a crash
+                    logging.warning(f"Skipping truncated line in recording {path}")
+                    continue
+                yield entry["ts"], entry["line"].encode("utf-8")
+        except (EOFError, zlib.error):
+            # a gzip member cut off by a crash - everything before it has been read
+            logging.warning(f"Recording {path} ends in a truncated gzip member - replaying up to it")
+
+
+def replay_lines(path: str, speed: float = 1.0) -> Iterator[bytes]:
+    """
+    Replay a recorded stream log with its original pacing
+
+    :param path: the recording file
+    :param speed: 1.0 for real time, N for N x real time, 0 for as fast as possible
+
+    :return: generator of raw stream lines
+    """
+    first_ts, started = None, time.monotonic()
+    for ts, response_line in read_recording(path):
+        if speed > 0:
+            if first_ts is None:
+                first_ts = ts
+            delay = (ts - first_ts) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        yield response_line
@@ -0,0 +1,95 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple
+
+'''
+Tools for keeping the stream rules on the Twitter API in sync with the config - contains functions for:
+    - Diffing the rules on the API against Config.rules/Config.tags by value and tag
+    - Turning the diff into the add/delete payloads of the rules endpoint, in a safe order
+
+Only the rules that changed are added or deleted, so every unchanged rule keeps matching
+while the tracked collections are updated.
+'''
+
+
+@dataclass
+class RuleDiff:
+    """
+    DataModel for the changes needed to bring the stream rules in line with the config
+
+    :param add: rules to add as {"value": rule, "tag": tag}
+    :param delete: IDs of the rules on the API to delete
+    :param unchanged: the number of rules already in place
+    """
+    add: List[Dict[str, str]] = field(default_factory=list)
+    delete: List[str] = field(default_factory=list)
+    unchanged: int = 0
+
+    @property
+    def empty(self) -> bool:
+        return not self.add and not self.delete
+
+    def retagged(self, current: List[Dict[str, str]]) -> Set[str]:
+        """
+        The rule values that are deleted and added again with a new tag
+
+        :param current: the rules on the API the diff was made against
+        """
+        deleted_values = {rule["value"] for rule in current if rule["id"] in self.delete}
+        return {rule["value"] for rule in self.add if rule["value"] in deleted_values}
+
+    def payloads(self, current: List[Dict[str, str]]) -> List[Dict]:
+        """
+        The request bodies for the rules endpoint - it takes either an add or a delete per call.
+        Adds go first so the stream never matches less than it should, unless a rule value is
+        re-added with a new tag: the API rejects duplicate values, so its old rule is deleted first.
+
+        :param current: the rules on the API the diff was made against
+        """
+        payloads = []
+        if self.add:
+            payloads.append({"add": self.add})
+        if self.delete:
+            delete = {"delete": {"ids": self.delete}}
+            if self.retagged(current):
+                payloads.insert(0, delete)
+            else:
+                payloads.append(delete)
+        return payloads
+
+
+def desired_rules(rules: List[str], tags: List[str]) -> List[Dict[str, str]]:
+    """
+    Pair the config rules with their tags, dropping repeated rule values
+    """
+    if len(rules) != len(tags):
+        raise ValueError(f"Every rule needs a tag - got {len(rules)} rules and {len(tags)} tags")
+    seen, desired = set(), []
+    for value, tag in zip(rules, tags):
+        if value not in seen:
+            seen.add(value)
+            desired.append({"value": value, "tag": tag})
+    return desired
+
+
+def diff_rules(current: List[Dict[str, str]], rules: List[str], tags: List[str]) -> RuleDiff:
+    """
+    Diff the rules on the API against the config rules and tags
+
+    :param current: the "data" of the rules endpoint - {"id", "value", "tag"} per rule
+    :param rules: Config.rules
+    :param tags: Config.tags
+    """
+    wanted: Dict[Tuple[str, str], Dict[str, str]] = {
+        (rule["value"], rule["tag"]): rule for rule in desired_rules(rules, tags)}
+    diff = RuleDiff()
+    kept = set()
+    for rule in current:
+        key = (rule["value"], rule.get("tag", ""))
+        if key in wanted and key not in kept:
+            kept.add(key)
+            diff.unchanged += 1
+        else:
+            # not in the config, or a second copy of a rule already kept
+            diff.delete.append(rule["id"])
+    diff.add = [rule for key, rule in wanted.items() if key not in kept]
+    return diff
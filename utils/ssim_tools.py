@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+
+'''
+Tools for scoring one grayscale pfp against many reference images with SSIM in one pass - contains functions for:
+    - Box filtered local statistics of a whole (N, H, W) reference stack in one OpenCV call
+    - Computing the pfp's local mean and variance once and reusing them for every reference
+
+Matches skimage.metrics.structural_similarity on 2-D images with its defaults: a 7x7 uniform
+window, K1 = 0.01, K2 = 0.03, the sample covariance (NP / (NP - 1)) and the mean taken over the
+similarity map cropped by half a window. That crop leaves only the positions whose window lies
+fully inside the image, so the filter's border mode never affects the result.
+'''
+
+
+def _box_mean(images: np.ndarray, win_size: int) -> np.ndarray:
+    """
+    Mean of the win_size x win_size window around every pixel of the last two axes.
+    The stack is filtered as one tall (N * H, W) image: windows straddling two references
+    only land on the rows _crop drops, so a single OpenCV call covers every reference.
+    """
+    width = images.shape[-1]
+    return cv2.boxFilter(images.reshape(-1, width), -1, (win_size, win_size),
+                         borderType=cv2.BORDER_REFLECT).reshape(images.shape)
+
+
+def _crop(images: np.ndarray, win_size: int) -> np.ndarray:
+    pad = win_size // 2
+    return images[..., pad:images.shape[-2] - pad, pad:images.shape[-1] - pad]
+
+
+class BatchedSSIM:
+    """
+    SSIM of one image against stacks of references of the same size
+
+    :param image: the grayscale (H, W) image every reference is compared with
+    :param win_size: the side of the uniform window
+    :param data_range: the range of the pixel values (255 for uint8)
+    :param batch_pixels: about how many reference pixels are scored per step - small enough that the
+        working arrays stay in the CPU cache, which is faster than one pass over the whole stack
+    """
+
+    def __init__(self, image: np.ndarray, win_size: int = 7, data_range: float = 255,
+                 K1: float = 0.01, K2: float = 0.03, batch_pixels: int = 1 << 14):
+        if image.ndim != 2 or min(image.shape) < win_size:
+            raise ValueError(f"Expected a 2-D image of at least {win_size}x{win_size} - got shape {image.shape}")
+        self.win_size = win_size
+        self.batch_size = max(1, batch_pixels // image.size)
+        self.C1 = (K1 * data_range) ** 2
+        self.C2 = (K2 * data_range) ** 2
+        self.cov_norm = win_size ** 2 / (win_size ** 2 - 1)
+        self.x = np.ascontiguousarray(image, dtype=np.float64)
+        # the image's own statistics, and the terms built only from them, are the same for every reference
+        self.ux = _box_mean(self.x, win_size)
+        vx = self.cov_norm * (_box_mean(self.x * self.x, win_size) - self.ux * self.ux)
+        self._ux_sq_c1 = self.ux * self.ux + self.C1
+        self._vx_c2 = vx + self.C2
+
+    def score(self, references: np.ndarray) -> np.ndarray:
+        """
+        The mean SSIM of the image against every reference
+
+        :param references: (N, H, W) stack of grayscale references
+
+        return: (N,) similarities
+        """
+        if references.shape[1:] != self.x.shape:
+            raise ValueError(f"Expected references of shape (N, {self.x.shape[0]}, {self.x.shape[1]}) - got {references.shape}")
+        scores = np.empty(len(references), dtype=np.float64)
+        for start in range(0, len(references), self.batch_size):
+            y = np.ascontiguousarray(references[start:start + self.batch_size], dtype=np.float64)
+            scratch = np.empty_like(y)
+            uy = _box_mean(y, self.win_size)
+            yy = _box_mean(np.multiply(y, y, out=scratch), self.win_size)
+            xy = _box_mean(np.multiply(y, self.x, out=scratch), self.win_size)
+            # in place from here on: every full-stack temporary costs as much as a filter
+            ux_uy = np.multiply(uy, self.ux, out=scratch)
+            uy *= uy
+            # 2 * vxy + C2, with vxy = cov_norm * (E[xy] - ux * uy)
+            xy -= ux_uy
+            xy *= 2 * self.cov_norm
+            xy += self.C2
+            # vx + vy + C2, with vy = cov_norm * (E[yy] - uy^2)
+            yy -= uy
+            yy *= self.cov_norm
+            yy += self._vx_c2
+            # 2 * ux * uy + C1 and ux^2 + uy^2 + C1
+            ux_uy *= 2
+            ux_uy += self.C1
+            uy += self._ux_sq_c1
+            ux_uy *= xy
+            uy *= yy
+            ux_uy /= uy
+            scores[start:start + len(y)] = _crop(ux_uy, self.win_size).mean(axis=(-2, -1))
+        return scores
+
+
+def structural_similarity(image: np.ndarray, references: np.ndarray, **kwargs) -> np.ndarray:
+    """
+    The mean SSIM of an image against every reference of an (N, H, W) stack (see BatchedSSIM)
+    """
+    return BatchedSSIM(image, **kwargs).score(references)
@@ -6,8 +6,16 @@ import sys
 from datetime import datetime, timedelta
 import logging
 import requests
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple, Union
+from urllib.parse import urlparse
 from sqlalchemy.engine import Engine
+from utils import log_tools as lt
+from utils import http_tools as ht
+from utils import rate_limit_tools as rl
+from utils import user_tools as ut
+from utils import timeline_tools as tt
+from utils import image_cache_tools as ict
+from utils import rule_tools as rut
 
 from dotenv import load_dotenv
 if 'GITHUB_ACTION' not in os.environ:
@@ -25,7 +33,7 @@ Tools for interacting with the Twitter API in a filtered stream - contains funct
     - Getting the rules from the rules.yml file
     - Adding rules to the rules.yml file
     - Removing rules from the rules.yml file
-    - Updating the rules on the Twitter API
+    - Updating the rules on the Twitter API by syncing only the rules that changed
 
 TODO: Determine whether we need get access modifiers or use the direct attribute from the class. Ex line 133: `config = Config.get_config(params)`
 '''
@@ -33,6 +41,27 @@ TODO: Determine whether we need get access modifiers or use the direct attribute
 bearer_token = os.environ.get("TWITTER_BEARER_TOKEN")
 params = Config()
 
+# every Twitter url is built on this base so the whole pipeline can run against a local fake API
+API_BASE = params.twitter_api_base.rstrip("/")
+rl.TWITTER_HOSTS.add(urlparse(API_BASE).netloc)
+
+# one pooled, keep-alive client for every Twitter call, paced by the per-endpoint rate limits
+scheduler = rl.RateLimitScheduler(burst=params.rate_limit_burst)
+client = ht.TwitterClient(
+    pool_size=params.http_pool_size,
+    timeout=(params.http_connect_timeout, params.http_read_timeout),
+    retry=ht.default_retry(params.http_retries, params.http_backoff_factor),
+    scheduler=scheduler,
+)
+
+# Expansions and fields requested on the stream connection itself so each tweet
+# arrives with its users, metrics, pfp and bio - same users as get_data_by_id
+STREAM_PARAMS = {
+    "expansions": "author_id,entities.mentions.username,referenced_tweets.id",
+    "tweet.fields": "author_id,created_at,entities,public_metrics,referenced_tweets",
+    "user.fields": ut.USER_FIELDS,
+}
+
 # SET BEARER TOKEN AUTH
 def bearer_oauth(r: requests.PreparedRequest) -> requests.PreparedRequest:
     """
@@ -51,15 +80,15 @@ def get_rules() -> Dict:
 
     :return json_response: Dict of rules
     """
-    response = requests.get(
-        "https://api.twitter.com/2/tweets/search/stream/rules", auth=bearer_oauth
+    response = client.get(
+        f"{API_BASE}/2/tweets/search/stream/rules", auth=bearer_oauth
     )
     if response.status_code != 200:
         raise Exception(
             "Cannot get rules (HTTP {}): {}".format(
                 response.status_code, response.text)
         )
-    logging.info(json.dumps(response.json()))
+    lt.log_event(logging.INFO, "stream_rules", response=response.json())
     return response.json()
 
 
@@ -74,8 +103,8 @@ def delete_all_rules(rules: List) -> None:
     ids = list(map(lambda rule: int(rule["id"]), rules["data"]))
     payload = {"delete": {"ids": ids}}
 
-    response = requests.post(
-        "https://api.twitter.com/2/tweets/search/stream/rules",
+    response = client.post(
+        f"{API_BASE}/2/tweets/search/stream/rules",
         auth=bearer_oauth,
         json=payload
     )
@@ -85,49 +114,82 @@ def delete_all_rules(rules: List) -> None:
                 response.status_code, response.text
             )
         )
-    logging.info(json.dumps(response.json()))
+    lt.log_event(logging.INFO, "stream_rules", response=response.json())
 
 
-# SET CURRENT STREAM RULES
-def set_rules() -> None:
+# SEND ONE ADD OR DELETE PAYLOAD TO THE RULES ENDPOINT
+def post_rules(payload: Dict, dry_run: bool = False) -> Dict:
     """
-    Set the stream rules for the current Twitter API stream
-    """
-    config = Config.get_config(params)
-    rules, my_rules = [], []
+    Add or delete stream rules
 
-    if params.update_flag == True:
-        my_rules = config.rules
-        tags = config.tags
-        params.update_flag = False
+    :param payload: {"add": [...]} or {"delete": {"ids": [...]}} - the endpoint takes one per call
+    :param dry_run: only validate the change, the stream rules stay as they are
 
-    for rule in my_rules:
-        rules.append(
-            {"value": rule, "tag": tags[my_rules.index(rule)]})
-    logging.info((f"ADDED RULES USED:\n {rules}"))
-
-    # Reconnect stream if not active and set rules again
-    response = requests.get(
-        "https://api.twitter.com/2/tweets/search/stream/rules", auth=bearer_oauth
-    )
-    axel_rules = get_rules()
-    if response.status_code != 200:
-        delete_all_rules(axel_rules)
-        logging.info("Reconnecting to the stream...")
-        config.recount += 1
-
-    payload = {"add": rules}
-    response = requests.post(
-        "https://api.twitter.com/2/tweets/search/stream/rules",
+    return: json response
+    """
+    response = client.post(
+        f"{API_BASE}/2/tweets/search/stream/rules" + ("?dry_run=true" if dry_run else ""),
         auth=bearer_oauth,
         json=payload,
     )
-    if response.status_code != 201:
+    if response.status_code not in (200, 201):
         raise Exception(
-            "Cannot add rules (HTTP {}): {}".format(
+            "Cannot update rules (HTTP {}): {}".format(
                 response.status_code, response.text)
         )
-    logging.info(json.dumps(response.json()))
+    json_response = response.json()
+    if json_response.get("errors"):
+        raise Exception(
+            "Cannot update rules{}: {}".format(" (dry run)" if dry_run else "", json_response["errors"]))
+    return json_response
+
+
+# SYNC STREAM RULES WITH CONFIG
+def sync_rules(current: Optional[Dict] = None, dry_run_first: bool = True) -> rut.RuleDiff:
+    """
+    Bring the stream rules in line with config.rules/config.tags by adding and deleting only
+    the rules that changed - unchanged rules keep matching throughout
+
+    :param current: the response of get_rules if already fetched
+    :param dry_run_first: validate every payload with dry_run before changing anything
+        (except the adds of re-tagged rules, which the API would reject while their old rule is live)
+
+    return: the changes that were made
+    """
+    config = Config.get_config(params)
+    if not config.rules:
+        logging.warning("No rules in config - leaving the stream rules as they are")
+        return rut.RuleDiff()
+    current_rules = (get_rules() if current is None else current).get("data", [])
+    diff = rut.diff_rules(current_rules, config.rules, config.tags)
+    if diff.empty:
+        lt.log_event(logging.INFO, "stream_rules_in_sync", rules=diff.unchanged)
+        return diff
+    payloads = diff.payloads(current_rules)
+    if dry_run_first:
+        # a re-tagged value is still live until its delete goes through, so its add would be
+        # rejected as a duplicate - it is a rule the API already accepted, so it is not checked
+        retagged = diff.retagged(current_rules)
+        for payload in payloads:
+            if "add" in payload:
+                payload = {"add": [rule for rule in payload["add"] if rule["value"] not in retagged]}
+                if not payload["add"]:
+                    continue
+            post_rules(payload, dry_run=True)
+    for payload in payloads:
+        lt.log_event(logging.INFO, "stream_rules", response=post_rules(payload))
+    lt.log_event(logging.INFO, "stream_rules_synced",
+                 added=[rule["value"] for rule in diff.add], deleted=diff.delete, unchanged=diff.unchanged)
+    return diff
+
+
+# SET CURRENT STREAM RULES
+def set_rules() -> None:
+    """
+    Set the stream rules for the current Twitter API stream from config
+    """
+    config = Config.get_config(params)
+    sync_rules()
     config.update_flag = False
 
 
@@ -138,9 +200,8 @@ def update_rules() -> None:
     config = Config.get_config(params)
 
     if config.update_flag == True:
-        print("UPDATING RULES")
-        delete_all_rules(get_rules())
-        set_rules()
+        logging.info("UPDATING RULES")
+        sync_rules()
         config.update_flag = False
 
 
@@ -165,8 +226,6 @@ def remove_rules(rules: List) -> bool:
         config.remove_rule = ""
         logging.info("REMOVE RULE RESET TO EMPTY")
 
-    delete_all_rules(get_rules())
-    # set_rules(new_rules) # shouldn't need new_rules passed
     set_rules()
     config.update_flag = False
     return config.update_flag
@@ -179,8 +238,8 @@ def get_data_by_id(tweet_id: str) -> Dict:
 
     :param tweet_id: (Self-explanatory)
     """
-    response = requests.get(
-        f"https://api.twitter.com/2/tweets/{str(tweet_id)}?expansions=author_id,entities.mentions.username,geo.place_id,referenced_tweets.id&media.fields=url&poll.fields=options&tweet.fields=public_metrics",
+    response = client.get(
+        f"{API_BASE}/2/tweets/{str(tweet_id)}?expansions=author_id,entities.mentions.username,geo.place_id,referenced_tweets.id&media.fields=url&poll.fields=options&tweet.fields=public_metrics,created_at&user.fields={ut.USER_FIELDS}",
         auth=bearer_oauth
     )
     if response.status_code != 200:
@@ -191,6 +250,76 @@ def get_data_by_id(tweet_id: str) -> Dict:
     return response.json()
 
 
+# USE TWEETS ENDPOINT TO GET TWEET DATA FOR UP TO 100 TWEET IDS IN ONE CALL
+def get_data_by_ids(tweet_ids: List[str]) -> Dict:
+    """
+    Return the data for up to 100 tweets given their tweet IDs - same expansions and fields as get_data_by_id
+
+    :param tweet_ids: the tweet IDs to look up (max 100)
+
+    return: json response with data, includes and errors for all of the tweets
+    """
+    if len(tweet_ids) > 100:
+        raise ValueError(
+            f"Tweet lookup accepts at most 100 IDs, got {len(tweet_ids)}")
+    ids = ",".join(str(tweet_id) for tweet_id in tweet_ids)
+    response = client.get(
+        f"{API_BASE}/2/tweets?ids={ids}&expansions=author_id,entities.mentions.username,geo.place_id,referenced_tweets.id&media.fields=url&poll.fields=options&tweet.fields=public_metrics,created_at&user.fields={ut.USER_FIELDS}",
+        auth=bearer_oauth
+    )
+    if response.status_code != 200:
+        raise Exception(
+            "Cannot get tweet data (HTTP {}): {}".format(
+                response.status_code, response.text)
+        )
+    return response.json()
+
+
+def split_tweet_lookup(tweet_ids: List[str], json_response: Dict) -> Dict[str, Union[Dict, Exception]]:
+    """
+    Route a multi-ID tweet lookup back to each tweet in the same shape get_data_by_id returns,
+    keeping only the included users, tweets and places that belong to that tweet
+
+    :param tweet_ids: the tweet IDs that were looked up
+    :param json_response: the response of get_data_by_ids
+
+    return: dict of tweet ID to its tweet data, or to an Exception if the tweet could not be found
+    """
+    includes = json_response.get("includes", {})
+    users_by_id = {user["id"]: user for user in includes.get("users", [])}
+    users_by_username = {user["username"].lower(): user for user in includes.get("users", [])}
+    tweets_by_id = {tweet["id"]: tweet for tweet in includes.get("tweets", [])}
+    places_by_id = {place["id"]: place for place in includes.get("places", [])}
+
+    results: Dict[str, Union[Dict, Exception]] = {}
+    for tweet in json_response.get("data", []):
+        users = []
+        if tweet.get("author_id") in users_by_id:
+            users.append(users_by_id[tweet["author_id"]])
+        for mention in tweet.get("entities", {}).get("mentions", []):
+            user = users_by_username.get(mention["username"].lower())
+            if user is not None and user not in users:
+                users.append(user)
+        tweet_includes = {"users": users}
+        referenced = [tweets_by_id[ref["id"]] for ref in tweet.get(
+            "referenced_tweets", []) if ref["id"] in tweets_by_id]
+        if referenced:
+            tweet_includes["tweets"] = referenced
+        place_id = tweet.get("geo", {}).get("place_id")
+        if place_id in places_by_id:
+            tweet_includes["places"] = [places_by_id[place_id]]
+        results[tweet["id"]] = {"data": tweet, "includes": tweet_includes}
+
+    errors = {error.get("resource_id", error.get("value")): error
+              for error in json_response.get("errors", [])}
+    for tweet_id in tweet_ids:
+        tweet_id = str(tweet_id)
+        if tweet_id not in results:
+            results[tweet_id] = Exception(
+                "Cannot get tweet data: {}".format(errors.get(tweet_id, "not returned by lookup")))
+    return results
+
+
 # GET ENGAGEMENT METRICS FOR TWEET BY TWEET ID
 def get_tweet_metrics(tweet_id: str) -> Dict:
     """
@@ -199,8 +328,8 @@ def get_tweet_metrics(tweet_id: str) -> Dict:
     :param tweet_id: (Self-explanatory)
     return: json response 
     """
-    response = requests.get(
-        f"https://api.twitter.com/1.1/statuses/show.json?id={str(tweet_id)}",
+    response = client.get(
+        f"{API_BASE}/1.1/statuses/show.json?id={str(tweet_id)}",
         auth=bearer_oauth
     )
 
@@ -211,18 +340,37 @@ def get_tweet_metrics(tweet_id: str) -> Dict:
         )
     return response.json()
 
-# CALL USERS ENDPOINT FOR USERNAME OF TWEETER BY TWEET AUTHOR ID
+# USE USERS ENDPOINTS TO GET UP TO 100 USERS IN ONE CALL
+def get_users_by_ids(user_ids: List[str]) -> Dict:
+    """
+    Get the profiles of up to 100 users by user ID with the combined user fields
+
+    :param user_ids: the user IDs to look up (max 100)
+    return: json response
+    """
+    ids = ",".join(str(user_id) for user_id in user_ids)
+    response = client.get(
+        f"{API_BASE}/2/users?ids={ids}&user.fields={ut.USER_FIELDS}",
+        auth=bearer_oauth
+    )
+    if response.status_code != 200:
+        raise Exception(
+            "Cannot get user data (HTTP {}): {}".format(
+                response.status_code, response.text)
+        )
+    return response.json()
 
 
-def get_username_by_author_id(author_id: str) -> Dict:
+def get_users_by_usernames(usernames: List[str]) -> Dict:
     """
-    Get twitter username from author ID
+    Get the profiles of up to 100 users by username with the combined user fields
 
-    :param author_id: (Self-explanatory)
-    return: json response 
+    :param usernames: the usernames to look up (max 100)
+    return: json response
     """
-    response = requests.get(
-        f"https://api.twitter.com/2/users/{str(author_id)}",
+    names = ",".join(str(username) for username in usernames)
+    response = client.get(
+        f"{API_BASE}/2/users/by?usernames={names}&user.fields={ut.USER_FIELDS}",
         auth=bearer_oauth
     )
     if response.status_code != 200:
@@ -233,6 +381,24 @@ def get_username_by_author_id(author_id: str) -> Dict:
     return response.json()
 
 
+# every single-user lookup goes through the profile cache, then is batched with the others in flight
+users = ut.UserResolver(
+    get_users_by_ids, get_users_by_usernames, params.user_batch_size, params.user_batch_wait,
+    cache=ut.ProfileCache(params.profile_cache_size, params.profile_cache_ttl,
+                          params.profile_cache_max_age, params.profile_cache_path))
+
+
+# CALL USERS ENDPOINT FOR USERNAME OF TWEETER BY TWEET AUTHOR ID
+def get_username_by_author_id(author_id: str) -> Dict:
+    """
+    Get twitter username from author ID
+
+    :param author_id: (Self-explanatory)
+    return: json response 
+    """
+    return {"data": users.resolve(user_id=author_id).raw}
+
+
 def get_twitter_user_info(username: str) -> Dict:
     """
     Get twitter user info from username
@@ -240,29 +406,17 @@ def get_twitter_user_info(username: str) -> Dict:
     :param username: (Self-explanatory)
     return: json response 
     """
-    # Twitter API endpoint for user lookup
-    url = f'https://api.twitter.com/2/users/by/username/{username}'
-
-    try:
-        response = requests.get(
-            url, headers={"Authorization": f"Bearer {bearer_token}"})
-
-        if response.status_code != 200:
-            raise Exception(
-                f"Failed to get user metrics (HTTP {response.status_code}): {response.text}")
-    except Exception as e:
-        logging.error(e)
-    return response.json()["data"]
+    return users.resolve(username=username).raw
 
 
 def get_user_metrics_start_end(user_id: str, start_date: str, end_date: str) -> Dict:
 
     aggregated_likes, aggregated_retweets, aggregated_replies, aggregated_impressions = 0, 0, 0, 0
 
-    url = f"https://api.twitter.com/2/users/{str(user_id)}/tweets?max_results=100&tweet.fields=public_metrics&start_time={str(start_date)}&end_time={str(end_date)}"
+    url = f"{API_BASE}/2/users/{str(user_id)}/tweets?max_results=100&tweet.fields=public_metrics&start_time={str(start_date)}&end_time={str(end_date)}"
 
     try:
-        response = requests.get(
+        response = client.get(
             url, headers={"Authorization": f"Bearer {bearer_token}"})
 
         if response.status_code != 200:
@@ -289,69 +443,86 @@ def get_user_metrics_start_end(user_id: str, start_date: str, end_date: str) ->
     return data
 
 
-def get_user_metrics_by_days(user_id, days) -> Dict:
+# USE USER TWEETS ENDPOINT TO GET ONE PAGE OF A USER TIMELINE
+def get_user_tweets_page(user_id: str,
+                         start_time: Optional[str] = None,
+                         since_id: Optional[str] = None,
+                         pagination_token: Optional[str] = None) -> Dict:
     """
-    Get user metrics given # days requested
+    Return one page (up to 100 tweets) of the timeline of a user with the public metrics of each tweet
 
-    :param user_id: (self-explanatory)
-    :param days: (self-explanatory)
+    :param user_id: (Self-explanatory)
+    :param start_time: only tweets created after this time, e.g. 2023-04-01T00:00:00Z
+    :param since_id: only tweets newer than this tweet ID
+    :param pagination_token: the next_token of the previous page
 
-    return: json response
+    return: json response with data and meta (newest_id, next_token...)
     """
+    url = f"{API_BASE}/2/users/{str(user_id)}/tweets?max_results=100&tweet.fields=public_metrics,created_at"
+    if since_id:
+        url += f"&since_id={since_id}"
+    elif start_time:
+        url += f"&start_time={start_time}"
+    if pagination_token:
+        url += f"&pagination_token={pagination_token}"
+    response = client.get(url, auth=bearer_oauth)
+    if response.status_code != 200:
+        raise Exception(
+            "Failed to get user metrics (HTTP {}): {}".format(
+                response.status_code, response.text)
+        )
+    return response.json()
 
-    aggregated_likes, aggregated_retweets, aggregated_replies, aggregated_impressions = 0, 0, 0, 0
 
-    end_date = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
-    start_date = (datetime.utcnow() - timedelta(days=days)
-                  ).strftime('%Y-%m-%dT%H:%M:%SZ')
+# USE TWEETS ENDPOINT TO GET ONLY THE PUBLIC METRICS OF UP TO 100 TWEETS
+def get_tweet_metrics_by_ids(tweet_ids: List[str]) -> Dict:
+    """
+    Return the public metrics of up to 100 tweets given their tweet IDs - no expansions
 
-    # current_time = datetime.utcnow()
+    :param tweet_ids: the tweet IDs to look up (max 100)
 
-    # if 'start_date' not in locals() or (current_time - datetime.fromisoformat(start_date)) >= timedelta(days=params.history):
-    #     start_date = (current_time - timedelta(days=params.history)
-    #                   ).strftime('%Y-%m-%dT%H:%M:%SZ')
-    #     end_date = (current_time + timedelta(days=1)
-    #                 ).strftime('%Y-%m-%dT%H:%M:%SZ')
-    # else:
-    #     end_date = (datetime.fromisoformat(end_date) +
-    #                 timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return: json response with data and errors for all of the tweets
+    """
+    if len(tweet_ids) > 100:
+        raise ValueError(
+            f"Tweet lookup accepts at most 100 IDs, got {len(tweet_ids)}")
+    ids = ",".join(str(tweet_id) for tweet_id in tweet_ids)
+    response = client.get(
+        f"{API_BASE}/2/tweets?ids={ids}&tweet.fields=public_metrics,created_at",
+        auth=bearer_oauth
+    )
+    if response.status_code != 200:
+        raise Exception(
+            "Cannot get tweet metrics (HTTP {}): {}".format(
+                response.status_code, response.text)
+        )
+    return response.json()
 
-    logging.debug(f"START DATE: {start_date}")
-    logging.debug(f"END DATE: {end_date}")
 
-    url = f"https://api.twitter.com/2/users/{str(user_id)}/tweets?max_results=100&tweet.fields=public_metrics&start_time={str(start_date)}&end_time={str(end_date)}"
+# pfp images by profile image url, revalidated with a conditional GET once older than the ttl
+images = ict.ImageCache(params.image_cache_path, client, params.image_cache_ttl, params.image_cache_memory,
+                        params.image_cache_max_age)
 
-    try:
-        response = requests.get(
-            url, headers={"Authorization": f"Bearer {bearer_token}"})
 
-        if response.status_code != 200:
-            raise Exception(
-                f"Failed to get user metrics (HTTP {response.status_code}): {response.text}")
-    except Exception as e:
-        logging.error(e)
-    # Parse the response JSON
-    data = response.json()
-    for tweet in data["data"]:
-        aggregated_likes += tweet["public_metrics"]["like_count"]
-        aggregated_retweets += tweet["public_metrics"]["retweet_count"]
-        aggregated_replies += tweet["public_metrics"]["reply_count"]
-        aggregated_impressions += tweet["public_metrics"]["impression_count"]
+# per-user tweet metrics with a since_id checkpoint, so only new tweets are fetched on later calls
+timelines = tt.TimelineAggregator.load(
+    params.timeline_path, get_user_tweets_page, get_tweet_metrics_by_ids,
+    params.timeline_fetch_interval, params.timeline_refresh_interval,
+    max_days=max(params.history, *params.engagement_windows), windows=tuple(params.engagement_windows))
 
-        data = {
-            "likes": aggregated_likes,
-            "retweets": aggregated_retweets,
-            "replies": aggregated_replies,
-            "impressions": aggregated_impressions
-        }
 
-    # TODO: determine best method of aggregating across all tweets
-    # Aggregate the metrics for all tweets
-    # metrics = {"likes": 0, "retweets": 0, "replies": 0, "impressions": 0}
-    # for tweet in data["data"]:
-    #     for key in metrics.keys():
-    #         metrics[key] += tweet["public_metrics"][key]
+def get_user_metrics_by_days(user_id, days) -> Dict:
+    """
+    Get user metrics given # days requested - the whole timeline of the window is counted,
+    not just its first page, and read from the daily buckets of the engagement window
 
+    :param user_id: (self-explanatory)
+    :param days: (self-explanatory)
+
+    return: dict of likes, retweets, replies and impressions
+    """
+    data = timelines.totals(user_id, days)
+    lt.log_event(logging.DEBUG, "user_metrics_window", user_id=user_id, days=days, metrics=data)
     return data
 
 
@@ -363,25 +534,8 @@ def get_bio_url(author: str) -> Tuple[str, str]:
 
     return: description/bio and url
     """
-    response = requests.get(
-        url=f"https://api.twitter.com/2/users/by/username/{str(author)}?user.fields=description,url",
-        auth=bearer_oauth
-    )
-    if response.status_code != 200:
-        raise Exception(
-            "Cannot get user data (HTTP {}): {}".format(
-                response.status_code, response.text)
-        )
-    data = response.json()["data"]
-    try:
-        desc = data["description"]
-    except KeyError:
-        desc = "None"
-    try:
-        urls = data["url"]
-    except KeyError:
-        urls = "None"
-    return desc, urls
+    profile = users.resolve(username=author)
+    return profile.description, profile.url
 
 
 def get_profile_picture_metadata(username: str) -> Tuple[str, Dict[str, str]]:
@@ -390,30 +544,10 @@ def get_profile_picture_metadata(username: str) -> Tuple[str, Dict[str, str]]:
 
     :param username: (self-explanatory)
     
-    :return: image url and response headers
+    :return: image url and the response headers of the image - served from the image cache, no HEAD call
     """
-    response = requests.get(
-        url=f"https://api.twitter.com/2/users/by/username/{str(username)}?user.fields=profile_image_url",
-        auth=bearer_oauth
-    )
-    if response.status_code != 200:
-        raise Exception(
-            "Cannot get user data (HTTP {}): {}".format(
-                response.status_code, response.text)
-        )
-    data = response.json()["data"]
-    try:
-        profile_image_url = data["profile_image_url"]
-    except KeyError:
-        profile_image_url = "None"
-
-    response = requests.head(profile_image_url)
-    if response.status_code != 200:
-        raise Exception(
-            "Cannot get user data (HTTP {}): {}".format(
-                response.status_code, response.text)
-        )
-    return profile_image_url, response.headers
+    profile_image_url = users.resolve(username=username).profile_image_url
+    return profile_image_url, images.get(profile_image_url).headers
 
 
 def update_pfp_tracked_table(engine: Engine, 
@@ -468,7 +602,7 @@ def update_pfp_tracked_table(engine: Engine,
             "Description": [desc],
             "Bio_Link": [url]
         })
-        logging.info(f"PFP Tracked Table Created: {pfp_table}")
+        lt.log_event(logging.INFO, "pfp_tracked_table_created", table=pfp_table)
         pfp_table.to_sql(pfp_table_name, engine,
                          if_exists="replace", index=False)
         logging.info(f"User {name} added to PFP Tracked Table")
@@ -513,7 +647,7 @@ def update_pfp_tracked_table(engine: Engine,
 
             if updates:
                 pfp_table.loc[user_index, updates.keys()] = updates.values()
-                logging.info(f"PFP Tracked values updated for user {name}: {updates}")
+                lt.log_event(logging.INFO, "pfp_tracked_values_updated", name=name, updates=updates)
         else:
             new_row = pd.DataFrame({
                 "index": [username],
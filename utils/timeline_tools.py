@@ -0,0 +1,254 @@
+import logging
+import os
+import pickle
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils import engagement_tools as et
+from utils import metrics_tools as mt
+
+'''
+Tools for keeping the engagement totals of leaderboard users current - contains functions for:
+    - Paginating a user timeline in full instead of reading only its first page
+    - Storing the public metrics of every tweet in the window with a since_id checkpoint per user
+    - Fetching only the tweets newer than the checkpoint on later calls
+    - Refreshing the metrics of older tweets still in the window through batched tweet lookups
+    - Taking metrics of tweets seen on the stream without any API call
+    - Persisting the stored timelines so a restart does not backfill every user again
+
+After the first backfill of a user, keeping the totals current costs one timeline call
+for the new tweets plus one tweet lookup per 100 stored tweets every refresh interval.
+Every change in a tweet's metrics is added to the daily buckets of an EngagementWindow,
+which the totals are read from.
+'''
+
+METRIC_KEYS = {
+    "likes": "like_count",
+    "retweets": "retweet_count",
+    "replies": "reply_count",
+    "impressions": "impression_count",
+}
+
+
+def parse_created_at(created_at: str) -> float:
+    """
+    Epoch seconds of a tweet created_at timestamp, e.g. 2023-04-01T12:00:00.000Z
+    """
+    return datetime.fromisoformat(created_at.replace("Z", "+00:00")).timestamp()
+
+
+def format_time(epoch: float) -> str:
+    """
+    Format epoch seconds as the start_time/end_time the API expects
+    """
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+@dataclass
+class UserTimeline:
+    """
+    DataModel for the stored tweets of one user
+
+    :param user_id: (Self-explanatory)
+    :param tweets: tweet ID -> (created_at epoch seconds, public_metrics)
+    :param since_id: the newest tweet ID fetched so far - later calls only fetch newer tweets
+    :param covered_from: epoch seconds from which the timeline has been backfilled
+    :param fetched_at: epoch seconds of the last call for new tweets
+    :param refreshed_at: epoch seconds of the last metrics refresh of the stored tweets
+    """
+    user_id: str
+    tweets: Dict[str, Tuple[float, Dict[str, int]]] = field(default_factory=dict)
+    since_id: Optional[str] = None
+    covered_from: Optional[float] = None
+    fetched_at: float = 0.0
+    refreshed_at: float = 0.0
+
+
+class TimelineAggregator:
+    """
+    Incremental per-user engagement totals over a rolling window of days
+
+    :param fetch_page: function(user_id, start_time, since_id, pagination_token) calling the user tweets endpoint
+    :param fetch_metrics: function(tweet_ids) calling the multi-ID tweet lookup (max 100 IDs)
+    :param fetch_interval: seconds during which stored totals are served without asking for new tweets
+    :param refresh_interval: seconds between metrics refreshes of the older stored tweets
+    :param max_days: the longest window in days totals can be read for
+    :param windows: the windows in days whose totals are kept running (see EngagementWindow)
+    """
+
+    def __init__(self,
+                 fetch_page: Callable[[str, Optional[str], Optional[str], Optional[str]], Dict],
+                 fetch_metrics: Callable[[List[str]], Dict],
+                 fetch_interval: float = 60,
+                 refresh_interval: float = 60 * 60,
+                 max_days: int = 30,
+                 windows: Tuple[int, ...] = (7, 30)):
+        self.fetch_page = fetch_page
+        self.fetch_metrics = fetch_metrics
+        self.fetch_interval = fetch_interval
+        self.refresh_interval = refresh_interval
+        self.engagement = et.EngagementWindow(max_days, windows)
+        self._timelines: Dict[str, UserTimeline] = {}
+        self._user_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        with self._lock:
+            if user_id not in self._user_locks:
+                self._user_locks[user_id] = threading.Lock()
+                self._timelines.setdefault(user_id, UserTimeline(user_id))
+            return self._user_locks[user_id]
+
+    def totals(self, user_id: str, days: int) -> Dict[str, int]:
+        """
+        Likes, retweets, replies and impressions of the tweets of a user in the last days,
+        fetching only what changed since the previous call for that user
+
+        :param user_id: (Self-explanatory)
+        :param days: the size of the window in days, at most max_days
+        """
+        user_id = str(user_id)
+        with self._user_lock(user_id):
+            timeline = self._timelines[user_id]
+            now = time.time()
+            # tweets are kept for the longest window, starting at midnight UTC like the daily buckets
+            window_start = (et.day_of(now) - self.engagement.max_days + 1) * et.DAY_SECONDS
+            if timeline.covered_from is None:
+                self._backfill(timeline, window_start, now)
+            elif now - timeline.fetched_at >= self.fetch_interval:
+                self._fetch_new(timeline, now)
+            if now - timeline.refreshed_at >= self.refresh_interval:
+                self._refresh(timeline, window_start, now)
+            # drop what fell out of the window
+            timeline.tweets = {tweet_id: tweet for tweet_id, tweet in timeline.tweets.items()
+                               if tweet[0] >= window_start}
+            timeline.covered_from = max(timeline.covered_from, window_start)
+        return self.engagement.totals(user_id, days, now)
+
+    def observe(self, user_id: str, tweet: Dict) -> None:
+        """
+        Take the metrics of a tweet seen on the stream, for users whose timeline is already stored.
+        The since_id checkpoint is left alone so tweets between it and this one are still fetched.
+
+        :param user_id: the author of the tweet
+        :param tweet: tweet object with created_at and public_metrics
+        """
+        user_id = str(user_id)
+        if user_id not in self._timelines or "public_metrics" not in tweet or "created_at" not in tweet:
+            return
+        with self._user_lock(user_id):
+            self._store(self._timelines[user_id], tweet["id"],
+                        parse_created_at(tweet["created_at"]), tweet["public_metrics"])
+
+    def _store(self, timeline: UserTimeline, tweet_id: str, created_at: float, public_metrics: Dict[str, int]) -> None:
+        """
+        Store the latest metrics of a tweet and add what changed to its day bucket
+        """
+        previous = timeline.tweets.get(tweet_id, (created_at, {}))[1]
+        timeline.tweets[tweet_id] = (created_at, public_metrics)
+        self.engagement.add(timeline.user_id, created_at, {
+            name: public_metrics.get(key, 0) - previous.get(key, 0) for name, key in METRIC_KEYS.items()})
+
+    def _forget(self, timeline: UserTimeline, tweet_id: str) -> None:
+        created_at, public_metrics = timeline.tweets.pop(tweet_id)
+        self.engagement.add(timeline.user_id, created_at, {
+            name: -public_metrics.get(key, 0) for name, key in METRIC_KEYS.items()})
+
+    def _paginate(self, timeline: UserTimeline, start_time: Optional[str], since_id: Optional[str]) -> int:
+        """
+        Follow next_token until the timeline is exhausted, storing every tweet
+
+        return: the number of tweets fetched
+        """
+        pagination_token, fetched, newest_id = None, 0, None
+        while True:
+            json_response = self.fetch_page(timeline.user_id, start_time, since_id, pagination_token)
+            mt.registry.inc("timeline_api_calls_total", kind="timeline")
+            for tweet in json_response.get("data", []):
+                self._store(timeline, tweet["id"], parse_created_at(tweet["created_at"]), tweet["public_metrics"])
+                fetched += 1
+            meta = json_response.get("meta", {})
+            # the first page carries the newest tweet of the whole result
+            newest_id = newest_id or meta.get("newest_id")
+            pagination_token = meta.get("next_token")
+            if not pagination_token:
+                break
+        if newest_id is not None:
+            timeline.since_id = newest_id
+        return fetched
+
+    def _backfill(self, timeline: UserTimeline, window_start: float, now: float) -> None:
+        fetched = self._paginate(timeline, format_time(window_start), None)
+        timeline.covered_from = window_start
+        timeline.fetched_at = timeline.refreshed_at = now
+        logging.debug(f"Backfilled {fetched} tweets of user {timeline.user_id}")
+
+    def _fetch_new(self, timeline: UserTimeline, now: float) -> None:
+        if timeline.since_id is None:
+            # nothing in the window yet - ask for everything since the window was last covered
+            self._paginate(timeline, format_time(timeline.covered_from), None)
+        else:
+            self._paginate(timeline, None, timeline.since_id)
+        timeline.fetched_at = now
+
+    def _refresh(self, timeline: UserTimeline, window_start: float, now: float) -> None:
+        """
+        Refresh the metrics of the stored tweets still in the window, 100 per lookup
+        """
+        tweet_ids = [tweet_id for tweet_id, (created_at, _) in timeline.tweets.items()
+                     if created_at >= window_start]
+        for i in range(0, len(tweet_ids), 100):
+            chunk = tweet_ids[i:i + 100]
+            json_response = self.fetch_metrics(chunk)
+            mt.registry.inc("timeline_api_calls_total", kind="tweet_lookup")
+            found = {tweet["id"]: tweet for tweet in json_response.get("data", [])}
+            for tweet_id in chunk:
+                if tweet_id in found:
+                    self._store(timeline, tweet_id, timeline.tweets[tweet_id][0], found[tweet_id]["public_metrics"])
+                else:
+                    # deleted or protected since it was stored - no longer counts
+                    self._forget(timeline, tweet_id)
+        timeline.refreshed_at = now
+
+    def save(self, path: str) -> None:
+        """
+        Persist the stored timelines so a restart only fetches what changed
+        """
+        with self._lock:
+            timelines = dict(self._timelines)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as file:
+                pickle.dump(timelines, file)
+        os.replace(tmp_path, path)
+        logging.debug(f"Saved {len(timelines)} user timelines to {path}")
+
+    @classmethod
+    def load(cls, path: str, *args, **kwargs) -> "TimelineAggregator":
+        """
+        Load persisted timelines, starting empty if there are none
+
+        :param path: the file written by save
+        :param args: see TimelineAggregator
+        """
+        aggregator = cls(*args, **kwargs)
+        if not path or not os.path.exists(path):
+            return aggregator
+        try:
+            with open(path, "rb") as file:
+                aggregator._timelines = pickle.load(file)
+        except Exception as e:
+            logging.warning(f"Could not load user timelines from {path}: {e}")
+            return aggregator
+        # rebuild the daily buckets from the stored tweet metrics
+        for timeline in aggregator._timelines.values():
+            for created_at, public_metrics in timeline.tweets.values():
+                aggregator.engagement.add(timeline.user_id, created_at, {
+                    name: public_metrics.get(key, 0) for name, key in METRIC_KEYS.items()})
+        logging.info(f"Loaded {len(aggregator._timelines)} user timelines from {path}")
+        return aggregator
+
+
+mt.registry.describe("timeline_api_calls_total", "Twitter calls made to keep user engagement totals current")
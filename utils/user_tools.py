@@ -0,0 +1,334 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from utils import metrics_tools as mt
+from utils import pipeline_tools as pt
+
+'''
+Tools for resolving Twitter user profiles in batches - contains functions for:
+    - A typed profile record holding everything the pipeline needs about a user
+    - Splitting multi-user lookups back into one profile per requested ID or username
+    - A resolver that collects IDs/usernames across tweets and resolves up to 100 per call
+    - A TTL profile cache (LRU in memory, optionally backed by sqlite on disk) the resolver consults first
+
+One /2/users or /2/users/by call with the combined user fields replaces the user lookup,
+image HEAD and bio lookup the pipeline used to make for every user of every tweet.
+'''
+
+USER_FIELDS = "profile_image_url,description,url,public_metrics"
+
+
+@dataclass
+class UserProfile:
+    """
+    DataModel for a Twitter user profile
+
+    :param id: the user ID
+    :param username: the @handle without the @
+    :param name: the display name
+    :param profile_image_url: the url of the pfp image ("None" if missing)
+    :param description: the bio of the user
+    :param url: the link in the bio of the user ("None" if missing)
+    :param public_metrics: followers_count, following_count, tweet_count and listed_count
+    :param raw: the user object as returned by the API
+    """
+    id: str
+    username: str
+    name: str = ""
+    profile_image_url: str = "None"
+    description: str = "None"
+    url: str = "None"
+    public_metrics: Dict[str, int] = field(default_factory=dict)
+    raw: Dict = field(default_factory=dict)
+
+    @classmethod
+    def from_user(cls, user: Dict) -> "UserProfile":
+        """
+        Build a profile from a user object of the API (lookup response or tweet includes)
+        """
+        return cls(
+            id=user["id"],
+            username=user["username"],
+            name=user.get("name", ""),
+            profile_image_url=user.get("profile_image_url", "None"),
+            description=user.get("description", "None"),
+            # url is left out of the user object when the bio has no link
+            url=user.get("url", "None"),
+            public_metrics=user.get("public_metrics", {}),
+            raw=user,
+        )
+
+    @property
+    def followers(self) -> int:
+        return self.public_metrics.get("followers_count", 0)
+
+
+def split_user_lookup(keys: List[str], json_response: Dict, by: str) -> Dict[str, Union[UserProfile, Exception]]:
+    """
+    Route a multi-user lookup back to each requested key
+
+    :param keys: the requested user IDs or usernames
+    :param json_response: the response of the multi-user lookup
+    :param by: "id" or "username" - what the keys are
+
+    return: dict of key to its profile, or to an Exception if the user could not be found
+    """
+    results: Dict[str, Union[UserProfile, Exception]] = {}
+    found = {}
+    for user in json_response.get("data", []):
+        profile = UserProfile.from_user(user)
+        found[profile.id if by == "id" else profile.username.lower()] = profile
+    errors = {str(error.get("value", error.get("resource_id", ""))).lower(): error
+              for error in json_response.get("errors", [])}
+    for key in keys:
+        lookup_key = key if by == "id" else key.lower()
+        if lookup_key in found:
+            results[key] = found[lookup_key]
+        else:
+            results[key] = Exception(
+                "Cannot get user data: {}".format(errors.get(lookup_key, "not returned by lookup")))
+    return results
+
+
+class ProfileCache:
+    """
+    LRU cache of user profiles keyed by user ID and username, optionally persisted to sqlite.
+    Entries older than ttl are still served but reported stale so the caller can refresh them
+    in the background, entries older than max_age are dropped.
+
+    :param max_size: the maximum number of profiles kept in memory
+    :param ttl: seconds before a profile is stale
+    :param max_age: seconds before a profile is no longer served at all
+    :param path: sqlite file backing the cache so a restart starts warm ("" for memory only)
+    :param flush_every: the number of changed profiles written to sqlite per commit
+    :param flush_interval: the maximum seconds a changed profile waits for its commit
+    """
+
+    def __init__(self, max_size: int, ttl: float, max_age: float, path: str = "",
+                 flush_every: int = 100, flush_interval: float = 5):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_age = max_age
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._by_id: OrderedDict = OrderedDict()
+        self._ids_by_username: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        # id -> row waiting for the next commit, written outside the cache lock
+        self._unsaved: Dict[str, Tuple[str, str, float, str]] = {}
+        self._flushed_at = time.monotonic()
+        self._db_lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS profiles (id TEXT PRIMARY KEY, username TEXT, fetched_at REAL, data TEXT)")
+            self._db.commit()
+            self._load()
+
+    def _load(self) -> None:
+        rows = self._db.execute(
+            "SELECT data, fetched_at FROM profiles WHERE fetched_at > ? ORDER BY fetched_at DESC LIMIT ?",
+            (time.time() - self.max_age, self.max_size)).fetchall()
+        for data, fetched_at in reversed(rows):
+            self._store(UserProfile.from_user(json.loads(data)), fetched_at)
+        logging.info(f"Loaded {len(rows)} cached user profiles")
+
+    def _store(self, profile: UserProfile, fetched_at: float) -> None:
+        old = self._by_id.pop(profile.id, None)
+        if old is not None:
+            self._ids_by_username.pop(old[0].username.lower(), None)
+        self._by_id[profile.id] = (profile, fetched_at)
+        self._ids_by_username[profile.username.lower()] = profile.id
+        while len(self._by_id) > self.max_size:
+            _, (evicted, _) = self._by_id.popitem(last=False)
+            self._ids_by_username.pop(evicted.username.lower(), None)
+
+    def get(self, user_id: Optional[str] = None, username: Optional[str] = None) -> Tuple[Optional[UserProfile], bool]:
+        """
+        Look up a cached profile by ID or username
+
+        :return: the profile (None on a miss) and whether it is still fresh
+        """
+        with self._lock:
+            if user_id is None and username is not None:
+                user_id = self._ids_by_username.get(username.lower())
+            entry = self._by_id.get(str(user_id)) if user_id is not None else None
+            age = time.time() - entry[1] if entry is not None else None
+            if entry is None or age > self.max_age:
+                mt.registry.inc("profile_cache_total", result="miss")
+                return None, False
+            self._by_id.move_to_end(str(user_id))
+        fresh = age <= self.ttl
+        mt.registry.inc("profile_cache_total", result="hit" if fresh else "stale")
+        return entry[0], fresh
+
+    def put(self, profile: UserProfile) -> None:
+        """
+        Store a freshly fetched profile in memory and queue it for sqlite.
+        A profile identical to a fresh cached one is skipped, the rest are committed in batches.
+        """
+        fetched_at = time.time()
+        with self._lock:
+            entry = self._by_id.get(profile.id)
+            if entry is not None and entry[0].raw == profile.raw and fetched_at - entry[1] <= self.ttl:
+                return
+            self._store(profile, fetched_at)
+            if self._db is None:
+                return
+            self._unsaved[profile.id] = (profile.id, profile.username, fetched_at, json.dumps(profile.raw))
+            due = (len(self._unsaved) >= self.flush_every
+                   or time.monotonic() - self._flushed_at >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Commit the profiles waiting to be written to sqlite
+        """
+        if self._db is None:
+            return
+        with self._db_lock:
+            with self._lock:
+                rows, self._unsaved = list(self._unsaved.values()), {}
+                self._flushed_at = time.monotonic()
+            if rows:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO profiles (id, username, fetched_at, data) VALUES (?, ?, ?, ?)", rows)
+                self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+
+mt.registry.describe("profile_cache_total", "User profile cache lookups by result (hit, stale, miss)")
+
+
+class UserResolver:
+    """
+    Batched user profile resolution by ID or username
+
+    :param fetch_by_ids: function calling the multi-ID user lookup (max 100 IDs)
+    :param fetch_by_usernames: function calling the multi-username user lookup (max 100 usernames)
+    :param max_batch: the maximum number of users per call
+    :param max_wait: the maximum seconds a user waits for its batch to fill
+    :param cache: profile cache consulted before any lookup - stale entries are served and refreshed in the background
+    """
+
+    def __init__(self,
+                 fetch_by_ids: Callable[[List[str]], Dict],
+                 fetch_by_usernames: Callable[[List[str]], Dict],
+                 max_batch: int = 100,
+                 max_wait: float = 0.2,
+                 cache: Optional[ProfileCache] = None):
+        self.cache = cache
+        self._refreshing: set = set()
+        self._by_id = pt.MicroBatcher(
+            lambda keys: split_user_lookup(keys, fetch_by_ids(keys), "id"),
+            max_batch, max_wait, name="user-lookup-by-id")
+        self._by_username = pt.MicroBatcher(
+            lambda keys: split_user_lookup(keys, fetch_by_usernames(keys), "username"),
+            max_batch, max_wait, name="user-lookup-by-username")
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _start(self) -> None:
+        with self._lock:
+            if not self._started:
+                self._by_id.start()
+                self._by_username.start()
+                self._started = True
+
+    def submit(self, user_id: Optional[str] = None, username: Optional[str] = None):
+        """
+        Queue a user for the next batch without blocking - by ID if given, otherwise by username
+
+        :return: future resolved with the UserProfile
+        """
+        self._start()
+        if user_id is not None:
+            return self._by_id.submit(str(user_id))
+        return self._by_username.submit(str(username))
+
+    def resolve(self, user_id: Optional[str] = None, username: Optional[str] = None) -> UserProfile:
+        """
+        Resolve one user from the cache, or batched with every other user being resolved at the same time
+        """
+        profile = self._cached(user_id, username)
+        if profile is not None:
+            return profile
+        return self._fetched(self.submit(user_id, username))
+
+    def resolve_many(self, users: List[Dict]) -> List[UserProfile]:
+        """
+        Resolve all users of a tweet at once - users that already carry the profile fields
+        or are cached are not looked up
+
+        :param users: user objects from the includes of a tweet
+        """
+        resolved = []
+        for user in users:
+            if has_profile_fields(user):
+                profile = UserProfile.from_user(user)
+                if self.cache is not None:
+                    self.cache.put(profile)
+                resolved.append(profile)
+            else:
+                resolved.append(self._cached(user.get("id"), user.get("username"))
+                                or self.submit(user.get("id"), user.get("username")))
+        return [item if isinstance(item, UserProfile) else self._fetched(item) for item in resolved]
+
+    def _cached(self, user_id: Optional[str], username: Optional[str]) -> Optional[UserProfile]:
+        if self.cache is None:
+            return None
+        profile, fresh = self.cache.get(user_id, username)
+        if profile is not None and not fresh:
+            self._refresh(profile)
+        return profile
+
+    def _fetched(self, future) -> UserProfile:
+        profile = future.result()
+        if self.cache is not None:
+            self.cache.put(profile)
+        return profile
+
+    def _refresh(self, profile: UserProfile) -> None:
+        """
+        Re-fetch a stale profile in the background without blocking the caller
+        """
+        with self._lock:
+            if profile.id in self._refreshing:
+                return
+            self._refreshing.add(profile.id)
+
+        def done(future):
+            with self._lock:
+                self._refreshing.discard(profile.id)
+            if future.exception() is None:
+                self.cache.put(future.result())
+            else:
+                logging.warning(f"Could not refresh profile of {profile.username}: {future.exception()}")
+
+        self.submit(user_id=profile.id).add_done_callback(done)
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._started:
+                self._by_id.stop()
+                self._by_username.stop()
+                self._started = False
+        if self.cache is not None:
+            self.cache.flush()
+
+
+def has_profile_fields(user: Dict) -> bool:
+    """
+    Whether a user object already carries the pfp and bio fields
+    """
+    return "profile_image_url" in user and "description" in user
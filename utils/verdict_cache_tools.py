@@ -0,0 +1,164 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from utils import match_tools as mat
+from utils import metrics_tools as mt
+
+'''
+Tools for remembering the pfp matching verdict of every avatar seen - contains functions for:
+    - Normalizing profile image urls so every size variant of an avatar shares one key
+    - Caching the verdict per collection (matched, best token, similarity tier) by url
+      and by the content hash of the image, optionally persisted to sqlite
+    - Dropping every verdict made against other references or matching settings
+
+A profile image url changes whenever its owner changes the avatar, so a url hit skips the
+download, decode and match entirely. A new url still gets a chance on the content hash once
+the image is downloaded, for an avatar re-uploaded unchanged.
+
+The size variants of an avatar share their verdict on purpose: every pfp is scaled down to
+Config.reference_size before it is matched, so a _normal (48x48) and a _400x400 copy get the same
+verdict except on the very edge of the similarity threshold. The stream only ever sees the
+_normal url, so in practice the verdict was made from the variant it is served for.
+'''
+
+# size variants Twitter serves the same avatar under: abc_normal.jpg, abc_400x400.jpg, ...
+_SIZE_SUFFIX = re.compile(r"_(normal|bigger|mini|reasonably_small|\d+x\d+)(?=\.\w+$)")
+
+
+def normalize_url(url: str) -> str:
+    """
+    The cache key of a profile image url - https, lowercase host, no size suffix, query or fragment.
+    Dropping the size suffix means a verdict made from one size variant is served for all of them.
+    """
+    parts = urlsplit(url.strip())
+    return urlunsplit(("https", parts.netloc.lower(), _SIZE_SUFFIX.sub("", parts.path), "", ""))
+
+
+class VerdictCache:
+    """
+    LRU cache of pfp verdicts keyed by normalized profile image url and by image content hash,
+    optionally persisted to sqlite. Verdicts older than max_age or made under another matcher
+    version (see match_tools.PfpMatcher.version) are not served.
+
+    :param max_size: the maximum number of keys kept in memory
+    :param max_age: seconds a verdict is served
+    :param version: the version of the matcher the verdicts are made by
+    :param path: sqlite file backing the cache so a restart starts warm ("" for memory only)
+    :param flush_every: the number of changed keys written to sqlite per commit
+    :param flush_interval: the maximum seconds a changed key waits for its commit
+    """
+
+    def __init__(self, max_size: int, max_age: float, version: str, path: str = "",
+                 flush_every: int = 100, flush_interval: float = 5):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.version = version
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._verdicts: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        # key -> row waiting for the next commit, written outside the cache lock
+        self._unsaved: Dict[str, Tuple[str, str, float, str]] = {}
+        self._flushed_at = time.monotonic()
+        self._db_lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, version TEXT, cached_at REAL, data TEXT)")
+            self._db.execute("DELETE FROM verdicts WHERE version != ?", (version,))
+            self._db.commit()
+            self._load()
+
+    def _load(self) -> None:
+        rows = self._db.execute(
+            "SELECT key, data, cached_at FROM verdicts WHERE version = ? AND cached_at > ? ORDER BY cached_at DESC LIMIT ?",
+            (self.version, time.time() - self.max_age, self.max_size)).fetchall()
+        for key, data, cached_at in reversed(rows):
+            self._store(key, json.loads(data), cached_at)
+        logging.info(f"Loaded {len(rows)} cached pfp verdicts")
+
+    def _store(self, key: str, data: Dict[str, Dict], cached_at: float) -> None:
+        self._verdicts[key] = (data, cached_at)
+        self._verdicts.move_to_end(key)
+        while len(self._verdicts) > self.max_size:
+            self._verdicts.popitem(last=False)
+
+    def _get(self, key: str) -> Optional[Dict[str, mat.PfpVerdict]]:
+        with self._lock:
+            entry = self._verdicts.get(key)
+            if entry is None or time.time() - entry[1] > self.max_age:
+                return None
+            self._verdicts.move_to_end(key)
+        return {collection: mat.PfpVerdict(**verdict) for collection, verdict in entry[0].items()}
+
+    def get_by_url(self, url: str) -> Optional[Dict[str, mat.PfpVerdict]]:
+        """
+        Look up the verdicts of a profile image url
+
+        :return: verdict per collection, None on a miss
+        """
+        verdicts = self._get("url:" + normalize_url(url))
+        if verdicts is not None:
+            mt.registry.inc("verdict_cache_total", result="url_hit")
+        return verdicts
+
+    def get_by_content(self, content_hash: str) -> Optional[Dict[str, mat.PfpVerdict]]:
+        """
+        Look up the verdicts of an image by the sha256 of its bytes (see image_cache_tools)
+
+        :return: verdict per collection, None on a miss
+        """
+        verdicts = self._get("content:" + content_hash)
+        mt.registry.inc("verdict_cache_total", result="miss" if verdicts is None else "content_hit")
+        return verdicts
+
+    def put(self, url: str, content_hash: str, verdicts: Dict[str, mat.PfpVerdict]) -> None:
+        """
+        Store the verdicts of an image under its url and its content hash in memory and queue them for sqlite,
+        committed in batches
+        """
+        data = {collection: asdict(verdict) for collection, verdict in verdicts.items()}
+        cached_at = time.time()
+        keys = ["url:" + normalize_url(url), "content:" + content_hash]
+        with self._lock:
+            for key in keys:
+                self._store(key, data, cached_at)
+            if self._db is None:
+                return
+            row_data = json.dumps(data)
+            for key in keys:
+                self._unsaved[key] = (key, self.version, cached_at, row_data)
+            due = (len(self._unsaved) >= self.flush_every
+                   or time.monotonic() - self._flushed_at >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Commit the verdicts waiting to be written to sqlite
+        """
+        if self._db is None:
+            return
+        with self._db_lock:
+            with self._lock:
+                rows, self._unsaved = list(self._unsaved.values()), {}
+                self._flushed_at = time.monotonic()
+            if rows:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO verdicts (key, version, cached_at, data) VALUES (?, ?, ?, ?)", rows)
+                self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._verdicts)
+
+
+mt.registry.describe("verdict_cache_total", "Pfp verdict cache lookups by result (url_hit, content_hit, miss)")